@@ -0,0 +1,170 @@
+import os
+import threading
+from collections import deque
+from datetime import date
+from typing import Any, Deque, Dict, List, Optional
+
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session as SASession
+from database import engine
+from models import ActivityLog
+
+# Append-only writer for the activity log.
+#
+# Request handlers call write_on_commit(): the entry is queued when their
+# transaction commits (and dropped on rollback). A background thread writes
+# queued entries in batches, one multi-row INSERT per batch in its own
+# transaction, so mutating endpoints pay no extra commit for logging.
+# Entries are lost only if the process is killed before the next flush (at
+# most ACTIVITY_LOG_FLUSH_INTERVAL seconds); shutdown flushes the queue.
+#
+# ACTIVITY_LOG_MODE=sync writes every entry immediately (tests, scripts).
+ACTIVITY_LOG_MODE = os.environ.get("ACTIVITY_LOG_MODE", "async").lower()
+ACTIVITY_LOG_QUEUE_SIZE = int(os.environ.get("ACTIVITY_LOG_QUEUE_SIZE", "10000"))
+ACTIVITY_LOG_BATCH_SIZE = int(os.environ.get("ACTIVITY_LOG_BATCH_SIZE", "500"))
+ACTIVITY_LOG_FLUSH_INTERVAL = float(os.environ.get("ACTIVITY_LOG_FLUSH_INTERVAL", "0.5"))
+
+# session.info key: entries waiting for their request transaction to commit
+_PENDING_ENTRIES = "activity_log_pending_entries"
+
+
+class ActivityLogWriter:
+    def __init__(
+        self,
+        synchronous: bool = False,
+        max_queue: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 0.5,
+    ):
+        self.synchronous = synchronous
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: Deque[Dict[str, Any]] = deque()
+        self._wakeup = threading.Condition()
+        # Held while a batch is taken and written, keeps entries in FIFO order
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.overflow_flushes = 0
+
+    @staticmethod
+    def _entry(action_type: str, description: str, details: Optional[str] = None) -> Dict[str, Any]:
+        return {
+            "timestamp": date.today(),
+            "action_type": action_type,
+            "description": description,
+            "details": details,
+        }
+
+    def write(self, action_type: str, description: str, details: Optional[str] = None):
+        self._enqueue(self._entry(action_type, description, details))
+
+    def write_on_commit(self, session, action_type: str, description: str, details: Optional[str] = None):
+        """Queues the entry when session commits; dropped if it rolls back."""
+        session.info.setdefault(_PENDING_ENTRIES, []).append(self._entry(action_type, description, details))
+
+    def _enqueue(self, entry: Dict[str, Any]):
+        if self.synchronous:
+            self._insert([entry])
+            return
+
+        if len(self._pending) >= self.max_queue:
+            # Queue is full (database slow or down): apply back-pressure to the caller
+            self.overflow_flushes += 1
+            self.flush()
+        with self._wakeup:
+            self._pending.append(entry)
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.notify()
+        self._ensure_started()
+
+    def flush(self):
+        """Writes everything queued so far (called before reading or wiping the log)."""
+        with self._flush_lock:
+            while True:
+                with self._wakeup:
+                    batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                if not batch:
+                    return
+                self._insert(batch)
+
+    def _insert(self, batch: List[Dict[str, Any]]):
+        try:
+            with engine.begin() as connection:
+                connection.execute(insert(ActivityLog).values(batch))
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            # Same policy as before: a failed log write never breaks the request
+            self.failed += len(batch)
+            print(f"Failed to write {len(batch)} activity log entries: {e}")
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._wakeup:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="activity-log-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                if not self._pending and not self._stopping:
+                    self._wakeup.wait(self.flush_interval)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    def stop(self, timeout: float = 10.0):
+        """Flushes the queue and stops the background thread (app shutdown)."""
+        thread = self._thread
+        if thread is not None:
+            with self._wakeup:
+                self._stopping = True
+                self._wakeup.notify()
+            thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": "sync" if self.synchronous else "async",
+            "queued": len(self._pending),
+            "written": self.written,
+            "batches": self.batches,
+            "failed": self.failed,
+            "overflow_flushes": self.overflow_flushes,
+            "max_queue": self.max_queue,
+        }
+
+
+activity_log_writer = ActivityLogWriter(
+    synchronous=ACTIVITY_LOG_MODE == "sync",
+    max_queue=ACTIVITY_LOG_QUEUE_SIZE,
+    batch_size=ACTIVITY_LOG_BATCH_SIZE,
+    flush_interval=ACTIVITY_LOG_FLUSH_INTERVAL,
+)
+
+
+def _enqueue_after_commit(session):
+    if session.in_nested_transaction():
+        return
+    for entry in session.info.pop(_PENDING_ENTRIES, None) or ():
+        activity_log_writer._enqueue(entry)
+
+
+def _drop_after_rollback(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop(_PENDING_ENTRIES, None)
+
+
+event.listen(SASession, "after_commit", _enqueue_after_commit)
+event.listen(SASession, "after_soft_rollback", _drop_after_rollback)
@@ -1,6 +1,10 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
+import asyncio
+import hashlib
 import os
+import threading
 from jose import JWTError, jwt
 import bcrypt  # Use direct bcrypt instead of passlib
 from fastapi import Depends, HTTPException, status
@@ -8,12 +12,28 @@ from fastapi.security import OAuth2PasswordBearer
 from sqlmodel import Session, select
 from database import get_session
 from models import User
+from auth_cache import auth_user_cache
 
 # Secret key for JWT encoding/decoding.
 # Must be set via environment variable in production.
 SECRET_KEY = os.environ.get("SECRET_KEY", "dev-only-unsafe-secret-change-me")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 1 week session
+# Put a short user-version claim ("uv") into new tokens. Tokens issued before
+# a password change stop working, and cached users that predate the token are
+# detected without a query. Tokens without the claim stay valid.
+TOKEN_USER_VERSION_ENABLED = os.environ.get("TOKEN_USER_VERSION", "true").lower() in {"1", "true", "yes"}
+
+# bcrypt cost factor for new hashes (existing hashes keep their own cost).
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+
+# Password hashing runs on a small dedicated pool, so a burst of logins cannot
+# take over the request threadpool. bcrypt releases the GIL, so threads are
+# enough; PASSWORD_EXECUTOR=process moves the work to separate processes.
+PASSWORD_EXECUTOR = os.environ.get("PASSWORD_EXECUTOR", "thread").lower()
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Password checks allowed to wait for the pool; beyond that requests get 503.
+PASSWORD_MAX_PENDING = int(os.environ.get("PASSWORD_MAX_PENDING", "64"))
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -26,9 +46,66 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     # bcrypt requires bytes
     pwd_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
     return bcrypt.hashpw(pwd_bytes, salt).decode('utf-8')
 
+_password_executor: Optional[Executor] = None
+_password_lock = threading.Lock()
+_password_pending = 0
+
+def _get_password_executor() -> Executor:
+    global _password_executor
+    with _password_lock:
+        if _password_executor is None:
+            if PASSWORD_EXECUTOR == "process":
+                _password_executor = ProcessPoolExecutor(max_workers=PASSWORD_WORKERS)
+            else:
+                _password_executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="password")
+        return _password_executor
+
+async def _run_password_job(func, *args):
+    global _password_pending
+    with _password_lock:
+        if _password_pending >= PASSWORD_MAX_PENDING:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many password checks in progress, try again",
+                headers={"Retry-After": "1"},
+            )
+        _password_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_password_executor(), func, *args)
+    finally:
+        with _password_lock:
+            _password_pending -= 1
+
+async def verify_password_async(plain_password, hashed_password) -> bool:
+    return await _run_password_job(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password) -> str:
+    return await _run_password_job(get_password_hash, password)
+
+def shutdown_password_executor():
+    global _password_executor
+    with _password_lock:
+        executor, _password_executor = _password_executor, None
+    if executor is not None:
+        # Queued checks belong to requests that are being dropped anyway
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def password_pool_stats() -> dict:
+    return {
+        "executor": PASSWORD_EXECUTOR,
+        "workers": PASSWORD_WORKERS,
+        "pending": _password_pending,
+        "max_pending": PASSWORD_MAX_PENDING,
+        "bcrypt_rounds": BCRYPT_ROUNDS,
+    }
+
+def user_token_version(user: User) -> str:
+    """Compact version of the user's credentials for the "uv" token claim."""
+    return hashlib.sha256(f"{user.id}:{user.password_hash}".encode("utf-8")).hexdigest()[:8]
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -40,7 +117,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
+def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session, scope="function")):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -53,10 +130,22 @@ def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Dep
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-        
+    token_version = payload.get("uv")
+
+    # Cached snapshot: attach to this session without a query
+    cached = auth_user_cache.get(token, token_version)
+    if cached is not None:
+        return session.merge(cached, load=False)
+
+    generation = auth_user_cache.begin()
     user = session.exec(select(User).where(User.username == username)).first()
     if user is None:
         raise credentials_exception
+    version = user_token_version(user)
+    if token_version is not None and token_version != version:
+        # Password changed after the token was issued
+        raise credentials_exception
+    auth_user_cache.put(token, user, version, generation)
     return user
 
 def get_current_active_user(current_user: User = Depends(get_current_user)):
@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as SASession, make_transient_to_detached
+from models import User
+
+# In-process cache of authenticated users, keyed by bearer token.
+#
+# get_current_user would otherwise decode the JWT and select the user on
+# every request. Entries hold a detached, read-only copy of the User row and
+# expire after AUTH_USER_CACHE_TTL seconds, which bounds staleness between
+# gunicorn workers. Inside one worker, ORM changes to a user (update, delete,
+# password change) drop that user's entries right after commit. Bulk SQL
+# paths (restore) call invalidate_all().
+AUTH_USER_CACHE_ENABLED = os.environ.get("AUTH_USER_CACHE_ENABLED", "true").lower() in {"1", "true", "yes"}
+AUTH_USER_CACHE_TTL = float(os.environ.get("AUTH_USER_CACHE_TTL", "30"))
+AUTH_USER_CACHE_MAX_SIZE = int(os.environ.get("AUTH_USER_CACHE_MAX_SIZE", "5000"))
+
+# session.info key: users changed in the current transaction
+_CHANGED_USER_IDS = "auth_cache_changed_user_ids"
+
+
+def user_snapshot(user: User) -> User:
+    """Detached copy with every column loaded; merge(load=False) into a session to use it."""
+    snapshot = User(**{column.key: getattr(user, column.key) for column in User.__table__.columns})
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+
+class AuthUserCache:
+    def __init__(self, enabled: bool = True, ttl: float = 30.0, max_size: int = 5000):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # token -> (user id, user version, stored_at, snapshot)
+        self._entries: Dict[str, Tuple[int, Optional[str], float, User]] = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.invalidations = 0
+
+    def begin(self) -> int:
+        """Pass to put() so users read before an invalidation are not stored."""
+        return self._generation
+
+    def get(self, token: str, token_version: Optional[str] = None) -> Optional[User]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                _, version, stored_at, snapshot = entry
+                if time.monotonic() - stored_at >= self.ttl:
+                    del self._entries[token]
+                elif token_version is not None and token_version != version:
+                    # Token was issued for other credentials than the cached row
+                    self.stale += 1
+                    del self._entries[token]
+                else:
+                    self.hits += 1
+                    return snapshot
+            self.misses += 1
+            return None
+
+    def put(self, token: str, user: User, version: Optional[str], generation: Optional[int] = None):
+        if not self.enabled or user.id is None:
+            return
+        snapshot = user_snapshot(user)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            if len(self._entries) >= self.max_size and token not in self._entries:
+                # Drop the oldest entry (dicts keep insertion order).
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[token] = (user.id, version, time.monotonic(), snapshot)
+
+    def invalidate_users(self, user_ids):
+        user_ids = set(user_ids)
+        with self._lock:
+            self._generation += 1
+            for token in [t for t, entry in self._entries.items() if entry[0] in user_ids]:
+                del self._entries[token]
+                self.invalidations += 1
+
+    def invalidate_all(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "stale_versions": self.stale,
+                "invalidations": self.invalidations,
+                "ttl_seconds": self.ttl,
+            }
+
+
+auth_user_cache = AuthUserCache(
+    enabled=AUTH_USER_CACHE_ENABLED,
+    ttl=AUTH_USER_CACHE_TTL,
+    max_size=AUTH_USER_CACHE_MAX_SIZE,
+)
+
+
+def _collect_user_changes(session, flush_context, instances):
+    changed = [obj.id for obj in list(session.dirty) + list(session.deleted) if isinstance(obj, User)]
+    if changed:
+        session.info.setdefault(_CHANGED_USER_IDS, set()).update(changed)
+
+
+def _invalidate_after_commit(session):
+    if session.in_nested_transaction():
+        return
+    user_ids = session.info.pop(_CHANGED_USER_IDS, None)
+    if user_ids:
+        auth_user_cache.invalidate_users(user_ids)
+
+
+def _reset_after_rollback(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop(_CHANGED_USER_IDS, None)
+
+
+event.listen(SASession, "before_flush", _collect_user_changes)
+event.listen(SASession, "after_commit", _invalidate_after_commit)
+event.listen(SASession, "after_soft_rollback", _reset_after_rollback)
@@ -0,0 +1,388 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import zlib
+from datetime import date, datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import Date, DateTime, delete, insert, select, text
+from sqlmodel import Session
+from database import engine
+from models import User, Order, Deduction, ActivityLog, OrderFile
+from payments import Payment, PaymentAllocation
+
+# Backup file sections in restore order (parents first)
+BACKUP_TABLES = [
+    ("users", User),
+    ("orders", Order),
+    ("payments", Payment),
+    ("allocations", PaymentAllocation),
+    ("deductions", Deduction),
+    ("activity_logs", ActivityLog),
+    ("order_files", OrderFile),
+]
+BACKUP_VERSION = "1.1"
+
+BACKUP_GZIP_LEVEL = int(os.environ.get("BACKUP_GZIP_LEVEL", "6"))
+BACKUP_FETCH_SIZE = int(os.environ.get("BACKUP_FETCH_SIZE", "1000"))
+BACKUP_CHUNK_SIZE = 64 * 1024
+RESTORE_BATCH_SIZE = int(os.environ.get("RESTORE_BATCH_SIZE", "1000"))
+
+
+def _json_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def row_json(row: Dict[str, Any]) -> str:
+    """Canonical JSON of one row; the checksum is computed over these strings."""
+    return json.dumps(row, ensure_ascii=False, separators=(",", ":"))
+
+
+class BackupService:
+    """
+    Потоковий експорт бази для /admin/backup.
+
+    Формат той самий, що й раніше ({"timestamp", "version", "data": {...}}),
+    плюс трейлер після "data": кількість рядків по таблицях і sha256 по
+    канонічному JSON кожного рядка (row_json + "\\n", у порядку файлу).
+    Рядки читаються пачками (yield_per, серверний курсор на Postgres) і
+    одразу стискаються gzip, тож пам'ять не залежить від розміру бази.
+    """
+
+    @staticmethod
+    def iter_json() -> Iterator[str]:
+        checksum = hashlib.sha256()
+        row_counts = {}
+        with engine.connect() as connection:
+            if connection.dialect.name == "postgresql":
+                # One snapshot for all tables
+                connection = connection.execution_options(isolation_level="REPEATABLE READ")
+            else:
+                # pysqlite starts transactions lazily; a read transaction
+                # keeps one WAL snapshot for all tables
+                connection.exec_driver_sql("BEGIN")
+
+            yield '{"timestamp":%s,"version":%s,"data":{' % (
+                json.dumps(datetime.now().isoformat()), json.dumps(BACKUP_VERSION),
+            )
+            for index, (section, model) in enumerate(BACKUP_TABLES):
+                table = model.__table__
+                keys = [column.key for column in table.columns]
+                yield ('' if index == 0 else ',') + json.dumps(section) + ':['
+                count = 0
+                result = connection.execute(
+                    select(table).order_by(*table.primary_key.columns).execution_options(yield_per=BACKUP_FETCH_SIZE)
+                )
+                for row in result:
+                    line = row_json({key: _json_value(value) for key, value in zip(keys, row)})
+                    checksum.update(line.encode("utf-8"))
+                    checksum.update(b"\n")
+                    yield ('' if count == 0 else ',') + line
+                    count += 1
+                row_counts[section] = count
+                yield ']'
+            connection.rollback()
+
+        yield '},"row_counts":%s,"checksum":%s}' % (
+            json.dumps(row_counts),
+            json.dumps({"algorithm": "sha256", "value": checksum.hexdigest()}),
+        )
+
+    @staticmethod
+    def iter_gzip(level: int = BACKUP_GZIP_LEVEL) -> Iterator[bytes]:
+        """iter_json() through a gzip stream, yielded in ~64 KiB pieces."""
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        pending = []
+        pending_size = 0
+        for text in BackupService.iter_json():
+            pending.append(text)
+            pending_size += len(text)
+            if pending_size >= BACKUP_CHUNK_SIZE:
+                chunk = compressor.compress("".join(pending).encode("utf-8"))
+                pending, pending_size = [], 0
+                if chunk:
+                    yield chunk
+        yield compressor.compress("".join(pending).encode("utf-8")) + compressor.flush()
+
+
+class BackupFormatError(ValueError):
+    pass
+
+
+class _JsonReader:
+    """Reads a JSON text stream piece by piece; values are decoded one at a time."""
+
+    def __init__(self, stream, chunk_size: int = BACKUP_CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+        self.last_text = ""  # source text of the last value()
+
+    def _fill(self) -> bool:
+        try:
+            chunk = self.stream.read(self.chunk_size)
+        except (EOFError, zlib.error, gzip.BadGzipFile, UnicodeDecodeError) as e:
+            # Truncated or damaged .gz, or not UTF-8: the file is bad, not the server
+            raise BackupFormatError(f"Damaged backup file: {e}") from e
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise BackupFormatError("Unexpected end of backup file")
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise BackupFormatError(f"Expected {char!r}, found {self.buffer[self.pos:self.pos + 20]!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                if self._fill():
+                    continue
+                raise BackupFormatError(f"Invalid JSON in backup file: {e}")
+            # A number at the end of the buffer may continue in the next piece
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.last_text = self.buffer[self.pos:end]
+            self.pos = end
+            return value
+
+    def members(self) -> Iterator[str]:
+        """Keys of an object; the caller reads each value before the next key."""
+        self.expect("{")
+        if self.peek() != "}":
+            while True:
+                key = self.value()
+                if not isinstance(key, str):
+                    raise BackupFormatError("Object key expected")
+                self.expect(":")
+                yield key
+                if self.peek() != ",":
+                    break
+                self.pos += 1
+        self.expect("}")
+
+    def items(self) -> Iterator[Any]:
+        self.expect("[")
+        if self.peek() != "]":
+            while True:
+                yield self.value()
+                if self.peek() != ",":
+                    break
+                self.pos += 1
+        self.expect("]")
+
+
+def iter_backup(stream) -> Iterator[Tuple[str, str, Any]]:
+    """
+    Events of a backup file without loading it: ("row", section, row, text)
+    for each row of data (text is the row as written in the file),
+    ("meta", key, value, None) for everything else.
+    """
+    reader = _JsonReader(stream)
+    for key in reader.members():
+        if key != "data":
+            yield "meta", key, reader.value(), None
+            continue
+        for section in reader.members():
+            if reader.peek() != "[":
+                yield "meta", f"data.{section}", reader.value(), None
+                continue
+            for row in reader.items():
+                yield "row", section, row, reader.last_text
+
+
+def open_backup(fileobj) -> io.TextIOWrapper:
+    """Text stream of an uploaded backup; gzip files are decompressed on the fly."""
+    magic = fileobj.read(2)
+    fileobj.seek(0)
+    if magic == b"\x1f\x8b":
+        fileobj = gzip.GzipFile(fileobj=fileobj, mode="rb")
+    return io.TextIOWrapper(fileobj, encoding="utf-8")
+
+
+def _parse_date(value):
+    if not value or not isinstance(value, str):
+        return value or None
+    try:
+        # "YYYY-MM-DD" and full ISO timestamps
+        return datetime.fromisoformat(value).date()
+    except ValueError:
+        return None
+
+
+def _parse_datetime(value):
+    if not value or not isinstance(value, str):
+        return value or None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+class _TableLoader:
+    """Typed rows for one table: defaults for missing fields, dates parsed in one pass."""
+
+    def __init__(self, model):
+        self.table = model.__table__
+        self.columns = []
+        for column in self.table.columns:
+            if isinstance(column.type, DateTime):
+                convert = _parse_datetime
+            elif isinstance(column.type, Date):
+                convert = _parse_date
+            else:
+                convert = None
+            self.columns.append((column.key, convert, model.model_fields.get(column.key)))
+
+    def row(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        row = {}
+        for key, convert, field in self.columns:
+            if key in item:
+                value = item[key]
+                row[key] = convert(value) if convert is not None else value
+            elif field is not None and not field.is_required():
+                row[key] = field.get_default(call_default_factory=True)
+            else:
+                row[key] = None
+        return row
+
+
+class RestoreProgress:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: Dict[str, Any] = {"state": "idle"}
+
+    def update(self, **values):
+        with self._lock:
+            self._state.update(values)
+
+    def reset(self, **values):
+        with self._lock:
+            self._state = dict(values)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._state)
+
+
+restore_progress = RestoreProgress()
+
+
+class RestoreService:
+    """
+    Потокове відновлення для /admin/restore.
+
+    Файл (JSON або gzip) розбирається по рядку, рядки типізуються одним
+    проходом і вставляються пачками (executemany) у транзакції запиту.
+    Секції мають іти від батьківських таблиць до дочірніх, як їх пише
+    BackupService. Після вставки послідовності id на Postgres виставляються
+    за максимальними id, тож fix_seq.py більше не потрібен.
+    """
+
+    @staticmethod
+    def clear(session: Session):
+        # Child tables first (foreign keys)
+        from models import OrderFinancials
+        for model in (PaymentAllocation, Deduction, OrderFile, ActivityLog, Payment, OrderFinancials, Order, User):
+            session.exec(delete(model))
+
+    @staticmethod
+    def restore(session: Session, fileobj, batch_size: int = RESTORE_BATCH_SIZE) -> Dict[str, Any]:
+        started = time.perf_counter()
+        loaders = {section: _TableLoader(model) for section, model in BACKUP_TABLES}
+        connection = session.connection()
+        row_counts = {section: 0 for section, _ in BACKUP_TABLES}
+        meta: Dict[str, Any] = {}
+        checksum = hashlib.sha256()
+        batch: List[Dict[str, Any]] = []
+        batch_section: Optional[str] = None
+        restore_progress.reset(state="running", section=None, rows=0, started_at=datetime.utcnow().isoformat())
+
+        def write_batch():
+            if batch:
+                connection.execute(insert(loaders[batch_section].table), batch)
+                batch.clear()
+                restore_progress.update(section=batch_section, rows=sum(row_counts.values()))
+
+        try:
+            RestoreService.clear(session)
+            for kind, key, value, row_text in iter_backup(open_backup(fileobj)):
+                if kind == "meta":
+                    meta[key] = value
+                    continue
+                loader = loaders.get(key)
+                if loader is None:
+                    continue
+                if not isinstance(value, dict):
+                    raise BackupFormatError(f"Row of {key} is not an object")
+                # BackupService writes each row as row_json(), so the file text is hashed as is
+                checksum.update(row_text.encode("utf-8"))
+                checksum.update(b"\n")
+                if key != batch_section:
+                    write_batch()
+                    if batch_section is not None:
+                        print(f"Restore: {batch_section} {row_counts[batch_section]} rows")
+                    batch_section = key
+                batch.append(loader.row(value))
+                row_counts[key] += 1
+                if len(batch) >= batch_size:
+                    write_batch()
+            write_batch()
+            if batch_section is not None:
+                print(f"Restore: {batch_section} {row_counts[batch_section]} rows")
+
+            expected_counts = meta.get("row_counts")
+            if isinstance(expected_counts, dict):
+                for section, count in expected_counts.items():
+                    if section in row_counts and row_counts[section] != count:
+                        raise BackupFormatError(f"{section}: {row_counts[section]} rows, trailer says {count}")
+            expected_checksum = meta.get("checksum")
+            if isinstance(expected_checksum, dict) and expected_checksum.get("value") != checksum.hexdigest():
+                raise BackupFormatError("Checksum mismatch, the backup file is damaged")
+
+            RestoreService.reset_sequences(connection)
+        except Exception as e:
+            restore_progress.update(state="failed", error=str(e))
+            raise
+
+        seconds = time.perf_counter() - started
+        restore_progress.update(state="done", section=None, rows=sum(row_counts.values()), seconds=round(seconds, 3))
+        return {"version": meta.get("version"), "timestamp": meta.get("timestamp"), "rows": row_counts, "seconds": seconds}
+
+    @staticmethod
+    def reset_sequences(connection):
+        """Postgres: next id of every table after the largest restored id."""
+        if connection.dialect.name != "postgresql":
+            return
+        preparer = connection.dialect.identifier_preparer
+        for _, model in BACKUP_TABLES:
+            table_name = preparer.format_table(model.__table__)
+            connection.execute(
+                text(
+                    f"SELECT setval(pg_get_serial_sequence(:table_name, 'id'), COALESCE(MAX(id), 0) + 1, false) "
+                    f"FROM {table_name}"
+                ),
+                {"table_name": table_name},
+            )
@@ -0,0 +1,93 @@
+"""
+Login storm benchmark: login throughput and latency of other endpoints
+while many users log in at once (shift start).
+
+Usage (against a running server):
+    python bench_login.py --url http://127.0.0.1:8000 --username admin --password admin
+    python bench_login.py --logins 16 --probes 4 --duration 20
+
+Login workers post to /token in a loop; probe workers call GET /users/me
+with a token obtained up front and report p50/p99 latency.
+"""
+import argparse
+import threading
+import time
+
+import requests
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(url, username, password, logins, probes, duration):
+    login_data = {"username": username, "password": password}
+    response = requests.post(f"{url}/token", data=login_data, timeout=30)
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    stop_at = time.perf_counter() + duration
+    lock = threading.Lock()
+    login_times, probe_times = [], []
+    errors = {"login": {}, "probe": {}}
+
+    def record_error(kind, reason):
+        errors[kind][reason] = errors[kind].get(reason, 0) + 1
+
+    def login_worker():
+        http = requests.Session()
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            try:
+                reason = http.post(f"{url}/token", data=login_data, timeout=30).status_code
+            except requests.RequestException as e:
+                reason = type(e).__name__
+            with lock:
+                if reason == 200:
+                    login_times.append(time.perf_counter() - started)
+                else:
+                    record_error("login", reason)
+
+    def probe_worker():
+        http = requests.Session()
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            try:
+                reason = http.get(f"{url}/users/me", headers=headers, timeout=30).status_code
+            except requests.RequestException as e:
+                reason = type(e).__name__
+            with lock:
+                if reason == 200:
+                    probe_times.append(time.perf_counter() - started)
+                else:
+                    record_error("probe", reason)
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=login_worker) for _ in range(logins)]
+    threads += [threading.Thread(target=probe_worker) for _ in range(probes)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print(f"Login workers: {logins}, probe workers: {probes}, duration: {duration:.0f} s")
+    print(f"Logins: {len(login_times)} ok, {sum(errors['login'].values())} failed {errors['login'] or ''}, {len(login_times) / duration:.1f}/s")
+    print(f"  login latency p50={percentile(login_times, 50) * 1000:.0f} ms p99={percentile(login_times, 99) * 1000:.0f} ms")
+    print(f"Probes (GET /users/me): {len(probe_times)} ok, {sum(errors['probe'].values())} failed {errors['probe'] or ''}")
+    print(f"  probe latency p50={percentile(probe_times, 50) * 1000:.1f} ms p99={percentile(probe_times, 99) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin")
+    parser.add_argument("--logins", type=int, default=16, help="concurrent login workers")
+    parser.add_argument("--probes", type=int, default=4, help="concurrent probe workers")
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds")
+    args = parser.parse_args()
+    run(args.url, args.username, args.password, args.logins, args.probes, args.duration)
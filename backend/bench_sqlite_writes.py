@@ -0,0 +1,111 @@
+"""
+SQLite write benchmark: several worker processes (like gunicorn workers)
+commit small transactions into one database file.
+
+Usage:
+    python bench_sqlite_writes.py                      # default vs tuned
+    python bench_sqlite_writes.py --mode tuned --workers 8 --duration 20
+
+Each transaction reads an order, updates it and appends an activity log
+entry, roughly what a mutating endpoint does. "default" uses SQLite defaults
+(rollback journal, synchronous=FULL); "tuned" applies the pragmas from
+sqlite_tuning.py (SQLITE_* environment variables are honoured). The
+benchmark uses a fresh temporary database, never database.db.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from datetime import date
+
+from sqlalchemy import create_engine, insert, select, update
+from sqlmodel import SQLModel
+
+from models import ActivityLog, Order, User
+from sqlite_tuning import SQLITE_PRAGMAS, SQLiteTuning
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def make_engine(path, mode):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    if mode == "tuned":
+        SQLiteTuning(enabled=True, pragmas=SQLITE_PRAGMAS).install(engine)
+    return engine
+
+
+def worker(path, mode, worker_id, orders, stop_at, results):
+    engine = make_engine(path, mode)
+    latencies, errors = [], {}
+    n = 0
+    while time.time() < stop_at:
+        order_id = (worker_id * 7919 + n) % orders + 1
+        n += 1
+        started = time.perf_counter()
+        try:
+            with engine.begin() as connection:
+                price = connection.execute(select(Order.price).where(Order.id == order_id)).scalar() or 0.0
+                connection.execute(update(Order).where(Order.id == order_id).values(price=price + 1))
+                connection.execute(insert(ActivityLog).values(
+                    timestamp=date.today(), action_type="BENCH", description=f"worker {worker_id} order {order_id}",
+                ))
+            latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            reason = str(getattr(e, "orig", e)).splitlines()[0][:60]
+            errors[reason] = errors.get(reason, 0) + 1
+    engine.dispose()
+    results.put((latencies, errors))
+
+
+def run(mode, workers, duration, orders, base_dir=None):
+    directory = tempfile.mkdtemp(prefix="bench_sqlite_", dir=base_dir)
+    path = os.path.join(directory, "bench.db")
+    engine = make_engine(path, mode)
+    SQLModel.metadata.create_all(engine, tables=[User.__table__, Order.__table__, ActivityLog.__table__])
+    with engine.begin() as connection:
+        connection.execute(insert(Order), [
+            {"name": f"Bench {i}", "price": 1000.0, "date_received": date.today()} for i in range(orders)
+        ])
+    engine.dispose()
+
+    results = multiprocessing.Queue()
+    stop_at = time.time() + duration
+    processes = [
+        multiprocessing.Process(target=worker, args=(path, mode, i, orders, stop_at, results))
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    latencies, errors = [], {}
+    for _ in processes:
+        worker_latencies, worker_errors = results.get()
+        latencies += worker_latencies
+        for reason, count in worker_errors.items():
+            errors[reason] = errors.get(reason, 0) + count
+    for process in processes:
+        process.join()
+
+    print(f"[{mode}] workers: {workers}, duration: {duration:.0f} s")
+    print(f"  commits: {len(latencies)} ok ({len(latencies) / duration:.0f}/s), {sum(errors.values())} failed {errors or ''}")
+    print(f"  commit latency p50={percentile(latencies, 50) * 1000:.1f} ms p99={percentile(latencies, 99) * 1000:.1f} ms")
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["default", "tuned", "both"], default="both")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent writer processes")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per mode")
+    parser.add_argument("--orders", type=int, default=1000, help="orders in the benchmark database")
+    parser.add_argument("--dir", default=None, help="where to create the database (same disk as production for realistic fsync cost)")
+    args = parser.parse_args()
+    for mode in (["default", "tuned"] if args.mode == "both" else [args.mode]):
+        run(mode, args.workers, args.duration, args.orders, args.dir)
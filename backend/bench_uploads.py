@@ -0,0 +1,122 @@
+"""
+Upload benchmark: throughput of concurrent file uploads and latency of
+other endpoints while they run (several drawings uploaded at once).
+
+Usage (against a running server):
+    python bench_uploads.py --url http://127.0.0.1:8000 --order-id 1
+    python bench_uploads.py --uploads 8 --size-mb 50 --probes 4 --duration 30
+
+Upload workers post a --size-mb file to /orders/{id}/upload in a loop (the
+files are written into the order's folder under one name per worker);
+probe workers call GET /users/me and report p50/p99 latency, which shows
+how much the uploads block the event loop.
+"""
+import argparse
+import os
+import threading
+import time
+
+import requests
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def multipart_body(filename, payload):
+    # Built once per worker, so the client spends no CPU per request
+    boundary = f"bench{os.urandom(8).hex()}"
+    head = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: application/octet-stream\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+    return head + payload + tail, f"multipart/form-data; boundary={boundary}"
+
+
+def run(url, username, password, order_id, category, uploads, size_mb, probes, duration):
+    response = requests.post(f"{url}/token", data={"username": username, "password": password}, timeout=30)
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    payload = os.urandom(int(size_mb * 1024 * 1024))
+
+    stop_at = time.perf_counter() + duration
+    lock = threading.Lock()
+    upload_times, probe_times = [], []
+    errors = {"upload": {}, "probe": {}}
+
+    def record_error(kind, reason):
+        errors[kind][reason] = errors[kind].get(reason, 0) + 1
+
+    def upload_worker(worker_id):
+        http = requests.Session()
+        body, content_type = multipart_body(f"bench_upload_{worker_id}.bin", payload)
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            try:
+                reason = http.post(
+                    f"{url}/orders/{order_id}/upload",
+                    params={"folder_category": category},
+                    data=body,
+                    headers={**headers, "Content-Type": content_type},
+                    timeout=300,
+                ).status_code
+            except requests.RequestException as e:
+                reason = type(e).__name__
+            with lock:
+                if reason == 200:
+                    upload_times.append(time.perf_counter() - started)
+                else:
+                    record_error("upload", reason)
+
+    def probe_worker():
+        http = requests.Session()
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            try:
+                reason = http.get(f"{url}/users/me", headers=headers, timeout=30).status_code
+            except requests.RequestException as e:
+                reason = type(e).__name__
+            with lock:
+                if reason == 200:
+                    probe_times.append(time.perf_counter() - started)
+                else:
+                    record_error("probe", reason)
+            time.sleep(0.01)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=upload_worker, args=(i,)) for i in range(uploads)]
+    threads += [threading.Thread(target=probe_worker) for _ in range(probes)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    print(f"Upload workers: {uploads} x {size_mb:g} MB, probe workers: {probes}, duration: {elapsed:.0f} s")
+    print(f"Uploads: {len(upload_times)} ok, {sum(errors['upload'].values())} failed {errors['upload'] or ''}, "
+          f"{len(upload_times) * size_mb / elapsed:.1f} MB/s")
+    print(f"  upload latency p50={percentile(upload_times, 50) * 1000:.0f} ms p99={percentile(upload_times, 99) * 1000:.0f} ms")
+    print(f"Probes (GET /users/me): {len(probe_times)} ok, {sum(errors['probe'].values())} failed {errors['probe'] or ''}")
+    print(f"  probe latency p50={percentile(probe_times, 50) * 1000:.1f} ms p99={percentile(probe_times, 99) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin")
+    parser.add_argument("--order-id", type=int, default=1)
+    parser.add_argument("--category", default="Креслення", help="project subfolder")
+    parser.add_argument("--uploads", type=int, default=4, help="concurrent upload workers")
+    parser.add_argument("--size-mb", type=float, default=20.0, help="file size per upload")
+    parser.add_argument("--probes", type=int, default=4, help="concurrent probe workers")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    args = parser.parse_args()
+    run(args.url, args.username, args.password, args.order_id, args.category,
+        args.uploads, args.size_mb, args.probes, args.duration)
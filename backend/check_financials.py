@@ -0,0 +1,35 @@
+"""
+Consistency check for the materialized order_financials table.
+
+Usage:
+    python check_financials.py          # report only
+    python check_financials.py --fix    # rewrite mismatching rows
+"""
+import sys
+from sqlmodel import Session
+from database import engine
+from financials_service import OrderFinancialsService
+
+
+def check_financials(fix: bool = False):
+    with Session(engine) as session:
+        report = OrderFinancialsService.check_consistency(session, fix=fix)
+        if fix:
+            session.commit()
+
+        print(f"Checked orders: {report['checked']}")
+        print(f"Missing rows: {report['missing']}")
+        print(f"Orphaned rows: {report['orphaned']}")
+        print(f"Mismatches: {len(report['mismatches'])}")
+        for item in report["mismatches"]:
+            print(f"  Order #{item['order_id']} {item['field']}: stored={item['stored']:.2f} expected={item['expected']:.2f}")
+
+        if report["consistent"]:
+            print("OK: order_financials is consistent.")
+        elif fix:
+            print("Fixed.")
+        return report
+
+
+if __name__ == "__main__":
+    check_financials(fix="--fix" in sys.argv)
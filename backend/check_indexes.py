@@ -0,0 +1,116 @@
+"""
+Checks that the hot queries are served by their indexes (EXPLAIN-based).
+
+Usage:
+    python check_indexes.py
+
+Exits with status 1 if any query does not use the expected index.
+"""
+import sys
+from sqlalchemy import text
+from sqlmodel import Session
+from database import engine
+
+# (description, query, expected index)
+HOT_QUERIES = [
+    (
+        "Unpaid deductions of one order (manager)",
+        "SELECT COALESCE(SUM(amount), 0) FROM deduction "
+        "WHERE order_id = 1 AND is_paid = FALSE AND target_role = 'manager'",
+        "ix_deduction_unpaid_order_role",
+    ),
+    (
+        "Unpaid deductions grouped by order and role",
+        "SELECT order_id, target_role, COALESCE(SUM(amount), 0) FROM deduction "
+        "WHERE is_paid = FALSE AND order_id IN (1, 2, 3) GROUP BY order_id, target_role",
+        "ix_deduction_unpaid_order_role",
+    ),
+    (
+        "Deductions of one order",
+        "SELECT * FROM deduction WHERE order_id = 1",
+        "ix_deduction_order_id",
+    ),
+    (
+        "Allocations of one payment",
+        "SELECT * FROM paymentallocation WHERE payment_id = 1",
+        "ix_paymentallocation_payment_id",
+    ),
+    (
+        "Allocations of one order",
+        "SELECT * FROM paymentallocation WHERE order_id = 1",
+        "ix_paymentallocation_order_id_stage",
+    ),
+    (
+        "Orders of a constructor",
+        'SELECT id FROM "order" WHERE constructor_id = 1',
+        "ix_order_constructor_id_id",
+    ),
+    (
+        "Orders of a manager",
+        'SELECT id FROM "order" WHERE manager_id = 1',
+        "ix_order_manager_id_id",
+    ),
+    (
+        "Payments of a constructor",
+        "SELECT SUM(amount) FROM payment WHERE constructor_id = 1",
+        "ix_payment_constructor_id",
+    ),
+    (
+        "Payments of a manager",
+        "SELECT SUM(amount) FROM payment WHERE manager_id = 1",
+        "ix_payment_manager_id",
+    ),
+    (
+        "Payments pinned to an order",
+        "SELECT id FROM payment WHERE manual_order_id = 1",
+        "ix_payment_manual_order_id",
+    ),
+    (
+        "Latest activity log entries",
+        "SELECT * FROM activitylog ORDER BY timestamp DESC, id DESC LIMIT 50",
+        "ix_activitylog_timestamp_id",
+    ),
+]
+
+
+def explain(session: Session, sql: str) -> str:
+    if engine.dialect.name == "postgresql":
+        # Small tables make the planner prefer sequential scans; we only
+        # want to know whether a matching index exists and applies.
+        session.connection().execute(text("SET LOCAL enable_seqscan = off"))
+        rows = session.connection().execute(text(f"EXPLAIN {sql}")).all()
+        return "\n".join(row[0] for row in rows)
+    rows = session.connection().execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+    return "\n".join(str(row[-1]) for row in rows)
+
+
+def check_indexes() -> bool:
+    failures = 0
+    with Session(engine) as session:
+        for description, sql, index_name in HOT_QUERIES:
+            try:
+                plan = explain(session, sql)
+            except Exception as e:
+                # Tables missing: the database was never migrated
+                session.rollback()
+                failures += 1
+                print(f"FAIL {description}: {e.__class__.__name__}: {str(e).splitlines()[0]}")
+                continue
+            if index_name in plan:
+                print(f"OK   {description}: {index_name}")
+            else:
+                failures += 1
+                print(f"FAIL {description}: expected {index_name}")
+                for line in plan.splitlines():
+                    print(f"       {line}")
+        session.rollback()
+
+    if failures:
+        print(f"{failures} hot queries do not use their index. Run migrate_auth.py to create missing indexes.")
+    else:
+        print("OK: all hot queries use their indexes.")
+    return failures == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if check_indexes() else 1)
@@ -40,6 +40,7 @@ def fix_fines():
         # 4. Trigger Distribution
         print("Distributing funds...")
         PaymentDistributionService.distribute_all_unallocated(session)
+        session.commit()
         print("Distribution complete.")
     else:
         print("No fines to convert.")
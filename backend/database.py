@@ -1,30 +1,139 @@
 from sqlmodel import SQLModel, create_engine, Session
+from fastapi.concurrency import run_in_threadpool
 from models import Order, Deduction  # Import to register models
 from payments import Payment, PaymentAllocation  # Import payment models
+import financials_service  # Registers order_financials maintenance hooks
+from sqlite_tuning import sqlite_tuning
+from pool_metrics import timed_pool_class, sync_pool_metrics, async_pool_metrics
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
 
 import os
+from uuid import uuid4
 
 # Database Config
 DATABASE_URL = os.environ.get("DATABASE_URL")
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SQLITE_PATH = None  # Set for SQLite databases (used for the migration file lock)
 
+# Connection pool (per worker process). Sync handlers run on the AnyIO
+# threadpool (40 threads), so pool_size + max_overflow below that makes busy
+# requests queue for a connection (see checkout wait in /admin/metrics).
+# Across gunicorn workers keep workers x (pool_size + max_overflow) below the
+# Postgres max_connections.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+# Postgres only. Pre-ping costs a round-trip per checkout; with pool_recycle
+# below the server/proxy idle timeout it can usually be turned off.
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() in {"1", "true", "yes"}
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "300"))
+# Behind pgbouncer in transaction pooling mode: no client-side pool and no
+# named prepared statements (the server connection changes per transaction).
+DB_PGBOUNCER = os.environ.get("DB_PGBOUNCER", "false").lower() in {"1", "true", "yes"}
+
+# One connection configuration for both engines: urls, pool and connect args
+connect_args = {}
+async_connect_args = {}
 if DATABASE_URL and DATABASE_URL.startswith("postgres"):
     # Fix for some hosting providers using postgres:// instead of postgresql://
-    database_url = DATABASE_URL.replace("postgres://", "postgresql://")
-    connect_args = {} # Postgres doesn't need check_same_thread
-    engine = create_engine(database_url, connect_args=connect_args, pool_pre_ping=True, pool_recycle=300)
+    database_url = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+    async_database_url = database_url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    ASYNC_DRIVER = "asyncpg"
+    if DB_PGBOUNCER:
+        pool_kwargs = {}
+        # psycopg2 never prepares statements; asyncpg does unless told not to
+        async_connect_args = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        }
+    else:
+        pool_kwargs = {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_pre_ping": DB_POOL_PRE_PING,
+            "pool_recycle": DB_POOL_RECYCLE,
+        }
 else:
     # Local development with SQLite
     sqlite_file_name = os.environ.get("SQLITE_FILE_NAME", "database.db")
     sqlite_path = sqlite_file_name if os.path.isabs(sqlite_file_name) else os.path.join(BASE_DIR, sqlite_file_name)
     sqlite_path = os.path.abspath(sqlite_path).replace("\\", "/")
     database_url = f"sqlite:///{sqlite_path}"
+    async_database_url = f"sqlite+aiosqlite:///{sqlite_path}"
+    SQLITE_PATH = sqlite_path
     connect_args = {"check_same_thread": False}
-    engine = create_engine(database_url, connect_args=connect_args)
+    ASYNC_DRIVER = "aiosqlite"
+    pool_kwargs = {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT}
+
+DB_POOL_CLASS = NullPool if DB_PGBOUNCER and SQLITE_PATH is None else QueuePool
+ASYNC_POOL_CLASS = NullPool if DB_POOL_CLASS is NullPool else AsyncAdaptedQueuePool
+engine = create_engine(
+    database_url,
+    connect_args=connect_args,
+    poolclass=timed_pool_class(DB_POOL_CLASS, sync_pool_metrics),
+    **pool_kwargs,
+)
+sync_pool_metrics.install(engine)
+sqlite_tuning.install(engine)  # WAL and pragmas, SQLite only
+
+# Optional async engine for the read-heavy endpoints (see run_read).
+# ASYNC_DB=auto uses it when the driver is installed; off disables it.
+ASYNC_DB = os.environ.get("ASYNC_DB", "auto").lower()
+async_engine = None
+if ASYNC_DB not in {"0", "false", "off", "no"}:
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        async_engine = create_async_engine(
+            async_database_url,
+            connect_args=dict(connect_args, **async_connect_args),
+            poolclass=timed_pool_class(ASYNC_POOL_CLASS, async_pool_metrics),
+            **pool_kwargs,
+        )
+        async_pool_metrics.install(async_engine.sync_engine)
+        sqlite_tuning.install(async_engine.sync_engine)
+    except ImportError as e:
+        if ASYNC_DB != "auto":
+            raise
+        print(f"Async database engine disabled ({ASYNC_DRIVER} not installed): {e}")
+
+# Search backend (see search_service.py): pg_trgm GIN indexes on Postgres,
+# FTS5 shadow table on SQLite. SEARCH_BACKEND=like disables both.
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND") or ("pg_trgm" if engine.dialect.name == "postgresql" else "fts5")
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
 
 def get_session():
-    with Session(engine) as session:
-        yield session
+    # Unit of work per request: handlers only flush(), the request commits once
+    # here after the handler returned and rolls back everything if it raised.
+    # expire_on_commit=False keeps loaded objects usable for the response.
+    # Declare it as Depends(get_session, scope="function"): the commit then
+    # runs before the response is sent, so a failed commit becomes a 500
+    # instead of a 200 for a write that was rolled back.
+    with Session(engine, expire_on_commit=False) as session:
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+async def run_read(fn, *args, **kwargs):
+    """
+    Runs a read-only fn(session, *args, **kwargs) for an async endpoint.
+
+    With the async engine the sync ORM code runs through AsyncSession.run_sync
+    (greenlet on the event loop), so waiting on the database holds no
+    threadpool thread. Without it, fn runs in the threadpool on the sync engine.
+    """
+    if async_engine is not None:
+        from sqlmodel.ext.asyncio.session import AsyncSession
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            return await session.run_sync(lambda sync_session: fn(sync_session, *args, **kwargs))
+
+    def call():
+        with Session(engine, expire_on_commit=False) as session:
+            return fn(session, *args, **kwargs)
+    return await run_in_threadpool(call)
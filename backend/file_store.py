@@ -0,0 +1,351 @@
+import hashlib
+import os
+import re
+import shutil
+import stat
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+from models import Order, OrderFile
+from file_utils import get_file_path, sanitize_filename
+
+# Content-addressed store for uploaded files.
+#
+# Every uploaded file is kept once under <storage_path>/.blobs/ab/abcd...
+# (its SHA-256) and the per-order folders get hard links to the blob, so the
+# project folder view is unchanged while identical catalogues and fittings
+# PDFs of many orders take the disk space of one copy. Where hard links are
+# not possible the blob is copied into the folder; FILE_STORE_LINK_MODE=
+# virtual creates no folder file at all and downloads are served from the
+# blob.
+#
+# References are the OrderFile rows with that content_hash; gc() deletes
+# blobs nobody references (older than the grace period, so a blob linked by
+# an upload that has not committed yet is never collected).
+#
+# Blobs are read-only. A hard link shares the file (and its permissions)
+# with the blob and every other order that uploaded the same content, so an
+# in-place edit through one order's folder would silently change all of
+# them. To change such a file, save the edited version under a new name (or
+# copy it out, edit, and upload it again): the upload replaces the folder
+# link with a link to the new blob and the other orders keep theirs.
+# FILE_STORE_LINK_MODE=copy gives every folder its own writable copy instead
+# (no disk savings for the folders, only for the store). store() still
+# re-checks an existing blob against its hash before deduplicating, as an
+# administrator can write to read-only files.
+#
+# FILE_STORE=off keeps plain per-order files (content_hash is still stored).
+FILE_STORE_ENABLED = os.environ.get("FILE_STORE", "on").lower() not in {"0", "false", "off", "no"}
+FILE_STORE_LINK_MODE = os.environ.get("FILE_STORE_LINK_MODE", "hardlink").lower()  # hardlink | copy | virtual
+FILE_STORE_GC_GRACE_SECONDS = float(os.environ.get("FILE_STORE_GC_GRACE_SECONDS", "3600"))
+BLOB_DIR_NAME = ".blobs"
+
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+
+def is_sha256(value: str) -> bool:
+    return bool(value) and bool(_SHA256.match(value))
+
+
+def _file_hash(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _protect(path: str):
+    """Drops the write bits (the mode is shared by every hard link of the blob)."""
+    mode = stat.S_IMODE(os.stat(path).st_mode)
+    if mode & 0o222:
+        os.chmod(path, mode & ~0o222)
+
+
+def _unlink(path: str, blob: Optional[str] = None):
+    """
+    Deletes a read-only folder link (POSIX only needs write access to the
+    directory). Windows refuses read-only files and the attribute is shared
+    by all links, so it is cleared for the delete and set again on blob.
+    """
+    try:
+        os.unlink(path)
+    except PermissionError:
+        if os.name != "nt":
+            raise
+        os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+        os.unlink(path)
+        if blob and os.path.exists(blob):
+            _protect(blob)
+
+
+class FileStore:
+    def __init__(self, enabled: bool = True, link_mode: str = "hardlink", grace_seconds: float = 3600.0):
+        self.enabled = enabled
+        self.link_mode = link_mode
+        self.grace_seconds = grace_seconds
+        self._lock = threading.Lock()
+        self.blobs_written = 0
+        self.dedup_hits = 0
+        self.bytes_deduplicated = 0
+        self.copies = 0  # hard link failed, folder got a copy
+        self.blobs_replaced = 0  # stored blob no longer matched its hash
+        self.last_gc: Optional[Dict[str, Any]] = None
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    # --- Paths ---
+
+    @staticmethod
+    def blob_root(base_path: str) -> str:
+        return os.path.join(base_path, BLOB_DIR_NAME)
+
+    @staticmethod
+    def blob_path(base_path: str, content_hash: str) -> str:
+        if not is_sha256(content_hash):
+            raise ValueError("Invalid content hash")
+        return os.path.join(base_path, BLOB_DIR_NAME, content_hash[:2], content_hash)
+
+    def has_blob(self, base_path: str, content_hash: str) -> bool:
+        return is_sha256(content_hash) and os.path.exists(self.blob_path(base_path, content_hash))
+
+    # --- Writing ---
+
+    def _link(self, base_path: str, blob: str, dest_path: str):
+        """Points dest_path at blob (hard link, or a copy), replacing dest_path atomically."""
+        if self.link_mode == "virtual":
+            if os.path.exists(dest_path):
+                self._unlink_folder_file(base_path, dest_path)  # Stale folder file of an earlier upload
+            return
+        if os.path.exists(dest_path):
+            try:
+                if self.link_mode != "copy" and os.path.samefile(blob, dest_path):
+                    return
+            except OSError:
+                pass
+        tmp_path = f"{dest_path}.link-{os.getpid()}-{threading.get_ident()}"
+        if self.link_mode == "copy":
+            # A private writable copy (copyfile does not take over the read-only mode)
+            shutil.copyfile(blob, tmp_path)
+        else:
+            try:
+                os.link(blob, tmp_path)
+            except FileNotFoundError:
+                raise  # Blob collected meanwhile, the caller decides
+            except OSError:
+                # Other file system or no hard link support: a plain copy
+                shutil.copyfile(blob, tmp_path)
+                self._count(copies=1)
+        try:
+            try:
+                os.replace(tmp_path, dest_path)
+            except PermissionError:
+                if os.name != "nt" or not os.path.exists(dest_path):
+                    raise
+                # Windows does not replace read-only files
+                self._unlink_folder_file(base_path, dest_path)
+                os.replace(tmp_path, dest_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                _unlink(tmp_path, blob)
+            raise
+
+    def _unlink_folder_file(self, base_path: str, path: str):
+        blob = None
+        if os.name == "nt" and not os.access(path, os.W_OK):
+            # Read-only: a link to some blob, found by its content
+            blob = self.blob_path(base_path, _file_hash(path))
+        _unlink(path, blob)
+
+    def link_existing(self, base_path: str, content_hash: str, dest_path: str) -> Optional[int]:
+        """
+        Hash-first upload: links the stored blob to dest_path. Returns the
+        file size, or None when the content is not in the store.
+        """
+        if not self.enabled or not self.has_blob(base_path, content_hash):
+            return None
+        blob = self.blob_path(base_path, content_hash)
+        try:
+            if _file_hash(blob) != content_hash:
+                return None  # Changed in place: the client uploads the file and store() replaces the blob
+            os.utime(blob)  # Fresh mtime: gc leaves it alone until the row is committed
+            self._link(base_path, blob, dest_path)
+            size = os.path.getsize(blob)
+        except FileNotFoundError:
+            return None  # Collected meanwhile
+        self._count(dedup_hits=1, bytes_deduplicated=size)
+        return size
+
+    @staticmethod
+    def _blob_intact(blob: str, tmp_path: str, content_hash: str) -> bool:
+        """Stored blob still has content_hash (size first, the full hash only when it matches)."""
+        try:
+            if os.path.getsize(blob) != os.path.getsize(tmp_path):
+                return False
+            return _file_hash(blob) == content_hash
+        except FileNotFoundError:
+            return True  # Collected meanwhile, store() writes a new one
+
+    def store(self, base_path: str, tmp_path: str, content_hash: str, dest_path: str) -> bool:
+        """
+        Moves a received temp file into the store and links it to dest_path.
+        Returns True when the content was already stored (the temp file is
+        dropped).
+        """
+        blob = self.blob_path(base_path, content_hash)
+        if os.path.exists(blob) and not self._blob_intact(blob, tmp_path, content_hash):
+            # Edited in place through a folder link: the new upload takes its place
+            self._count(blobs_replaced=1)
+            try:
+                _unlink(blob)
+            except FileNotFoundError:
+                pass
+        if os.path.exists(blob):
+            try:
+                _protect(blob)  # Blobs stored while they were writable
+                os.utime(blob)
+                self._link(base_path, blob, dest_path)
+                size = os.path.getsize(tmp_path)
+                os.unlink(tmp_path)
+                self._count(dedup_hits=1, bytes_deduplicated=size)
+                return True
+            except FileNotFoundError:
+                pass  # Collected meanwhile: store the new copy
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        _protect(tmp_path)
+        shutil.move(tmp_path, blob)
+        self._count(blobs_written=1)
+        self._link(base_path, blob, dest_path)
+        return False
+
+    # --- Maintenance ---
+
+    @staticmethod
+    def references(session: Session) -> Dict[str, int]:
+        """content_hash -> number of OrderFile rows."""
+        return dict(session.exec(
+            select(OrderFile.content_hash, func.count())
+            .where(OrderFile.content_hash.is_not(None))
+            .group_by(OrderFile.content_hash)
+        ).all())
+
+    def gc(self, session: Session, base_path: str, dry_run: bool = False, prune_links: bool = False) -> Dict[str, Any]:
+        """
+        Deletes blobs without OrderFile references. prune_links also deletes
+        folder files that are hard links to such a blob (files the store
+        created for since-deleted rows). Space comes back once the last
+        link of a blob is gone.
+        """
+        root = self.blob_root(base_path)
+        references = self.references(session)
+        cutoff = time.time() - self.grace_seconds
+        unreferenced: Dict[tuple, str] = {}
+        result = {"blobs": 0, "referenced": 0, "deleted": 0, "bytes_freed": 0, "links_pruned": 0, "dry_run": dry_run}
+
+        for directory, _, names in os.walk(root):
+            for name in names:
+                if not is_sha256(name):
+                    continue
+                path = os.path.join(directory, name)
+                result["blobs"] += 1
+                if references.get(name):
+                    result["referenced"] += 1
+                    continue
+                st = os.stat(path)
+                if st.st_mtime > cutoff:
+                    continue
+                unreferenced[(st.st_dev, st.st_ino)] = path
+
+        if prune_links and unreferenced:
+            for directory, dirnames, names in os.walk(base_path):
+                dirnames[:] = [d for d in dirnames if os.path.join(directory, d) != root]
+                for name in names:
+                    path = os.path.join(directory, name)
+                    st = os.stat(path)
+                    if st.st_nlink > 1 and (st.st_dev, st.st_ino) in unreferenced:
+                        result["links_pruned"] += 1
+                        if not dry_run:
+                            _unlink(path)
+
+        for path in unreferenced.values():
+            st = os.stat(path)
+            result["deleted"] += 1
+            if st.st_nlink <= 1 or prune_links:
+                result["bytes_freed"] += st.st_size
+            if not dry_run:
+                _unlink(path)
+        with self._lock:
+            self.last_gc = result
+        return result
+
+    def adopt(self, session: Session, base_path: str) -> Dict[str, Any]:
+        """
+        Moves files uploaded before the store existed (rows without
+        content_hash whose file is on disk) into the store.
+        """
+        result = {"files": 0, "deduplicated": 0, "missing": 0}
+        rows = session.exec(
+            select(OrderFile, Order.name)
+            .join(Order, Order.id == OrderFile.order_id)
+            .where(OrderFile.content_hash.is_(None), OrderFile.url.startswith("/api/download/"))
+        ).all()
+        for file_row, order_name in rows:
+            try:
+                path = get_file_path(order_name, file_row.folder_name, file_row.name, base_path)
+            except ValueError:
+                continue
+            if not os.path.exists(path):
+                result["missing"] += 1
+                continue
+            content_hash = _file_hash(path)
+            size = os.path.getsize(path)
+            # Keep the original until the blob is linked in its place
+            tmp_path = f"{path}.adopt-{os.getpid()}"
+            shutil.copyfile(path, tmp_path)
+            if self.store(base_path, tmp_path, content_hash, path):
+                result["deduplicated"] += 1
+            file_row.content_hash = content_hash
+            file_row.size = size
+            session.add(file_row)
+            result["files"] += 1
+        session.commit()
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "link_mode": self.link_mode,
+                "blobs_written": self.blobs_written,
+                "dedup_hits": self.dedup_hits,
+                "bytes_deduplicated": self.bytes_deduplicated,
+                "copies": self.copies,
+                "blobs_replaced": self.blobs_replaced,
+                "last_gc": self.last_gc,
+            }
+
+
+file_store = FileStore(enabled=FILE_STORE_ENABLED, link_mode=FILE_STORE_LINK_MODE, grace_seconds=FILE_STORE_GC_GRACE_SECONDS)
+
+
+def stored_file_path(session: Session, order_id: int, folder_category: str, filename: str, base_path: str) -> Optional[str]:
+    """Blob behind a download link whose folder file is missing (virtual mode, pruned folder)."""
+    content_hash = session.exec(
+        select(OrderFile.content_hash)
+        .where(
+            OrderFile.order_id == order_id,
+            OrderFile.folder_name == folder_category,
+            OrderFile.name == sanitize_filename(filename),
+            OrderFile.content_hash.is_not(None),
+        )
+        .order_by(OrderFile.id.desc())
+    ).first()
+    if content_hash and file_store.has_blob(base_path, content_hash):
+        return file_store.blob_path(base_path, content_hash)
+    return None
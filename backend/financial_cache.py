@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+# In-process cache of computed order financials (constructor + manager snapshots).
+#
+# Entries are keyed by order id and stamped with the order's own financial
+# inputs, so edits to the order row itself never serve stale data. Inputs that
+# live outside the row (deductions, user salary settings) are handled by
+# explicit invalidation from the write endpoints. With several gunicorn
+# workers each process has its own cache, so entries also expire after
+# FINANCIALS_CACHE_TTL seconds to bound staleness across workers.
+FINANCIALS_CACHE_ENABLED = os.environ.get("FINANCIALS_CACHE_ENABLED", "true").lower() in {"1", "true", "yes"}
+FINANCIALS_CACHE_TTL = float(os.environ.get("FINANCIALS_CACHE_TTL", "30"))
+FINANCIALS_CACHE_MAX_SIZE = int(os.environ.get("FINANCIALS_CACHE_MAX_SIZE", "20000"))
+
+ORDER_VERSION_FIELDS = (
+    "constructor_id",
+    "manager_id",
+    "price",
+    "material_cost",
+    "fixed_bonus",
+    "custom_stage1_percent",
+    "custom_stage2_percent",
+    "advance_paid_amount",
+    "final_paid_amount",
+    "manager_paid_amount",
+    "date_to_work",
+    "date_installation",
+    "date_manager_handover",
+)
+
+
+def order_version(order: Any) -> tuple:
+    """Version stamp built from the order fields that feed the calculations."""
+    return tuple(getattr(order, field, None) for field in ORDER_VERSION_FIELDS)
+
+
+class OrderFinancialsCache:
+    def __init__(self, enabled: bool = True, ttl: float = 30.0, max_size: int = 20000):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: Dict[int, Tuple[tuple, float, dict, dict]] = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def begin(self) -> int:
+        """
+        Returns the current generation. Pass it to put() so results computed
+        from data read before an invalidation are not stored.
+        """
+        return self._generation
+
+    def get(self, order: Any) -> Optional[Tuple[dict, dict]]:
+        if not self.enabled or getattr(order, "id", None) is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(order.id)
+            if entry is not None:
+                version, stored_at, constructor_financials, manager_financials = entry
+                if version == order_version(order) and time.monotonic() - stored_at < self.ttl:
+                    self.hits += 1
+                    return constructor_financials, manager_financials
+                del self._entries[order.id]
+            self.misses += 1
+            return None
+
+    def put(self, order: Any, constructor_financials: dict, manager_financials: dict, generation: Optional[int] = None):
+        if not self.enabled or getattr(order, "id", None) is None:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            if len(self._entries) >= self.max_size and order.id not in self._entries:
+                # Drop the oldest entry (dicts keep insertion order).
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[order.id] = (order_version(order), time.monotonic(), constructor_financials, manager_financials)
+
+    def invalidate_orders(self, order_ids: Iterable[Optional[int]]):
+        with self._lock:
+            self._generation += 1
+            for order_id in order_ids:
+                if order_id is not None and self._entries.pop(order_id, None) is not None:
+                    self.invalidations += 1
+
+    def invalidate_order(self, order_id: Optional[int]):
+        self.invalidate_orders([order_id])
+
+    def invalidate_all(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "ttl_seconds": self.ttl,
+            }
+
+
+financials_cache = OrderFinancialsCache(
+    enabled=FINANCIALS_CACHE_ENABLED,
+    ttl=FINANCIALS_CACHE_TTL,
+    max_size=FINANCIALS_CACHE_MAX_SIZE,
+)
@@ -1,7 +1,30 @@
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, Optional
 
 from sqlmodel import Session
-from sqlalchemy import text
+from sqlalchemy import bindparam, text
+
+# Keeps IN (...) lists well below the SQLite bound-parameter limit.
+DEDUCTION_BATCH_SIZE = 500
+
+
+# Databases (by URL) where deduction.target_role is known to exist. The
+# column is never dropped, so after the first successful query the hot path
+# skips the savepoint below.
+_TARGET_ROLE_DATABASES: set = set()
+
+
+def _fetch_all(session: Session, query, params, uses_target_role: bool = False) -> list:
+    database = str(session.get_bind().url)
+    if uses_target_role and database in _TARGET_ROLE_DATABASES:
+        return session.execute(query, params).all()
+    # A failed statement aborts the whole transaction on Postgres; inside a
+    # savepoint only the savepoint is rolled back, so the legacy fallback query
+    # (and the request's own pending writes) still work.
+    with session.begin_nested():
+        rows = session.execute(query, params).all()
+    if uses_target_role:
+        _TARGET_ROLE_DATABASES.add(database)
+    return rows
 
 
 def _sum_unpaid_deductions_for_target(
@@ -16,17 +39,20 @@ def _sum_unpaid_deductions_for_target(
 
     try:
         if target_role == "manager":
-            total = session.execute(
+            total = _fetch_all(
+                session,
                 text(
                     "SELECT COALESCE(SUM(amount), 0) "
                     "FROM deduction "
                     "WHERE order_id = :order_id AND is_paid = FALSE AND target_role = 'manager'"
                 ),
                 params,
-            ).scalar()
+                uses_target_role=True,
+            )[0][0]
         else:
             # Legacy compatibility: old rows without target_role are treated as constructor fines.
-            total = session.execute(
+            total = _fetch_all(
+                session,
                 text(
                     "SELECT COALESCE(SUM(amount), 0) "
                     "FROM deduction "
@@ -34,26 +60,97 @@ def _sum_unpaid_deductions_for_target(
                     "AND (target_role = 'constructor' OR target_role IS NULL)"
                 ),
                 params,
-            ).scalar()
+                uses_target_role=True,
+            )[0][0]
         return float(total or 0.0)
     except Exception:
         # Column target_role might not exist in very old DB snapshots.
         try:
             if target_role == "manager":
                 return 0.0
-            total_legacy = session.execute(
+            total_legacy = _fetch_all(
+                session,
                 text(
                     "SELECT COALESCE(SUM(amount), 0) "
                     "FROM deduction "
                     "WHERE order_id = :order_id AND is_paid = FALSE"
                 ),
                 params,
-            ).scalar()
+            )[0][0]
             return float(total_legacy or 0.0)
         except Exception:
             return 0.0
 
 
+def sum_unpaid_deductions_by_order(
+    session: Optional[Session],
+    order_ids: Optional[Iterable[int]] = None,
+) -> Dict[int, Dict[str, float]]:
+    """
+    Batched variant of _sum_unpaid_deductions_for_target.
+
+    Returns {order_id: {"constructor": total, "manager": total}} using one
+    grouped query per batch instead of two queries per order. When
+    order_ids is None every order with unpaid deductions is included.
+    """
+    totals: Dict[int, Dict[str, float]] = {}
+    if order_ids is not None:
+        unique_ids = sorted({order_id for order_id in order_ids if order_id is not None})
+        totals = {order_id: {"constructor": 0.0, "manager": 0.0} for order_id in unique_ids}
+        if not unique_ids:
+            return totals
+        batches = [
+            unique_ids[start:start + DEDUCTION_BATCH_SIZE]
+            for start in range(0, len(unique_ids), DEDUCTION_BATCH_SIZE)
+        ]
+    else:
+        batches = [None]
+
+    if not session:
+        return totals
+
+    def build_query(columns: str, group_by: str, batch):
+        sql = f"SELECT {columns} FROM deduction WHERE is_paid = FALSE"
+        if batch is not None:
+            sql += " AND order_id IN :order_ids"
+        query = text(f"{sql} GROUP BY {group_by}")
+        if batch is not None:
+            query = query.bindparams(bindparam("order_ids", expanding=True))
+        return query
+
+    for batch in batches:
+        params = {"order_ids": batch} if batch is not None else {}
+        try:
+            rows = _fetch_all(
+                session,
+                build_query("order_id, target_role, COALESCE(SUM(amount), 0)", "order_id, target_role", batch),
+                params,
+                uses_target_role=True,
+            )
+            for order_id, target_role, total in rows:
+                bucket = totals.setdefault(order_id, {"constructor": 0.0, "manager": 0.0})
+                # Legacy compatibility: rows without target_role are constructor fines.
+                if target_role == "manager":
+                    bucket["manager"] += float(total or 0.0)
+                elif target_role in (None, "constructor"):
+                    bucket["constructor"] += float(total or 0.0)
+        except Exception:
+            # Column target_role might not exist in very old DB snapshots.
+            try:
+                rows = _fetch_all(
+                    session,
+                    build_query("order_id, COALESCE(SUM(amount), 0)", "order_id", batch),
+                    params,
+                )
+                for order_id, total in rows:
+                    bucket = totals.setdefault(order_id, {"constructor": 0.0, "manager": 0.0})
+                    bucket["constructor"] += float(total or 0.0)
+            except Exception:
+                continue
+
+    return totals
+
+
 def resolve_constructor_base_financials(
     order: Any,
     session: Optional[Session] = None,
@@ -289,18 +386,42 @@ def build_manager_financial_snapshot(
     }
 
 
+def calculate_order_current_debt(
+    advance_remaining: float,
+    final_remaining: float,
+    unabsorbed_deductions: float = 0.0,
+    stage1_active: bool = False,
+    stage2_active: bool = False,
+) -> float:
+    """
+    Constructor debt as shown in order lists and dashboards: remaining
+    amounts of ACTIVE stages (ignoring sub-cent leftovers) minus fines that
+    could not be absorbed by the stages.
+    """
+    current_debt = 0.0
+    if stage1_active and advance_remaining > 0.01:
+        current_debt += advance_remaining
+    if stage2_active and final_remaining > 0.01:
+        current_debt += final_remaining
+
+    current_debt -= unabsorbed_deductions or 0.0
+    return current_debt
+
+
 def calculate_constructor_financials(
     order: Any,
     session: Optional[Session] = None,
     constructor: Any = None,
+    unpaid_deductions: Optional[float] = None,
 ) -> Dict[str, float]:
     base_financials = resolve_constructor_base_financials(order, session=session, constructor=constructor)
 
-    unpaid_deductions = _sum_unpaid_deductions_for_target(
-        session=session,
-        order_id=getattr(order, "id", None),
-        target_role="constructor",
-    )
+    if unpaid_deductions is None:
+        unpaid_deductions = _sum_unpaid_deductions_for_target(
+            session=session,
+            order_id=getattr(order, "id", None),
+            target_role="constructor",
+        )
 
     advance_paid_amount = getattr(order, "advance_paid_amount", 0.0) or 0.0
     final_paid_amount = getattr(order, "final_paid_amount", 0.0) or 0.0
@@ -325,13 +446,15 @@ def calculate_manager_financials(
     order: Any,
     session: Optional[Session] = None,
     manager: Any = None,
+    unpaid_deductions: Optional[float] = None,
 ) -> Dict[str, float]:
     base_financials = resolve_manager_base_financials(order, session=session, manager=manager)
-    unpaid_deductions = _sum_unpaid_deductions_for_target(
-        session=session,
-        order_id=getattr(order, "id", None),
-        target_role="manager",
-    )
+    if unpaid_deductions is None:
+        unpaid_deductions = _sum_unpaid_deductions_for_target(
+            session=session,
+            order_id=getattr(order, "id", None),
+            target_role="manager",
+        )
     snapshot = build_manager_financial_snapshot(
         raw_stage1_amount=base_financials["raw_stage1_amount"],
         raw_stage2_amount=base_financials["raw_stage2_amount"],
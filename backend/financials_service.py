@@ -0,0 +1,310 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import bindparam, event, inspect, text
+from sqlalchemy.orm import Session as SASession
+from sqlmodel import Session, select, or_
+from models import Order, User, Deduction, OrderFinancials
+from payments import PaymentAllocation
+from financial_cache import financials_cache
+from financial_logic import (
+    calculate_constructor_financials,
+    calculate_manager_financials,
+    calculate_order_current_debt,
+    sum_unpaid_deductions_by_order,
+)
+
+# session.info keys used to collect what has to be recomputed before commit.
+_DIRTY_ORDER_IDS = "financials_dirty_order_ids"
+_DIRTY_ORDERS = "financials_dirty_orders"
+_DIRTY_USER_IDS = "financials_dirty_user_ids"
+_DELETED_ORDER_IDS = "financials_deleted_order_ids"
+_REFRESHING = "financials_refreshing"
+# Orders whose cached financials must be dropped once the transaction commits
+_COMMITTED_ORDER_IDS = "financials_committed_order_ids"
+_COMMITTED_USERS = "financials_committed_users"
+
+SNAPSHOT_FIELDS = (
+    "bonus",
+    "advance_amount",
+    "final_amount",
+    "advance_remaining",
+    "final_remaining",
+    "current_debt",
+    "unpaid_deductions",
+    "remainder_amount",
+    "manager_bonus",
+    "manager_total_bonus",
+    "manager_current_debt",
+    "manager_unpaid_deductions",
+)
+
+# User fields that change the calculation of their orders.
+USER_SALARY_FIELDS = ("salary_mode", "salary_percent", "payment_stage1_percent", "payment_stage2_percent")
+
+REFRESH_BATCH_SIZE = 500
+
+
+class OrderFinancialsService:
+    """
+    Підтримує таблицю order_financials (матеріалізовані фінанси замовлень).
+
+    Зміни Order / Deduction / PaymentAllocation / налаштувань User, зроблені
+    через ORM, фіксуються автоматично і перераховуються в тій самій
+    транзакції перед commit. Для змін через сирий SQL викликайте
+    mark_orders / mark_users.
+    """
+
+    @staticmethod
+    def compute(
+        orders: List[Order],
+        users_by_id: Dict[int, User],
+        unpaid_by_order: Dict[int, Dict[str, float]],
+    ) -> Dict[int, Dict[str, float]]:
+        result = {}
+        for order in orders:
+            unpaid = unpaid_by_order.get(order.id) or {}
+            constructor_financials = calculate_constructor_financials(
+                order,
+                constructor=users_by_id.get(order.constructor_id),
+                unpaid_deductions=unpaid.get("constructor", 0.0),
+            )
+            manager_financials = calculate_manager_financials(
+                order,
+                manager=users_by_id.get(order.manager_id),
+                unpaid_deductions=unpaid.get("manager", 0.0),
+            )
+            result[order.id] = {
+                "bonus": constructor_financials["bonus"],
+                "advance_amount": constructor_financials["advance_amount"],
+                "final_amount": constructor_financials["final_amount"],
+                "advance_remaining": constructor_financials["advance_remaining"],
+                "final_remaining": constructor_financials["final_remaining"],
+                "current_debt": calculate_order_current_debt(
+                    advance_remaining=constructor_financials["advance_remaining"],
+                    final_remaining=constructor_financials["final_remaining"],
+                    unabsorbed_deductions=constructor_financials.get("unabsorbed_deductions", 0.0),
+                    stage1_active=bool(order.date_to_work),
+                    stage2_active=bool(order.date_installation),
+                ),
+                "unpaid_deductions": constructor_financials["unpaid_deductions"],
+                "remainder_amount": constructor_financials.get(
+                    "remainder_amount",
+                    constructor_financials["advance_remaining"] + constructor_financials["final_remaining"],
+                ),
+                "manager_bonus": manager_financials["active_amount"],
+                "manager_total_bonus": manager_financials["total_bonus"],
+                "manager_current_debt": manager_financials["current_debt"],
+                "manager_unpaid_deductions": manager_financials["unpaid_deductions"],
+            }
+        return result
+
+    @staticmethod
+    def _load_inputs(session: Session, orders: List[Order]):
+        user_ids = {o.constructor_id for o in orders if o.constructor_id} | {o.manager_id for o in orders if o.manager_id}
+        users_by_id = {}
+        if user_ids:
+            users_by_id = {u.id: u for u in session.exec(select(User).where(User.id.in_(user_ids))).all()}
+        unpaid_by_order = sum_unpaid_deductions_by_order(session, [o.id for o in orders])
+        return users_by_id, unpaid_by_order
+
+    @staticmethod
+    def refresh_orders(session: Session, order_ids: Iterable[Optional[int]]):
+        """Перераховує і записує рядки order_financials (без commit)."""
+        order_ids = sorted({order_id for order_id in order_ids if order_id is not None})
+        for start in range(0, len(order_ids), REFRESH_BATCH_SIZE):
+            batch = order_ids[start:start + REFRESH_BATCH_SIZE]
+            orders = session.exec(select(Order).where(Order.id.in_(batch))).all()
+            users_by_id, unpaid_by_order = OrderFinancialsService._load_inputs(session, orders)
+            computed = OrderFinancialsService.compute(orders, users_by_id, unpaid_by_order)
+
+            existing = {
+                row.order_id: row
+                for row in session.exec(select(OrderFinancials).where(OrderFinancials.order_id.in_(batch))).all()
+            }
+            now = datetime.utcnow()
+            for order_id in batch:
+                values = computed.get(order_id)
+                row = existing.get(order_id)
+                if values is None:
+                    # Order no longer exists
+                    if row is not None:
+                        session.delete(row)
+                    continue
+                if row is None:
+                    row = OrderFinancials(order_id=order_id)
+                for field, value in values.items():
+                    setattr(row, field, value)
+                row.updated_at = now
+                session.add(row)
+
+    @staticmethod
+    def refresh_users(session: Session, user_ids: Iterable[Optional[int]]):
+        user_ids = [user_id for user_id in set(user_ids) if user_id is not None]
+        if not user_ids:
+            return
+        order_ids = session.exec(
+            select(Order.id).where(or_(Order.constructor_id.in_(user_ids), Order.manager_id.in_(user_ids)))
+        ).all()
+        OrderFinancialsService.refresh_orders(session, order_ids)
+
+    @staticmethod
+    def refresh_all(session: Session):
+        order_ids = session.exec(select(Order.id)).all()
+        OrderFinancialsService.refresh_orders(session, order_ids)
+        session.flush()
+        session.execute(text('DELETE FROM order_financials WHERE order_id NOT IN (SELECT id FROM "order")'))
+
+    @staticmethod
+    def delete_orders(session: Session, order_ids: Iterable[Optional[int]]):
+        order_ids = [order_id for order_id in set(order_ids) if order_id is not None]
+        if not order_ids:
+            return
+        session.execute(
+            text("DELETE FROM order_financials WHERE order_id IN :order_ids")
+            .bindparams(bindparam("order_ids", expanding=True)),
+            {"order_ids": order_ids},
+        )
+
+    @staticmethod
+    def mark_orders(session: Session, order_ids: Iterable[Optional[int]]):
+        """Позначити замовлення для перерахунку перед commit (для змін через сирий SQL)."""
+        session.info.setdefault(_DIRTY_ORDER_IDS, set()).update(
+            order_id for order_id in order_ids if order_id is not None
+        )
+
+    @staticmethod
+    def mark_users(session: Session, user_ids: Iterable[Optional[int]]):
+        session.info.setdefault(_DIRTY_USER_IDS, set()).update(
+            user_id for user_id in user_ids if user_id is not None
+        )
+
+    @staticmethod
+    def check_consistency(session: Session, fix: bool = False, tolerance: float = 0.005) -> dict:
+        """
+        Перераховує всі замовлення і порівнює з order_financials.
+        fix=True перезаписує розбіжності (без commit).
+        """
+        orders = session.exec(select(Order).order_by(Order.id.asc())).all()
+        stored = {row.order_id: row for row in session.exec(select(OrderFinancials)).all()}
+        users_by_id = {u.id: u for u in session.exec(select(User)).all()}
+        unpaid_by_order = sum_unpaid_deductions_by_order(session)
+        computed = OrderFinancialsService.compute(orders, users_by_id, unpaid_by_order)
+
+        mismatches = []
+        missing = []
+        for order_id, values in computed.items():
+            row = stored.get(order_id)
+            if row is None:
+                missing.append(order_id)
+                continue
+            for field in SNAPSHOT_FIELDS:
+                stored_value = getattr(row, field) or 0.0
+                if abs(stored_value - values[field]) > tolerance:
+                    mismatches.append({
+                        "order_id": order_id,
+                        "field": field,
+                        "stored": stored_value,
+                        "expected": values[field],
+                    })
+        orphaned = sorted(set(stored) - set(computed))
+
+        if fix:
+            OrderFinancialsService.delete_orders(session, orphaned)
+            OrderFinancialsService.refresh_orders(
+                session, set(missing) | {m["order_id"] for m in mismatches}
+            )
+
+        return {
+            "checked": len(computed),
+            "mismatches": mismatches,
+            "missing": missing,
+            "orphaned": orphaned,
+            "consistent": not mismatches and not missing and not orphaned,
+        }
+
+
+def _collect_changes(session, flush_context, instances):
+    if session.info.get(_REFRESHING):
+        return
+    dirty_ids: Set[int] = session.info.setdefault(_DIRTY_ORDER_IDS, set())
+    dirty_orders: list = session.info.setdefault(_DIRTY_ORDERS, [])
+    dirty_users: Set[int] = session.info.setdefault(_DIRTY_USER_IDS, set())
+    deleted_ids: Set[int] = session.info.setdefault(_DELETED_ORDER_IDS, set())
+
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Order):
+            # New orders get their id during flush, so keep the object.
+            dirty_orders.append(obj)
+        elif isinstance(obj, (Deduction, PaymentAllocation)):
+            dirty_ids.add(obj.order_id)
+            # Deduction/allocation moved to another order
+            history = inspect(obj).attrs.order_id.history
+            dirty_ids.update(value for value in history.deleted if value is not None)
+        elif isinstance(obj, User) and _salary_changed(obj):
+            dirty_users.add(obj.id)
+
+    for obj in session.deleted:
+        if isinstance(obj, Order):
+            deleted_ids.add(obj.id)
+        elif isinstance(obj, (Deduction, PaymentAllocation)):
+            dirty_ids.add(obj.order_id)
+        elif isinstance(obj, User):
+            dirty_users.add(obj.id)
+
+
+def _salary_changed(user: User) -> bool:
+    state = inspect(user)
+    return any(state.attrs[field].history.has_changes() for field in USER_SALARY_FIELDS)
+
+
+def _refresh_before_commit(session):
+    if session.info.get(_REFRESHING):
+        return
+    session.flush()
+    dirty_ids: Set[int] = session.info.pop(_DIRTY_ORDER_IDS, set())
+    dirty_orders: list = session.info.pop(_DIRTY_ORDERS, [])
+    dirty_users: Set[int] = session.info.pop(_DIRTY_USER_IDS, set())
+    deleted_ids: Set[int] = session.info.pop(_DELETED_ORDER_IDS, set())
+    dirty_ids.update(order.id for order in dirty_orders if order.id is not None)
+    if not (dirty_ids or dirty_users or deleted_ids):
+        return
+
+    session.info.setdefault(_COMMITTED_ORDER_IDS, set()).update(dirty_ids | deleted_ids)
+    if dirty_users:
+        session.info[_COMMITTED_USERS] = True
+
+    session.info[_REFRESHING] = True
+    try:
+        OrderFinancialsService.delete_orders(session, deleted_ids)
+        OrderFinancialsService.refresh_users(session, dirty_users)
+        OrderFinancialsService.refresh_orders(session, dirty_ids - deleted_ids)
+        session.flush()
+    finally:
+        session.info.pop(_REFRESHING, None)
+
+
+def _invalidate_cache_after_commit(session):
+    # After commit, not before: a concurrent request reading between our
+    # flush and commit could otherwise cache the old numbers again.
+    if session.in_nested_transaction():
+        return
+    order_ids = session.info.pop(_COMMITTED_ORDER_IDS, None)
+    if session.info.pop(_COMMITTED_USERS, None):
+        financials_cache.invalidate_all()
+    elif order_ids:
+        financials_cache.invalidate_orders(order_ids)
+
+
+def _reset_after_rollback(session, previous_transaction):
+    if previous_transaction.nested:
+        # Savepoint rollback: changes flushed before the savepoint still commit
+        return
+    for key in (_DIRTY_ORDER_IDS, _DIRTY_ORDERS, _DIRTY_USER_IDS, _DELETED_ORDER_IDS, _COMMITTED_ORDER_IDS, _COMMITTED_USERS):
+        session.info.pop(key, None)
+
+
+event.listen(SASession, "before_flush", _collect_changes)
+event.listen(SASession, "before_commit", _refresh_before_commit)
+event.listen(SASession, "after_commit", _invalidate_cache_after_commit)
+event.listen(SASession, "after_soft_rollback", _reset_after_rollback)
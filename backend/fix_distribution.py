@@ -17,6 +17,7 @@ def fix():
     
     # 1. Clear Allocations
     session.exec(delete(PaymentAllocation))
+    PaymentDistributionService.sync_allocated_totals(session)
     
     # 2. Reset Orders
     orders = session.exec(select(Order)).all()
@@ -36,6 +37,7 @@ def fix():
     
     # Run distribution
     allocations = PaymentDistributionService.distribute_all_unallocated(session)
+    session.commit()
     
     print(f"Done! Created {len(allocations)} allocations.")
     for a in allocations:
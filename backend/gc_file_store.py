@@ -0,0 +1,35 @@
+"""
+File store maintenance (see file_store.py).
+
+Usage:
+    python gc_file_store.py                 # what gc would delete (dry run)
+    python gc_file_store.py --delete        # delete unreferenced blobs
+    python gc_file_store.py --delete --prune-links
+    python gc_file_store.py --adopt         # move files uploaded before the store into it
+
+Uses the same database and settings as the app (DATABASE_URL /
+SQLITE_FILE_NAME, settings.json or STORAGE_PATH).
+"""
+import argparse
+
+from sqlmodel import Session
+from database import engine
+from file_store import file_store
+from settings import load_settings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--delete", action="store_true", help="really delete (default is a dry run)")
+    parser.add_argument("--prune-links", action="store_true", help="also delete folder hard links of unreferenced blobs")
+    parser.add_argument("--adopt", action="store_true", help="hash existing uploads and move them into the store first")
+    parser.add_argument("--grace", type=float, default=None, help="skip blobs touched in the last N seconds")
+    args = parser.parse_args()
+
+    storage_path = load_settings().storage_path
+    if args.grace is not None:
+        file_store.grace_seconds = args.grace
+    with Session(engine) as session:
+        if args.adopt:
+            print("adopt:", file_store.adopt(session, storage_path))
+        print("gc:", file_store.gc(session, storage_path, dry_run=not args.delete, prune_links=args.prune_links))
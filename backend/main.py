@@ -4,6 +4,11 @@ import os
 
 from migrate_auth import migrate
 from routes import router
+from activity_log import activity_log_writer
+from auth import shutdown_password_executor
+from database import engine
+from sqlite_tuning import sqlite_tuning
+from telegram_dispatcher import telegram_dispatcher, TELEGRAM_DISPATCHER_ENABLED
 
 app = FastAPI(title="TechPay Pro")
 
@@ -28,6 +33,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # Keyset pagination for GET /orders/
 )
 
 @app.on_event("startup")
@@ -39,6 +45,20 @@ def on_startup():
             migrate()
     except Exception as e:
         print(f"Startup migration error: {e}")
+    if TELEGRAM_DISPATCHER_ENABLED:
+        telegram_dispatcher.start()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    # Write queued activity log entries before the process exits
+    activity_log_writer.stop()
+    telegram_dispatcher.stop()
+    shutdown_password_executor()
+    # Fold the WAL back into the database file (SQLite only)
+    try:
+        sqlite_tuning.checkpoint(engine, "TRUNCATE")
+    except Exception as e:
+        print(f"SQLite checkpoint on shutdown failed: {e}")
 
 app.include_router(router)
 
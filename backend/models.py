@@ -1,8 +1,10 @@
-from typing import Optional
-from datetime import date
+from typing import List, Optional
+from datetime import date, datetime
 from sqlmodel import Field, SQLModel
+from sqlalchemy import Index, text
 from pydantic import BaseModel
-from financial_logic import calculate_constructor_financials, calculate_manager_financials
+from financial_logic import calculate_constructor_financials, calculate_manager_financials, calculate_order_current_debt, sum_unpaid_deductions_by_order
+from financial_cache import financials_cache
 
 # User Model
 class User(SQLModel, table=True):
@@ -16,6 +18,7 @@ class User(SQLModel, table=True):
     email: Optional[str] = None
     phone_number: Optional[str] = None
     telegram_id: Optional[str] = Field(default=None)
+    telegram_digest: bool = Field(default=False)  # Payment/deduction notifications once a day instead of instantly
     salary_mode: str = Field(default='sales_percent')  # 'sales_percent' or 'materials_percent'
     salary_percent: float = Field(default=5.0)  # Percentage value
     payment_stage1_percent: float = Field(default=50.0)  # % paid after stage 1 (Конструктив)
@@ -36,6 +39,7 @@ class UserCreate(BaseModel):
     email: Optional[str] = None
     phone_number: Optional[str] = None
     telegram_id: Optional[str] = None
+    telegram_digest: bool = False
     salary_mode: str = 'sales_percent'
     salary_percent: float = 5.0
     payment_stage1_percent: float = 50.0
@@ -57,6 +61,7 @@ class UserRead(BaseModel):
     email: Optional[str] = None
     phone_number: Optional[str] = None
     telegram_id: Optional[str] = None
+    telegram_digest: Optional[bool] = None
     salary_mode: Optional[str] = None
     salary_percent: Optional[float] = None
     payment_stage1_percent: Optional[float] = None
@@ -77,6 +82,7 @@ class UserUpdate(BaseModel):
     email: Optional[str] = None
     phone_number: Optional[str] = None
     telegram_id: Optional[str] = None
+    telegram_digest: Optional[bool] = None
     salary_mode: Optional[str] = None
     salary_percent: Optional[float] = None
     payment_stage1_percent: Optional[float] = None
@@ -127,12 +133,34 @@ class OrderBase(SQLModel):
     date_manager_paid: Optional[date] = None
 
 class Order(OrderBase, table=True):
+    # Composite indexes for keyset pagination / filters on GET /orders/ (sort column + id)
+    __table_args__ = (
+        Index("ix_order_constructor_id_id", "constructor_id", "id"),
+        Index("ix_order_manager_id_id", "manager_id", "id"),
+        Index("ix_order_name_id", "name", "id"),
+        Index("ix_order_price_id", "price", "id"),
+        Index("ix_order_date_received_id", "date_received", "id"),
+        Index("ix_order_date_to_work_id", "date_to_work", "id"),
+        Index("ix_order_date_installation_id", "date_installation", "id"),
+        Index("ix_order_date_final_paid", "date_final_paid"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
 
 # Deduction Model (штрафи/відрахування)
 class Deduction(SQLModel, table=True):
+    __table_args__ = (
+        # Unpaid deductions per order and role (financial_logic SUMs filter on is_paid = FALSE)
+        Index(
+            "ix_deduction_unpaid_order_role",
+            "order_id", "target_role", "amount",
+            sqlite_where=text("is_paid = FALSE"),
+            postgresql_where=text("is_paid = FALSE"),
+        ),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    order_id: int = Field(foreign_key="order.id")
+    order_id: int = Field(foreign_key="order.id", index=True)
     amount: float
     description: str
     target_role: str = Field(default="constructor")  # constructor | manager
@@ -213,6 +241,10 @@ class OrderRead(OrderBase):
         from sqlmodel import Session
         if isinstance(session_or_constructor, Session):
             session = session_or_constructor
+            cached = financials_cache.get(order)
+            if cached is not None:
+                return cls.from_financials(order, *cached)
+            generation = financials_cache.begin()
             if order.constructor_id:
                 from models import User
                 constructor = session.get(User, order.constructor_id)
@@ -227,13 +259,81 @@ class OrderRead(OrderBase):
             session=session,
             constructor=constructor,
         )
-        bonus = constructor_financials["bonus"]
-
         manager_financials = calculate_manager_financials(
             order,
             session=session,
             manager=manager,
         )
+        if session is not None:
+            financials_cache.put(order, constructor_financials, manager_financials, generation=generation)
+        return cls.from_financials(order, constructor_financials, manager_financials)
+
+    @classmethod
+    def from_orders(cls, orders: List[Order], session) -> List["OrderRead"]:
+        """
+        Batch version of from_order for list endpoints.
+
+        Rows found in the financials cache are served from memory; for the
+        rest the referenced users and unpaid deduction totals are loaded up
+        front (two queries in total) and every row is built in memory.
+        """
+        from sqlmodel import select
+
+        orders = list(orders)
+        if not orders:
+            return []
+
+        financials_by_order = {}
+        misses = []
+        for order in orders:
+            cached = financials_cache.get(order)
+            if cached is not None:
+                financials_by_order[order.id] = cached
+            else:
+                misses.append(order)
+
+        if misses:
+            generation = financials_cache.begin()
+            user_ids = set()
+            for order in misses:
+                if order.constructor_id:
+                    user_ids.add(order.constructor_id)
+                if order.manager_id:
+                    user_ids.add(order.manager_id)
+
+            users_by_id = {}
+            if user_ids:
+                # populate_existing makes sure salary settings are fresh even if
+                # the user object is already in the session identity map.
+                users = session.exec(
+                    select(User)
+                    .where(User.id.in_(user_ids))
+                    .execution_options(populate_existing=True)
+                ).all()
+                users_by_id = {user.id: user for user in users}
+
+            unpaid_by_order = sum_unpaid_deductions_by_order(session, [order.id for order in misses])
+
+            for order in misses:
+                unpaid = unpaid_by_order.get(order.id) or {"constructor": 0.0, "manager": 0.0}
+                constructor_financials = calculate_constructor_financials(
+                    order,
+                    constructor=users_by_id.get(order.constructor_id),
+                    unpaid_deductions=unpaid["constructor"],
+                )
+                manager_financials = calculate_manager_financials(
+                    order,
+                    manager=users_by_id.get(order.manager_id),
+                    unpaid_deductions=unpaid["manager"],
+                )
+                financials_cache.put(order, constructor_financials, manager_financials, generation=generation)
+                financials_by_order[order.id] = (constructor_financials, manager_financials)
+
+        return [cls.from_financials(order, *financials_by_order[order.id]) for order in orders]
+
+    @classmethod
+    def from_financials(cls, order: Order, constructor_financials: dict, manager_financials: dict):
+        bonus = constructor_financials["bonus"]
         manager_bonus = manager_financials["active_amount"]
         manager_remaining = manager_financials["current_debt"]
 
@@ -322,16 +422,14 @@ class OrderRead(OrderBase):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         # Calculate current_debt: sum of remaining amounts for ACTIVE but UNPAID stages
-        current_debt = 0.0
-        # If work started but advance not fully paid
-        if self.date_to_work and (self.advance_remaining > 0.01):
-             current_debt += self.advance_remaining
-        # If installation done but final not fully paid
-        if self.date_installation and (self.final_remaining > 0.01):
-             current_debt += self.final_remaining
-             
-        current_debt -= getattr(self, "unabsorbed_deductions", 0.0) or 0.0
-              
+        current_debt = calculate_order_current_debt(
+            advance_remaining=self.advance_remaining,
+            final_remaining=self.final_remaining,
+            unabsorbed_deductions=getattr(self, "unabsorbed_deductions", 0.0),
+            stage1_active=bool(self.date_to_work),
+            stage2_active=bool(self.date_installation),
+        )
+
         object.__setattr__(self, 'current_debt', current_debt)
 
 # Deduction Pydantic Models
@@ -394,8 +492,31 @@ class OrderCalculationHistoryItemRead(BaseModel):
     stage: Optional[str] = None
     snapshot: OrderCalculationSnapshotRead
 
+# Materialized order financials (recomputed on every write that affects them)
+class OrderFinancials(SQLModel, table=True):
+    __tablename__ = "order_financials"
+
+    order_id: int = Field(primary_key=True)  # Same id as "order"; kept in sync by financials_service
+    bonus: float = Field(default=0.0)
+    advance_amount: float = Field(default=0.0)
+    final_amount: float = Field(default=0.0)
+    advance_remaining: float = Field(default=0.0)
+    final_remaining: float = Field(default=0.0)
+    current_debt: float = Field(default=0.0, index=True)
+    unpaid_deductions: float = Field(default=0.0)
+    remainder_amount: float = Field(default=0.0)  # Used by the archived filter
+    manager_bonus: float = Field(default=0.0)
+    manager_total_bonus: float = Field(default=0.0)
+    manager_current_debt: float = Field(default=0.0, index=True)
+    manager_unpaid_deductions: float = Field(default=0.0)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
 # Activity Log Model
 class ActivityLog(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_activitylog_timestamp_id", "timestamp", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     timestamp: date = Field(default_factory=date.today) # Use datetime if time is needed, but for now date is consistent with other models
     action_type: str  # e.g., "CREATE", "DELETE", "UPDATE", "PAYMENT"
@@ -412,11 +533,13 @@ class ActivityLogRead(BaseModel):
 # Order File Model (Links to external storage like Google Drive)
 class OrderFile(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    order_id: int = Field(foreign_key="order.id")
+    order_id: int = Field(foreign_key="order.id", index=True)
     name: str
     url: str
     folder_name: str
     upload_date: date = Field(default_factory=date.today)
+    size: Optional[int] = None  # Uploaded files only (not external links)
+    content_hash: Optional[str] = None  # sha256 hex
 
 class OrderFileCreate(BaseModel):
     name: str
@@ -430,3 +553,53 @@ class OrderFileRead(BaseModel):
     url: str
     folder_name: str
     upload_date: date
+    size: Optional[int] = None
+    content_hash: Optional[str] = None
+
+# Search result (GET /search)
+class SearchResultRead(BaseModel):
+    type: str  # "order" | "payment" | "deduction"
+    id: int
+    order_id: Optional[int] = None
+    order_name: Optional[str] = None
+    text: str
+    highlight: str  # HTML-escaped text with <mark>...</mark> around matches
+    score: float
+
+# Outgoing Telegram messages (see telegram_dispatcher.py). Written in the
+# same transaction as the change they report, sent by a background dispatcher.
+class NotificationOutbox(SQLModel, table=True):
+    __tablename__ = "notification_outbox"
+    __table_args__ = (
+        Index("ix_notification_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    chat_id: str
+    text: str
+    # message: sent as is; payment/deduction: payload (JSON) can be merged
+    # into a summary with other pending rows of the same chat
+    kind: str = Field(default="message")
+    payload: Optional[str] = None
+    status: str = Field(default="pending")  # pending, sent, failed; held (waits for the daily digest), digested
+    attempts: int = Field(default=0)
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    sent_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+
+# Applied schema migrations (see schema_migrations.py)
+class SchemaMigration(SQLModel, table=True):
+    __tablename__ = "schema_migrations"
+
+    version: int = Field(primary_key=True)
+    name: str
+    applied_at: datetime = Field(default_factory=datetime.utcnow)
+
+# Fingerprint of the schema the migrations produced; lets startup skip migrate()
+class SchemaState(SQLModel, table=True):
+    __tablename__ = "schema_state"
+
+    id: int = Field(default=1, primary_key=True)
+    fingerprint: str
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
@@ -0,0 +1,159 @@
+import html
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import update
+from sqlmodel import Session, select
+from database import engine
+from models import NotificationOutbox
+
+# Per-recipient merging of payment/deduction notifications.
+#
+# Coalescing: such rows are queued TELEGRAM_COALESCE_SECONDS in the future.
+# When the first one of a chat is due, the dispatcher also claims every
+# other pending payment/deduction row of that chat and sends one summary
+# instead of a message per allocation (one distribute_all_unallocated pass
+# can pay dozens of orders of one constructor).
+#
+# Daily digest: for users with telegram_digest the rows are stored as
+# "held". Once a day, after TELEGRAM_DIGEST_HOUR (server local time), the
+# builder turns the held rows of each chat into a single digest message.
+TELEGRAM_COALESCE_SECONDS = float(os.environ.get("TELEGRAM_COALESCE_SECONDS", "30"))
+TELEGRAM_DIGEST_HOUR = int(os.environ.get("TELEGRAM_DIGEST_HOUR", "19"))
+
+COALESCIBLE_KINDS = ("payment", "deduction")
+STAGE_LABELS = {"advance": "Аванс", "final": "Фінал", "manager": "Комісія менеджера"}
+# Telegram rejects messages over 4096 characters
+SUMMARY_MAX_ITEMS = 40
+
+
+def _payloads(rows: List[NotificationOutbox]) -> List[Dict[str, Any]]:
+    payloads = []
+    for row in rows:
+        try:
+            payload = json.loads(row.payload) if row.payload else {}
+        except ValueError:
+            payload = {}
+        payload["kind"] = row.kind
+        payloads.append(payload)
+    return payloads
+
+
+def _section(title: str, lines: List[str], total: float) -> List[str]:
+    shown = lines[:SUMMARY_MAX_ITEMS]
+    section = [f"{title} ({len(lines)})", ""] + shown
+    if len(lines) > len(shown):
+        section.append(f"… та ще {len(lines) - len(shown)}")
+    section += ["", f"💰 <b>Разом:</b> {total:.2f} грн"]
+    return section
+
+
+def render_summary(rows: List[NotificationOutbox], title: Optional[str] = None) -> str:
+    """One message for several payment/deduction rows of the same chat."""
+    payments, deductions = [], []
+    for payload in _payloads(rows):
+        (deductions if payload["kind"] == "deduction" else payments).append(payload)
+
+    parts: List[str] = []
+    if title:
+        parts += [title, ""]
+    if payments:
+        lines = []
+        for p in payments:
+            stage = STAGE_LABELS.get(p.get("stage"), "")
+            stage = f" ({stage})" if stage else ""
+            lines.append(f"• {html.escape(str(p.get('order', '')))}{stage}: {float(p.get('amount') or 0):.2f} грн")
+        parts += _section("💸 <b>ОТРИМАНО ОПЛАТИ</b>", lines, sum(float(p.get("amount") or 0) for p in payments))
+    if deductions:
+        if payments:
+            parts.append("")
+        lines = [
+            f"• {html.escape(str(d.get('order', '')))}: {float(d.get('amount') or 0):.2f} грн"
+            f" — {html.escape(str(d.get('description') or ''))}"
+            for d in deductions
+        ]
+        parts += _section("⚠️ <b>ВІДРАХУВАННЯ (ШТРАФИ)</b>", lines, sum(float(d.get("amount") or 0) for d in deductions))
+    parts += ["", "<i>Баланс оновлено.</i>"]
+    return "\n".join(parts)
+
+
+class NotificationDigest:
+    def __init__(self, hour: int = 19):
+        self.hour = hour
+        self._lock = threading.Lock()
+        self._last_cutoff: Optional[datetime] = None
+        self.digests_built = 0
+        self.rows_digested = 0
+
+    def cutoff(self, now: Optional[datetime] = None) -> Optional[datetime]:
+        """Today's digest time as naive UTC (like created_at), or None before it."""
+        now = now or datetime.now()
+        local_cutoff = now.replace(hour=self.hour, minute=0, second=0, microsecond=0)
+        if now < local_cutoff:
+            return None
+        return datetime.utcfromtimestamp(local_cutoff.timestamp())
+
+    def build(self, cutoff: Optional[datetime] = None) -> int:
+        """
+        Turns the held rows created before cutoff into one digest per chat.
+        Returns the number of digests queued. The held rows are switched to
+        "digested" guarded by their status, so concurrent builders (several
+        workers) never queue the same row twice.
+        """
+        cutoff = cutoff or datetime.utcnow()
+        with Session(engine) as session:
+            rows = session.exec(
+                select(NotificationOutbox)
+                .where(NotificationOutbox.status == "held", NotificationOutbox.created_at < cutoff)
+                .order_by(NotificationOutbox.chat_id, NotificationOutbox.id)
+            ).all()
+            by_chat: Dict[str, List[NotificationOutbox]] = {}
+            for row in rows:
+                by_chat.setdefault(row.chat_id, []).append(row)
+            title = f"📊 <b>ЩОДЕННИЙ ПІДСУМОК</b> за {datetime.now().strftime('%d.%m.%Y')}"
+            digests = [
+                (chat_id, [row.id for row in chat_rows], render_summary(chat_rows, title))
+                for chat_id, chat_rows in by_chat.items()
+            ]
+
+            built = 0
+            for chat_id, ids, text in digests:
+                result = session.execute(
+                    update(NotificationOutbox)
+                    .where(NotificationOutbox.id.in_(ids), NotificationOutbox.status == "held")
+                    .values(status="digested")
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount != len(ids):
+                    session.rollback()  # Another worker got there first
+                    continue
+                session.add(NotificationOutbox(chat_id=chat_id, kind="digest", text=text))
+                session.commit()
+                built += 1
+                with self._lock:
+                    self.digests_built += 1
+                    self.rows_digested += len(ids)
+        return built
+
+    def run_if_due(self, now: Optional[datetime] = None) -> int:
+        """Called from the dispatcher loop: builds today's digests once, after the digest hour."""
+        cutoff = self.cutoff(now)
+        if cutoff is None or cutoff == self._last_cutoff:
+            return 0
+        built = self.build(cutoff)
+        self._last_cutoff = cutoff
+        return built
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hour": self.hour,
+            "last_run_cutoff_utc": self._last_cutoff.isoformat() if self._last_cutoff else None,
+            "digests_built": self.digests_built,
+            "rows_digested": self.rows_digested,
+        }
+
+
+notification_digest = NotificationDigest(hour=TELEGRAM_DIGEST_HOUR)
@@ -1,9 +1,145 @@
 from datetime import date, datetime
-from typing import List, Tuple, Optional
-from sqlmodel import Session, select
+from typing import Dict, Iterable, List, Tuple, Optional
+from sqlmodel import Session, select, func, or_
+from sqlalchemy import bindparam, text
 from models import Order, User
 from payments import Payment, PaymentAllocation
-from financial_logic import calculate_constructor_financials, calculate_manager_financials
+from financial_logic import calculate_constructor_financials, calculate_manager_financials, sum_unpaid_deductions_by_order
+
+# Backfills payment.allocated_total from the allocation ledger.
+SYNC_ALLOCATED_TOTAL_SQL = (
+    "UPDATE payment SET allocated_total = COALESCE(("
+    "SELECT SUM(paymentallocation.amount) FROM paymentallocation "
+    "WHERE paymentallocation.payment_id = payment.id"
+    "), 0)"
+)
+
+
+class OpenDebtIndex:
+    """
+    Замовлення з відкритим боргом по активних етапах, згруповані по
+    конструктору і менеджеру.
+
+    Фінанси рахуються в пам'яті з попередньо завантажених користувачів і
+    сум неоплачених штрафів, тому розподіл не робить запитів на кожне
+    замовлення.
+    """
+
+    def __init__(self, orders: List[Order], users_by_id: Dict[int, User], unpaid_by_order: Dict[int, Dict[str, float]]):
+        self.users_by_id = users_by_id
+        self.unpaid_by_order = unpaid_by_order
+        self.orders_by_id: Dict[int, Order] = {}
+        self.by_constructor: Dict[int, List[Order]] = {}
+        self.by_manager: Dict[int, List[Order]] = {}
+        self.all_orders: List[Order] = []
+
+        for order in sorted(orders, key=lambda o: o.id):
+            # Оплачені суми лише зростають під час розподілу, тому замовлення
+            # без боргу на старті вже не отримає коштів у цьому проході.
+            if not self.has_open_debt(order):
+                continue
+            self.orders_by_id[order.id] = order
+            self.all_orders.append(order)
+            if order.constructor_id:
+                self.by_constructor.setdefault(order.constructor_id, []).append(order)
+            if order.manager_id:
+                self.by_manager.setdefault(order.manager_id, []).append(order)
+
+    @classmethod
+    def load(
+        cls,
+        session: Session,
+        payments: List[Payment],
+        order_ids: Optional[Iterable[int]] = None,
+    ) -> "OpenDebtIndex":
+        """Завантажує лише замовлення, на які можуть піти кошти з payments."""
+        query = select(Order).where(
+            or_(
+                Order.date_to_work.is_not(None),
+                Order.date_installation.is_not(None),
+                Order.date_manager_handover.is_not(None),
+            )
+        )
+
+        has_general_payment = any(
+            not (p.manual_order_id or p.constructor_id or p.manager_id) for p in payments
+        )
+        if not has_general_payment:
+            manual_ids = {p.manual_order_id for p in payments if p.manual_order_id}
+            constructor_ids = {p.constructor_id for p in payments if not p.manual_order_id and p.constructor_id}
+            manager_ids = {
+                p.manager_id for p in payments
+                if not p.manual_order_id and not p.constructor_id and p.manager_id
+            }
+            scope = []
+            if manual_ids:
+                scope.append(Order.id.in_(manual_ids))
+            if constructor_ids:
+                scope.append(Order.constructor_id.in_(constructor_ids))
+            if manager_ids:
+                scope.append(Order.manager_id.in_(manager_ids))
+            if not scope:
+                return cls([], {}, {})
+            query = query.where(or_(*scope))
+
+        if order_ids is not None:
+            order_ids = list(order_ids)
+            if not order_ids:
+                return cls([], {}, {})
+            query = query.where(Order.id.in_(order_ids))
+
+        orders = session.exec(query.order_by(Order.id.asc())).all()
+
+        user_ids = {o.constructor_id for o in orders if o.constructor_id} | {o.manager_id for o in orders if o.manager_id}
+        users_by_id = {}
+        if user_ids:
+            users_by_id = {u.id: u for u in session.exec(select(User).where(User.id.in_(user_ids))).all()}
+
+        unpaid_by_order = sum_unpaid_deductions_by_order(session, [o.id for o in orders])
+        return cls(orders, users_by_id, unpaid_by_order)
+
+    def financials(self, order: Order) -> Tuple[float, float, float, dict]:
+        """Те саме, що PaymentDistributionService._calculate_financials, але без запитів."""
+        unpaid = self.unpaid_by_order.get(order.id) or {}
+        constructor_financials = calculate_constructor_financials(
+            order,
+            constructor=self.users_by_id.get(order.constructor_id),
+            unpaid_deductions=unpaid.get("constructor", 0.0),
+        )
+        manager_financials = calculate_manager_financials(
+            order,
+            manager=self.users_by_id.get(order.manager_id),
+            unpaid_deductions=unpaid.get("manager", 0.0),
+        )
+        return (
+            constructor_financials["bonus"],
+            constructor_financials["advance_amount"],
+            constructor_financials["final_amount"],
+            manager_financials,
+        )
+
+    def has_open_debt(self, order: Order) -> bool:
+        _, advance_amount, final_amount, manager_financials = self.financials(order)
+        if order.date_to_work and advance_amount - order.advance_paid_amount > 0.01:
+            return True
+        if order.date_installation and final_amount - order.final_paid_amount > 0.01:
+            return True
+        return manager_financials["current_debt"] > 0.01
+
+    def candidates(self, payment: Payment) -> List[Order]:
+        """Цільові замовлення платежу в порядку FIFO (старіші спочатку)."""
+        # Пріоритет 1: Ручний вибір конкретного замовлення
+        if payment.manual_order_id:
+            order = self.orders_by_id.get(payment.manual_order_id)
+            return [order] if order else []
+        # Пріоритет 2: Фільтрація по конструктору
+        if payment.constructor_id:
+            return self.by_constructor.get(payment.constructor_id, [])
+        # Пріоритет 3: Фільтрація по менеджеру
+        if payment.manager_id:
+            return self.by_manager.get(payment.manager_id, [])
+        return self.all_orders
+
 
 class PaymentDistributionService:
     """Сервіс для автоматичного розподілу платежів"""
@@ -122,76 +258,108 @@ class PaymentDistributionService:
         
         return remaining, allocations
 
+    @staticmethod
+    def sync_allocated_totals(session: Session, payment_ids: Optional[Iterable[int]] = None):
+        """
+        Перераховує payment.allocated_total з таблиці PaymentAllocation.
+        Викликати після масового видалення/зміни розподілів в обхід сервісу.
+        """
+        if payment_ids is None:
+            session.execute(text(SYNC_ALLOCATED_TOTAL_SQL))
+        else:
+            payment_ids = [pid for pid in set(payment_ids) if pid is not None]
+            if not payment_ids:
+                return
+            session.execute(
+                text(f"{SYNC_ALLOCATED_TOTAL_SQL} WHERE payment.id IN :payment_ids")
+                .bindparams(bindparam("payment_ids", expanding=True)),
+                {"payment_ids": payment_ids},
+            )
+
+        # Сирий SQL не оновлює вже завантажені об'єкти, а commit їх більше
+        # не експайрить (expire_on_commit=False), тому перечитуємо явно.
+        for obj in list(session.identity_map.values()):
+            if isinstance(obj, Payment) and (payment_ids is None or obj.id in payment_ids):
+                session.expire(obj, ["allocated_total"])
+
+    @staticmethod
+    def release_allocation(session: Session, allocation: PaymentAllocation, amount: float) -> float:
+        """
+        Зменшує (або видаляє) розподіл на amount і повертає кошти у вільний
+        залишок платежу. Повертає фактично звільнену суму.
+        """
+        released = min(amount, allocation.amount)
+        payment = session.get(Payment, allocation.payment_id)
+        if payment:
+            payment.allocated_total = max(0.0, (payment.allocated_total or 0.0) - released)
+            session.add(payment)
+
+        if allocation.amount <= amount:
+            session.delete(allocation)
+        else:
+            allocation.amount -= amount
+            session.add(allocation)
+        return released
+
+    @staticmethod
+    def get_payments_with_free_funds(session: Session) -> List[Payment]:
+        """Черга платежів з нерозподіленим залишком (FIFO по даті надходження)."""
+        return session.exec(
+            select(Payment)
+            .where(Payment.amount - func.coalesce(Payment.allocated_total, 0.0) > 0.01)
+            .order_by(Payment.date_received.asc(), Payment.id.asc())
+        ).all()
+
     @staticmethod
     def distribute_all_unallocated(
-        session: Session
+        session: Session,
+        order_ids: Optional[Iterable[int]] = None
     ) -> List[dict]:
         """
         Розподіляє ВСІ вільні кошти з усіх платежів по замовленнях.
         Використовує FIFO: старі платежі закривають старі замовлення.
+
+        Обробляються лише платежі з вільним залишком і лише замовлення з
+        відкритим боргом у їхній зоні. order_ids додатково обмежує
+        кандидатів (наприклад, одним замовленням, у якого змінились дати).
+
+        Лише flush, commit робить викликач.
         """
         all_allocations = []
-        
-        # 1. Отримуємо всі платежі
-        payments = session.exec(
-            select(Payment).order_by(Payment.date_received.asc(), Payment.id.asc())
-        ).all()
-        
-        # 2. Отримуємо всі замовлення, які потребують оплати (відсортовані: спочатку старі)
-        # We need to fetch fresh state for every allocation loop, but for optimization
-        # we can fetch once and update objects in memory if session is persistent.
-        # But safest is to iterate payments and for each payment try to fill orders.
-        
-        orders = session.exec(
-            select(Order).order_by(Order.id.asc())
-        ).all()
-        
+
+        # 1. Черга платежів з вільними коштами
+        payments = PaymentDistributionService.get_payments_with_free_funds(session)
+        if not payments:
+            return all_allocations
+
+        # 2. Індекс замовлень з відкритим боргом (одним набором запитів)
+        index = OpenDebtIndex.load(session, payments, order_ids=order_ids)
+
         for payment in payments:
             # Рахуємо скільки залишилось у цього платежу
-            existing_allocs = session.exec(
-                select(PaymentAllocation).where(PaymentAllocation.payment_id == payment.id)
-            ).all()
-            used_amount = sum(a.amount for a in existing_allocs)
-            remaining_payment = payment.amount - used_amount
-            
+            remaining_payment = payment.amount - (payment.allocated_total or 0.0)
+
             if remaining_payment <= 0.01:
                 continue
 
-            # Визначаємо цільові замовлення: одне (ручний) чи всі (авто)
-            target_orders = orders
-            
-            # Пріоритет 1: Ручний вибір конкретного замовлення
-            if payment.manual_order_id:
-                manual_order = next((o for o in orders if o.id == payment.manual_order_id), None)
-                if manual_order:
-                    target_orders = [manual_order]
-                else:
-                    # Якщо замовлення не знайдено, не розподіляємо нікуди
-                    target_orders = [] 
-            
-            # Пріоритет 2: Фільтрація по конструктору (якщо це не ручний вибір замовлення)
-            elif payment.constructor_id:
-                # Розподіляти ТІЛЬКИ на замовлення цього конструктора
-                target_orders = [o for o in orders if o.constructor_id == payment.constructor_id] 
-            
-            # Пріоритет 3: Фільтрація по менеджеру
-            elif payment.manager_id:
-                # Розподіляти ТІЛЬКИ на замовлення цього менеджера
-                target_orders = [o for o in orders if o.manager_id == payment.manager_id]
-
-            # Якщо є залишок, пробуємо його розподілити
-            for order in target_orders:
+            for order in index.candidates(payment):
                 if remaining_payment <= 0.01:
                     break
-                    
+
                 # Скільки треба цьому замовленню?
                 amount_allocated, new_allocs = PaymentDistributionService._allocate_payment_chunk_to_order(
-                    order, remaining_payment, session, is_manager_payment=bool(payment.manager_id)
+                    order,
+                    remaining_payment,
+                    session,
+                    is_manager_payment=bool(payment.manager_id),
+                    financials=index.financials(order),
                 )
-                
+
                 if amount_allocated > 0:
                     remaining_payment -= amount_allocated
-                    
+                    payment.allocated_total = (payment.allocated_total or 0.0) + amount_allocated
+                    session.add(payment)
+
                     # Створюємо PaymentAllocation для цього шматка
                     for alloc_data in new_allocs:
                         pa = PaymentAllocation(
@@ -202,8 +370,8 @@ class PaymentDistributionService:
                         )
                         session.add(pa)
                         all_allocations.append(alloc_data)
-        
-        session.commit()
+
+        session.flush()
         return all_allocations
 
     @staticmethod
@@ -211,7 +379,8 @@ class PaymentDistributionService:
         order: Order,
         amount: float,
         session: Session,
-        is_manager_payment: bool = False
+        is_manager_payment: bool = False,
+        financials: Optional[Tuple[float, float, float, dict]] = None
     ) -> Tuple[float, List[dict]]:
         """
         Спроба 'влити' суму amount в замовлення.
@@ -221,8 +390,10 @@ class PaymentDistributionService:
         allocations = []
         remaining_to_give = amount
         
-        # Calculate financials dynamically
-        _, advance_amount, final_amount, manager_financials = PaymentDistributionService._calculate_financials(order, session)
+        # Calculate financials dynamically (or reuse the precomputed snapshot)
+        if financials is None:
+            financials = PaymentDistributionService._calculate_financials(order, session)
+        _, advance_amount, final_amount, manager_financials = financials
         
         if is_manager_payment:
             # Менеджерська виплата
@@ -1,6 +1,7 @@
 from typing import Optional
 from datetime import datetime, date
 from sqlmodel import Field, SQLModel, Relationship
+from sqlalchemy import Index
 
 class Payment(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -8,15 +9,20 @@ class Payment(SQLModel, table=True):
     date_received: date
     created_at: datetime = Field(default_factory=datetime.utcnow)
     allocated_automatically: bool = Field(default=True)
-    manual_order_id: Optional[int] = Field(default=None, foreign_key="order.id")
-    constructor_id: Optional[int] = Field(default=None, foreign_key="user.id")
-    manager_id: Optional[int] = Field(default=None, foreign_key="user.id")
+    manual_order_id: Optional[int] = Field(default=None, foreign_key="order.id", index=True)
+    constructor_id: Optional[int] = Field(default=None, foreign_key="user.id", index=True)
+    manager_id: Optional[int] = Field(default=None, foreign_key="user.id", index=True)
     notes: Optional[str] = None
+    allocated_total: float = Field(default=0.0)  # Сума всіх PaymentAllocation цього платежу
 
 class PaymentAllocation(SQLModel, table=True):
     """Зв'язок платежу з конкретним замовленням і етапом"""
+    __table_args__ = (
+        Index("ix_paymentallocation_order_id_stage", "order_id", "stage"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    payment_id: int = Field(foreign_key="payment.id")
+    payment_id: int = Field(foreign_key="payment.id", index=True)
     order_id: int = Field(foreign_key="order.id")
     stage: str = Field(default="advance")  # "advance" або "final"
     amount: float = Field(default=0.0)
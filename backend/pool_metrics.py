@@ -0,0 +1,99 @@
+import threading
+import time
+from typing import Any, Dict
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+# Connection pool gauges for /admin/metrics.
+#
+# The Timed* pool classes measure how long a checkout waits for a connection
+# (pool exhausted, or connecting with NullPool); checkout/checkin events keep
+# the in-use gauge. Counters are per process, like every other metric here.
+
+
+class PoolMetrics:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.slow_waits = 0  # checkouts that waited longer than 100 ms
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if seconds > 0.1:
+                self.slow_waits += 1
+
+    def install(self, engine):
+        """Counts connections in use on engine (pass async_engine.sync_engine for async)."""
+        @event.listens_for(engine, "checkout")
+        def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+            with self._lock:
+                self.in_use += 1
+                self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+        @event.listens_for(engine, "checkin")
+        def _on_checkin(dbapi_connection, connection_record):
+            with self._lock:
+                self.in_use -= 1
+
+    def stats(self, engine) -> Dict[str, Any]:
+        pool = engine.pool
+        with self._lock:
+            result = {
+                "pool": type(pool).__name__,
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "checkouts": self.checkouts,
+                "checkout_timeouts": self.timeouts,
+                "checkout_wait_avg_ms": (self.wait_total / self.checkouts * 1000) if self.checkouts else 0.0,
+                "checkout_wait_max_ms": self.wait_max * 1000,
+                "slow_checkouts": self.slow_waits,
+            }
+        if isinstance(pool, QueuePool):
+            result.update({
+                "in_use": pool.checkedout(),
+                "size": pool.size(),
+                "idle": pool.checkedin(),
+                "overflow": pool.overflow(),
+                "max_overflow": pool._max_overflow,
+                "timeout_seconds": pool.timeout(),
+            })
+        return result
+
+
+class _TimedCheckout:
+    pool_metrics: PoolMetrics = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            if self.pool_metrics is not None:
+                self.pool_metrics.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        if self.pool_metrics is not None:
+            self.pool_metrics.record_wait(time.perf_counter() - started)
+        return connection
+
+
+def timed_pool_class(base, metrics: PoolMetrics):
+    """Pool class for create_engine(poolclass=...) that reports checkout waits to metrics."""
+    return type(f"Timed{base.__name__}", (_TimedCheckout, base), {"pool_metrics": metrics})
+
+
+sync_pool_metrics = PoolMetrics("sync")
+async_pool_metrics = PoolMetrics("async")
+
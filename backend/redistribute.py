@@ -10,6 +10,7 @@ def run_redistribution():
         try:
             # 1. Delete all current allocations
             session.exec(text("DELETE FROM paymentallocation"))
+            PaymentDistributionService.sync_allocated_totals(session)
             print("Deleted all payment allocations.")
             
             # 2. Reset order paid amounts
@@ -20,6 +21,7 @@ def run_redistribution():
             
             # 3. Redistribute
             allocations = PaymentDistributionService.distribute_all_unallocated(session)
+            session.commit()
             print(f"Redistributed money. Total new allocations: {len(allocations)}")
             
         except Exception as e:
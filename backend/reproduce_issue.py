@@ -42,6 +42,7 @@ def test_deletion_logic():
         # 4. Run Distribution (Simulate API behavior)
         from backend.payment_service import PaymentDistributionService
         PaymentDistributionService.distribute_all_unallocated(session)
+        session.commit()
         
         session.refresh(order)
         print(f"After Payment: Order Paid: {order.advance_paid_amount}/{order.final_paid_amount}")
@@ -76,6 +77,7 @@ def test_deletion_logic():
         
         # C. Re-Distribute
         PaymentDistributionService.distribute_all_unallocated(session)
+        session.commit()
         
         # 6. VERIFY
         session.refresh(order)
@@ -1,22 +1,38 @@
 import os
-import shutil
+import base64
+import json
+import time
 from typing import List, Optional
 from datetime import date, datetime, timedelta
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, UploadFile, File, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlmodel import Session, select, desc, asc
-from sqlalchemy import text
-from database import get_session
-from models import Order, OrderCreate, OrderRead, OrderUpdate, Deduction, DeductionCreate, DeductionRead, DeductionUpdate, ActivityLog, ActivityLogRead, OrderFile, OrderFileCreate, OrderFileRead, User, UserCreate, UserRead, UserUpdate, OrderCalculationHistoryItemRead
+from sqlalchemy import text, func, or_, and_, not_
+from database import get_session, run_read, engine, async_engine, SQLITE_PATH, DB_PGBOUNCER, DB_POOL_PRE_PING
+from pool_metrics import sync_pool_metrics, async_pool_metrics
+from sqlite_tuning import sqlite_tuning
+from models import Order, OrderCreate, OrderRead, OrderUpdate, OrderFinancials, Deduction, DeductionCreate, DeductionRead, DeductionUpdate, ActivityLog, ActivityLogRead, OrderFile, OrderFileCreate, OrderFileRead, User, UserCreate, UserRead, UserUpdate, OrderCalculationHistoryItemRead, SearchResultRead
 from payments import Payment, PaymentAllocation, PaymentRead
 from payment_service import PaymentDistributionService
-from financial_logic import build_constructor_financial_snapshot, resolve_constructor_base_financials, calculate_manager_financials
+from stats_service import FinancialStatsService
+from financial_cache import financials_cache
+from activity_log import activity_log_writer
+from backup_service import BackupService, RestoreService, BackupFormatError, restore_progress
+from financials_service import OrderFinancialsService
+from search_service import SearchService, SEARCH_DOC_TYPES
+from schema_migrations import run_migrations
+from financial_logic import build_constructor_financial_snapshot, resolve_constructor_base_financials
 from pydantic import BaseModel
-from auth import get_current_user, get_admin_user, get_super_admin_user, get_manager_user, create_access_token, verify_password, get_password_hash, ACCESS_TOKEN_EXPIRE_MINUTES
+from auth import get_current_user, get_admin_user, get_super_admin_user, get_manager_user, create_access_token, verify_password_async, get_password_hash_async, password_pool_stats, user_token_version, ACCESS_TOKEN_EXPIRE_MINUTES, TOKEN_USER_VERSION_ENABLED
+from auth_cache import auth_user_cache
 from settings import load_settings, save_settings, Settings
 from file_utils import ensure_project_structure, get_file_path, sanitize_filename, normalize_folder_category
 from telegram_service import TelegramService
+from telegram_dispatcher import telegram_dispatcher
+from upload_service import StreamingUpload, UploadError, upload_limit, upload_stats
+from file_store import file_store, is_sha256, stored_file_path
 
 router = APIRouter()
 
@@ -133,20 +149,28 @@ def filter_allocations_for_user(
 
 # --- AUTH ROUTES ---
 
+def find_login_user(session: Session, login_value: str) -> Optional[User]:
+    user = session.exec(select(User).where(User.username == login_value)).first()
+    # Support login by email as well, because users often enter email in the login field.
+    if not user and "@" in login_value:
+        user = session.exec(select(User).where(User.email == login_value)).first()
+    # Nothing to write: end the read transaction so the pooled connection is
+    # not held while the password is checked (a login storm would drain the pool).
+    session.commit()
+    return user
+
 @router.post("/token")
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session, scope="function")):
     print(f"--- LOGIN ATTEMPT ---")
     login_value = (form_data.username or "").strip()
     print(f"Username received: '{login_value}'")
 
-    user = session.exec(select(User).where(User.username == login_value)).first()
-    # Support login by email as well, because users often enter email in the login field.
-    if not user and "@" in login_value:
-        user = session.exec(select(User).where(User.email == login_value)).first()
+    user = await run_in_threadpool(find_login_user, session, login_value)
 
     is_valid = False
     if user:
-        is_valid = verify_password(form_data.password, user.password_hash)
+        # bcrypt runs on the password pool, the event loop keeps serving requests
+        is_valid = await verify_password_async(form_data.password, user.password_hash)
 
     if not user or not is_valid:
         raise HTTPException(
@@ -163,23 +187,21 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), ses
     
     print("LOGIN SUCCESS")
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username, "role": user.role}, expires_delta=access_token_expires
-    )
+    token_data = {"sub": user.username, "role": user.role}
+    if TOKEN_USER_VERSION_ENABLED:
+        token_data["uv"] = user_token_version(user)
+    access_token = create_access_token(data=token_data, expires_delta=access_token_expires)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/users/me", response_model=UserRead)
 def read_users_me(current_user: User = Depends(get_current_user)):
     return current_user
 
-# Admin only: Create User
-@router.post("/users", response_model=UserRead)
-def create_user(user: UserCreate, current_user: User = Depends(get_admin_user), session: Session = Depends(get_session)):
+def insert_user(session: Session, user: UserCreate, hashed_password: str) -> User:
     db_user = session.exec(select(User).where(User.username == user.username)).first()
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    hashed_password = get_password_hash(user.password)
     new_user = User(
         username=user.username,
         password_hash=hashed_password,
@@ -190,12 +212,19 @@ def create_user(user: UserCreate, current_user: User = Depends(get_admin_user),
         phone_number=user.phone_number
     )
     session.add(new_user)
-    session.commit()
-    session.refresh(new_user)
+    session.flush()
     return new_user
 
+# Admin only: Create User
+@router.post("/users", response_model=UserRead)
+async def create_user(user: UserCreate, current_user: User = Depends(get_admin_user), session: Session = Depends(get_session, scope="function")):
+    # Hash first: no database connection is held while bcrypt runs
+    hashed_password = await get_password_hash_async(user.password)
+    # Database work runs in the threadpool, the event loop keeps serving requests
+    return await run_in_threadpool(insert_user, session, user, hashed_password)
+
 @router.delete("/users/{user_id}")
-def delete_user(user_id: int, current_user: User = Depends(get_admin_user), session: Session = Depends(get_session)):
+def delete_user(user_id: int, current_user: User = Depends(get_admin_user), session: Session = Depends(get_session, scope="function")):
     user_to_delete = session.get(User, user_id)
     if not user_to_delete:
         raise HTTPException(status_code=404, detail="User not found")
@@ -206,6 +235,11 @@ def delete_user(user_id: int, current_user: User = Depends(get_admin_user), sess
         
     username = user_to_delete.username
     
+    # Their orders fall back to default rates once unlinked
+    OrderFinancialsService.mark_orders(session, session.exec(
+        select(Order.id).where((Order.constructor_id == user_id) | (Order.manager_id == user_id))
+    ).all())
+
     # Logic: If user is deleted, we should UNLINK them from orders and payments
     # (Setting to NULL instead of deleting orders/money)
     session.execute(text('UPDATE "order" SET constructor_id = NULL WHERE constructor_id = :user_id'), {"user_id": user_id})
@@ -214,13 +248,13 @@ def delete_user(user_id: int, current_user: User = Depends(get_admin_user), sess
     session.execute(text("UPDATE payment SET manager_id = NULL WHERE manager_id = :user_id"), {"user_id": user_id})
     
     session.delete(user_to_delete)
-    session.commit()
+    financials_cache.invalidate_all()
     
     log_activity(session, "DELETE_USER", f"Видалено користувача '{username}' (Видалив: {current_user.username})")
     return {"message": "User deleted successfully"}
 
 @router.get("/users", response_model=List[UserRead])
-def read_users(current_user: User = Depends(get_manager_user), session: Session = Depends(get_session)):
+def read_users(current_user: User = Depends(get_manager_user), session: Session = Depends(get_session, scope="function")):
     users = session.exec(select(User)).all()
     return users
 
@@ -233,413 +267,24 @@ class PaymentCreate(BaseModel):
     constructor_id: Optional[int] = None # Якщо вказано, розподіл по замовленнях цього конструктора
     manager_id: Optional[int] = None # Якщо вказано, розподіл по замовленнях цього менеджера
 
-PAYMENT_SCHEMA_PATCHES = [
-    ("allocated_automatically", "ALTER TABLE payment ADD COLUMN allocated_automatically BOOLEAN DEFAULT TRUE"),
-    ("notes", "ALTER TABLE payment ADD COLUMN notes TEXT"),
-    ("manual_order_id", "ALTER TABLE payment ADD COLUMN manual_order_id INTEGER"),
-    ("constructor_id", "ALTER TABLE payment ADD COLUMN constructor_id INTEGER"),
-    ("manager_id", "ALTER TABLE payment ADD COLUMN manager_id INTEGER"),
-]
-
-ORDER_PLANNING_SCHEMA_PATCHES = [
-    (
-        "date_manager_handover",
-        (
-            'ALTER TABLE "order" ADD COLUMN date_manager_handover DATE',
-            "ALTER TABLE order ADD COLUMN date_manager_handover DATE",
-        ),
-    ),
-    (
-        "constructive_days",
-        (
-            'ALTER TABLE "order" ADD COLUMN constructive_days INTEGER DEFAULT 5',
-            "ALTER TABLE order ADD COLUMN constructive_days INTEGER DEFAULT 5",
-        ),
-    ),
-    (
-        "complectation_days",
-        (
-            'ALTER TABLE "order" ADD COLUMN complectation_days INTEGER DEFAULT 2',
-            "ALTER TABLE order ADD COLUMN complectation_days INTEGER DEFAULT 2",
-        ),
-    ),
-    (
-        "preassembly_days",
-        (
-            'ALTER TABLE "order" ADD COLUMN preassembly_days INTEGER DEFAULT 1',
-            "ALTER TABLE order ADD COLUMN preassembly_days INTEGER DEFAULT 1",
-        ),
-    ),
-    (
-        "installation_days",
-        (
-            'ALTER TABLE "order" ADD COLUMN installation_days INTEGER DEFAULT 3',
-            "ALTER TABLE order ADD COLUMN installation_days INTEGER DEFAULT 3",
-        ),
-    ),
-    (
-        "constructive_start_date",
-        (
-            'ALTER TABLE "order" ADD COLUMN constructive_start_date DATE',
-            "ALTER TABLE order ADD COLUMN constructive_start_date DATE",
-        ),
-    ),
-    (
-        "constructive_end_date",
-        (
-            'ALTER TABLE "order" ADD COLUMN constructive_end_date DATE',
-            "ALTER TABLE order ADD COLUMN constructive_end_date DATE",
-        ),
-    ),
-    (
-        "complectation_start_date",
-        (
-            'ALTER TABLE "order" ADD COLUMN complectation_start_date DATE',
-            "ALTER TABLE order ADD COLUMN complectation_start_date DATE",
-        ),
-    ),
-    (
-        "complectation_end_date",
-        (
-            'ALTER TABLE "order" ADD COLUMN complectation_end_date DATE',
-            "ALTER TABLE order ADD COLUMN complectation_end_date DATE",
-        ),
-    ),
-    (
-        "preassembly_start_date",
-        (
-            'ALTER TABLE "order" ADD COLUMN preassembly_start_date DATE',
-            "ALTER TABLE order ADD COLUMN preassembly_start_date DATE",
-        ),
-    ),
-    (
-        "preassembly_end_date",
-        (
-            'ALTER TABLE "order" ADD COLUMN preassembly_end_date DATE',
-            "ALTER TABLE order ADD COLUMN preassembly_end_date DATE",
-        ),
-    ),
-    (
-        "installation_start_date",
-        (
-            'ALTER TABLE "order" ADD COLUMN installation_start_date DATE',
-            "ALTER TABLE order ADD COLUMN installation_start_date DATE",
-        ),
-    ),
-    (
-        "installation_end_date",
-        (
-            'ALTER TABLE "order" ADD COLUMN installation_end_date DATE',
-            "ALTER TABLE order ADD COLUMN installation_end_date DATE",
-        ),
-    ),
-]
-
-DEDUCTION_SCHEMA_PATCHES = [
-    (
-        "target_role",
-        (
-            "ALTER TABLE deduction ADD COLUMN target_role VARCHAR DEFAULT 'constructor'",
-            "UPDATE deduction SET target_role = 'constructor' WHERE target_role IS NULL OR target_role = ''",
-        ),
-    ),
-]
-
-
-def ensure_payment_schema(session: Session):
-    """Hot-fix old databases that miss newer payment columns."""
-    for column_name, alter_sql in PAYMENT_SCHEMA_PATCHES:
-        try:
-            session.exec(text(f"SELECT {column_name} FROM payment LIMIT 1"))
-        except Exception:
-            session.rollback()
-            try:
-                session.connection().execute(text(alter_sql))
-                session.commit()
-            except Exception as e:
-                session.rollback()
-                err = str(e).lower()
-                if "already exists" in err or "duplicate column" in err:
-                    continue
-                raise
-
-
-def ensure_order_planning_schema(session: Session):
-    """Ensure planning columns exist on older databases."""
-    for column_name, alter_sqls in ORDER_PLANNING_SCHEMA_PATCHES:
-        try:
-            session.exec(text(f'SELECT {column_name} FROM "order" LIMIT 1'))
-            continue
-        except Exception:
-            session.rollback()
-
-        for sql in alter_sqls:
-            try:
-                session.connection().execute(text(sql))
-                session.commit()
-                break
-            except Exception as e:
-                session.rollback()
-                err = str(e).lower()
-                if "already exists" in err or "duplicate column" in err:
-                    break
-
-
-def ensure_deduction_schema(session: Session):
-    """Ensure deduction target columns exist on older databases."""
-    for column_name, sql_steps in DEDUCTION_SCHEMA_PATCHES:
-        try:
-            session.exec(text(f"SELECT {column_name} FROM deduction LIMIT 1"))
-            continue
-        except Exception:
-            session.rollback()
-
-        for sql in sql_steps:
-            try:
-                session.connection().execute(text(sql))
-                session.commit()
-            except Exception as e:
-                session.rollback()
-                err = str(e).lower()
-                if "already exists" in err or "duplicate column" in err:
-                    continue
-
-
 def log_activity(session: Session, action_type: str, description: str, details: Optional[str] = None):
+    # Queued when the request commits, written in batches (activity_log.py)
     try:
-        log = ActivityLog(action_type=action_type, description=description, details=details)
-        session.add(log)
-        session.commit()
+        activity_log_writer.write_on_commit(session, action_type, description, details)
     except Exception as e:
         print(f"Failed to log activity: {e}")
 
 @router.get("/fix-db")
 def fix_database_schema(
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_session, scope="function"),
     current_user: User = Depends(get_super_admin_user)
 ):
-    logs = []
-    
-    # helper to run command
-    def run_sql(sql):
-        try:
-            # 💡 SQLite doesn't support 'IF NOT EXISTS' in ALTER TABLE
-            # If we detect it and we are on SQLite, we might need a workaround.
-            # But the simplest is to try with it, and if it fails with syntax, try without.
-            session.connection().execute(text(sql))
-            session.commit()
-            logs.append(f"SUCCESS: {sql}")
-        except Exception as e:
-            session.rollback()
-            err_msg = str(e).lower()
-            
-            # If it failed because of IF NOT EXISTS syntax (sqlite error)
-            if "if not exists" in sql.lower() and ("syntax error" in err_msg or "near \"exists\"" in err_msg):
-                # Try stripping IF NOT EXISTS
-                cleaned_sql = sql.replace("IF NOT EXISTS ", "").replace("if not exists ", "")
-                try:
-                    session.connection().execute(text(cleaned_sql))
-                    session.commit()
-                    logs.append(f"SUCCESS (cleaned): {cleaned_sql}")
-                    return
-                except Exception as e2:
-                    session.rollback()
-                    err_msg2 = str(e2).lower()
-                    # If it already exists, that's actually success for an "IF NOT EXISTS" intent
-                    if "duplicate column" in err_msg2 or "already exists" in err_msg2:
-                        logs.append(f"SKIPPED (already exists): {cleaned_sql}")
-                        return
-                    logs.append(f"FAILED (cleaned): {cleaned_sql} | Error: {str(e2)}")
-            
-            # If it failed because column already exists (postgres or cleaned sqlite)
-            if "already exists" in err_msg or "duplicate column" in err_msg:
-                logs.append(f"SKIPPED (already exists): {sql}")
-            else:
-                logs.append(f"FAILED: {sql} | Error: {str(e)}")
+    """Ручне виправлення схеми: повторно застосовує всі міграції (вони ідемпотентні)."""
+    logs = ["--- RE-APPLYING SCHEMA MIGRATIONS ---"]
+    logs.extend(run_migrations(session, reapply=True))
+    financials_cache.invalidate_all()
 
-    logs.append("--- STARTING MANUAL MIGRATION (VERSION 3 - QUOTED USER) ---")
-    
-    # 1. Constructor ID
-    logs.append("Attempting to add constructor_id...")
-    # Postgres specific try
-    run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS constructor_id INTEGER')
-    # Fallback (simple)
-    run_sql('ALTER TABLE order ADD COLUMN constructor_id INTEGER')
-
-    # 2. Date Design Deadline
-    logs.append("Attempting to add date_design_deadline...")
-    run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS date_design_deadline DATE')
-    run_sql('ALTER TABLE order ADD COLUMN date_design_deadline DATE')
-
-    logs.append("Attempting to add date_manager_handover...")
-    run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS date_manager_handover DATE')
-    run_sql('ALTER TABLE order ADD COLUMN date_manager_handover DATE')
-    
-    # 2b. Planned Installation Date (Manager View)
-    logs.append("Attempting to add date_installation_plan...")
-    run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS date_installation_plan DATE')
-    run_sql('ALTER TABLE order ADD COLUMN date_installation_plan DATE')
-
-    # 2b2. Planned Installation Duration (days)
-    logs.append("Attempting to add installation_days...")
-    run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS installation_days INTEGER DEFAULT 3')
-    run_sql('ALTER TABLE order ADD COLUMN installation_days INTEGER DEFAULT 3')
-
-    # 2b3. Planned stage durations for Gantt pipeline
-    logs.append("Attempting to add constructive/complectation/preassembly days...")
-    run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS constructive_days INTEGER DEFAULT 5')
-    run_sql('ALTER TABLE order ADD COLUMN constructive_days INTEGER DEFAULT 5')
-    run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS complectation_days INTEGER DEFAULT 2')
-    run_sql('ALTER TABLE order ADD COLUMN complectation_days INTEGER DEFAULT 2')
-    run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS preassembly_days INTEGER DEFAULT 1')
-    run_sql('ALTER TABLE order ADD COLUMN preassembly_days INTEGER DEFAULT 1')
-    
-    # 2c. Material Cost
-    logs.append("Attempting to add material_cost...")
-    run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS material_cost FLOAT DEFAULT 0.0')
-    run_sql('ALTER TABLE order ADD COLUMN material_cost REAL DEFAULT 0.0')
-    
-    # 2d. Manager ID
-    logs.append("Attempting to add manager_id...")
-    run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS manager_id INTEGER')
-    run_sql('ALTER TABLE order ADD COLUMN manager_id INTEGER')
-    
-    # 2e. Manager Paid Amount
-    logs.append("Attempting to add manager_paid_amount...")
-    run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS manager_paid_amount FLOAT DEFAULT 0.0')
-    run_sql('ALTER TABLE order ADD COLUMN manager_paid_amount REAL DEFAULT 0.0')
-    
-    # 2f. Date Manager Paid
-    logs.append("Attempting to add date_manager_paid...")
-    run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS date_manager_paid DATE')
-    run_sql('ALTER TABLE order ADD COLUMN date_manager_paid DATE')
-    
-    # 2d. Fixed Bonus and Custom Stage Percentages
-    logs.append("Attempting to add fixed_bonus and custom stage percentages...")
-    run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS fixed_bonus FLOAT')
-    run_sql('ALTER TABLE order ADD COLUMN fixed_bonus REAL')
-    
-    run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS custom_stage1_percent FLOAT')
-    run_sql('ALTER TABLE order ADD COLUMN custom_stage1_percent REAL')
-    
-    run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS custom_stage2_percent FLOAT')
-    run_sql('ALTER TABLE order ADD COLUMN custom_stage2_percent REAL')
-
-    # 3. Payment Columns (allocated_automatically, notes, manual_order_id)
-    logs.append("Checking Payment table columns...")
-    run_sql('ALTER TABLE payment ADD COLUMN IF NOT EXISTS allocated_automatically BOOLEAN DEFAULT TRUE')
-    run_sql('ALTER TABLE payment ADD COLUMN allocated_automatically BOOLEAN DEFAULT 1') 
-    
-    run_sql('ALTER TABLE payment ADD COLUMN IF NOT EXISTS notes VARCHAR')
-    run_sql('ALTER TABLE payment ADD COLUMN notes TEXT')
-    
-    run_sql('ALTER TABLE payment ADD COLUMN IF NOT EXISTS manual_order_id INTEGER REFERENCES "order"(id)')
-    # Fallback without FK (safest for SQLite updates)
-    run_sql('ALTER TABLE payment ADD COLUMN manual_order_id INTEGER')
-    
-    run_sql('ALTER TABLE payment ADD COLUMN IF NOT EXISTS constructor_id INTEGER REFERENCES "user"(id)')
-    run_sql('ALTER TABLE payment ADD COLUMN constructor_id INTEGER')
-    
-    run_sql('ALTER TABLE payment ADD COLUMN IF NOT EXISTS manager_id INTEGER REFERENCES "user"(id)')
-    run_sql('ALTER TABLE payment ADD COLUMN manager_id INTEGER')
-
-    # 4. User Columns (card_number, email)
-    logs.append("Checking User table columns...")
-    
-    # Try multiple variants for the table name
-    user_variants = ['"user"', 'public."user"', 'user']
-    
-    for variant in user_variants:
-        try:
-            logs.append(f"Trying table name: {variant}")
-            # Use distinct run for each column to avoid one failure blocking others
-            run_sql(f'ALTER TABLE {variant} ADD COLUMN IF NOT EXISTS card_number VARCHAR')
-            run_sql(f'ALTER TABLE {variant} ADD COLUMN IF NOT EXISTS email VARCHAR')
-            run_sql(f'ALTER TABLE {variant} ADD COLUMN IF NOT EXISTS phone_number VARCHAR')
-            run_sql(f'ALTER TABLE {variant} ADD COLUMN IF NOT EXISTS telegram_id VARCHAR')
-            
-            # Additional User Columns (v1.5)
-            run_sql(f"ALTER TABLE {variant} ADD COLUMN IF NOT EXISTS salary_mode VARCHAR DEFAULT 'sales_percent'")
-            run_sql(f"ALTER TABLE {variant} ADD COLUMN IF NOT EXISTS salary_percent FLOAT DEFAULT 5.0")
-            run_sql(f"ALTER TABLE {variant} ADD COLUMN IF NOT EXISTS payment_stage1_percent FLOAT DEFAULT 50.0")
-            run_sql(f"ALTER TABLE {variant} ADD COLUMN IF NOT EXISTS payment_stage2_percent FLOAT DEFAULT 50.0")
-            
-            # Manager permissions (v1.6)
-            run_sql(f"ALTER TABLE {variant} ADD COLUMN IF NOT EXISTS can_see_constructor_pay BOOLEAN DEFAULT TRUE")
-            run_sql(f"ALTER TABLE {variant} ADD COLUMN IF NOT EXISTS can_see_stage1 BOOLEAN DEFAULT TRUE")
-            run_sql(f"ALTER TABLE {variant} ADD COLUMN IF NOT EXISTS can_see_stage2 BOOLEAN DEFAULT TRUE")
-            run_sql(f"ALTER TABLE {variant} ADD COLUMN IF NOT EXISTS can_see_debt BOOLEAN DEFAULT TRUE")
-            run_sql(f"ALTER TABLE {variant} ADD COLUMN IF NOT EXISTS can_see_dashboard BOOLEAN DEFAULT TRUE")
-            
-            session.commit()
-            logs.append(f"COMPLETED checks for {variant}")
-            # We don't break anymore because run_sql handles errors individually, 
-            # and we want to try other variants if one completely fails (e.g. table not found)
-            # but actually if run_sql works, it means table exists.
-            # Let's check status of the first run_sql
-            break # If we got here without a fatal table error, we are good.
-        except Exception as e:
-            session.rollback()
-            logs.append(f"Failed with {variant}: {str(e)}")
-            
-    # Also add text columns separately just in case
-    try:
-        variant = '"user"' # Most likely correct
-        session.connection().execute(text(f'ALTER TABLE {variant} ADD COLUMN card_number TEXT'))
-        session.connection().execute(text(f'ALTER TABLE {variant} ADD COLUMN email TEXT'))
-        session.connection().execute(text(f'ALTER TABLE {variant} ADD COLUMN phone_number TEXT'))
-        session.commit()
-    except:
-        session.rollback()
-
-    # 5. Order Columns (v1.5)
-    logs.append("Checking Order table columns (v1.5)...")
-    try:
-        # Check for material_cost
-        run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS material_cost FLOAT DEFAULT 0.0')
-        run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS fixed_bonus FLOAT')
-        run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS custom_stage1_percent FLOAT')
-        run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS custom_stage2_percent FLOAT')
-        
-        # Fallback for unquoted
-        run_sql('ALTER TABLE order ADD COLUMN material_cost FLOAT DEFAULT 0.0')
-        run_sql('ALTER TABLE order ADD COLUMN fixed_bonus FLOAT')
-        run_sql('ALTER TABLE order ADD COLUMN custom_stage1_percent FLOAT')
-        run_sql('ALTER TABLE order ADD COLUMN custom_stage2_percent FLOAT')
-        
-        # v1.6 Manager Plan
-        run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS date_installation_plan DATE')
-        run_sql('ALTER TABLE order ADD COLUMN date_installation_plan DATE')
-        run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS date_manager_handover DATE')
-        run_sql('ALTER TABLE order ADD COLUMN date_manager_handover DATE')
-        run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS constructive_days INTEGER DEFAULT 5')
-        run_sql('ALTER TABLE order ADD COLUMN constructive_days INTEGER DEFAULT 5')
-        run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS complectation_days INTEGER DEFAULT 2')
-        run_sql('ALTER TABLE order ADD COLUMN complectation_days INTEGER DEFAULT 2')
-        run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS preassembly_days INTEGER DEFAULT 1')
-        run_sql('ALTER TABLE order ADD COLUMN preassembly_days INTEGER DEFAULT 1')
-        run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS installation_days INTEGER DEFAULT 3')
-        run_sql('ALTER TABLE order ADD COLUMN installation_days INTEGER DEFAULT 3')
-        run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS constructive_start_date DATE')
-        run_sql('ALTER TABLE order ADD COLUMN constructive_start_date DATE')
-        run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS constructive_end_date DATE')
-        run_sql('ALTER TABLE order ADD COLUMN constructive_end_date DATE')
-        run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS complectation_start_date DATE')
-        run_sql('ALTER TABLE order ADD COLUMN complectation_start_date DATE')
-        run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS complectation_end_date DATE')
-        run_sql('ALTER TABLE order ADD COLUMN complectation_end_date DATE')
-        run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS preassembly_start_date DATE')
-        run_sql('ALTER TABLE order ADD COLUMN preassembly_start_date DATE')
-        run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS preassembly_end_date DATE')
-        run_sql('ALTER TABLE order ADD COLUMN preassembly_end_date DATE')
-        run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS installation_start_date DATE')
-        run_sql('ALTER TABLE order ADD COLUMN installation_start_date DATE')
-        run_sql('ALTER TABLE "order" ADD COLUMN IF NOT EXISTS installation_end_date DATE')
-        run_sql('ALTER TABLE order ADD COLUMN installation_end_date DATE')
-    except:
-        pass
-
-    # 6. Create Default Super Admin if missing
+    # Create Default Super Admin if missing
     logs.append("Checking for super-admin user...")
     try:
         admin_exists = session.exec(select(User).where(User.username == "admin")).first()
@@ -671,18 +316,71 @@ def fix_database_schema(
 
     return {"status": "completed", "logs": logs}
 
+LOGS_PAGE_MAX_LIMIT = 500
+
+
 @router.get("/logs", response_model=List[ActivityLogRead])
-def get_logs(
-    session: Session = Depends(get_session),
+async def get_logs(
+    limit: int = 100,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    action_type: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
     current_user: User = Depends(get_admin_user)
 ):
-    return session.exec(select(ActivityLog).order_by(ActivityLog.timestamp.desc(), ActivityLog.id.desc())).all()
+    """
+    Стрічка подій, новіші першими (індекс (timestamp, id)).
+
+    - before_id: наступна сторінка старіших записів після рядка з цим id;
+    - after_id: лише записи, новіші за останній відомий клієнту id (для опитування);
+    - action_type: один або кілька типів через кому.
+    """
+    limit = max(1, min(limit, LOGS_PAGE_MAX_LIMIT))
+    await run_in_threadpool(activity_log_writer.flush)  # Read-your-writes for queued entries
+    return await run_read(query_logs_page, limit, before_id, after_id, action_type, date_from, date_to)
+
+
+def query_logs_page(
+    session: Session,
+    limit: int,
+    before_id: Optional[int],
+    after_id: Optional[int],
+    action_type: Optional[str],
+    date_from: Optional[date],
+    date_to: Optional[date],
+):
+    query = select(ActivityLog)
+
+    if action_type:
+        action_types = [a.strip() for a in action_type.split(",") if a.strip()]
+        query = query.where(ActivityLog.action_type.in_(action_types))
+    if date_from:
+        query = query.where(ActivityLog.timestamp >= date_from)
+    if date_to:
+        # Inclusive: the whole date_to day
+        query = query.where(ActivityLog.timestamp < date_to + timedelta(days=1))
+
+    if after_id is not None:
+        # Incremental poll: a primary-key range probe, usually empty
+        query = query.where(ActivityLog.id > after_id).order_by(ActivityLog.id.desc())
+        return session.exec(query.limit(limit)).all()
+
+    if before_id is not None:
+        anchor = session.get(ActivityLog, before_id)
+        if anchor is None:
+            raise HTTPException(status_code=400, detail="Unknown before_id")
+        query = query.where(or_(
+            ActivityLog.timestamp < anchor.timestamp,
+            and_(ActivityLog.timestamp == anchor.timestamp, ActivityLog.id < anchor.id),
+        ))
+
+    query = query.order_by(ActivityLog.timestamp.desc(), ActivityLog.id.desc())
+    return session.exec(query.limit(limit)).all()
 
 @router.post("/orders/", response_model=OrderRead)
-def create_order(order: OrderCreate, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
+def create_order(order: OrderCreate, session: Session = Depends(get_session, scope="function"), current_user: User = Depends(get_current_user)):
     try:
-        ensure_order_planning_schema(session)
-
         # Create DB model from input
         db_order = Order.from_orm(order)
         db_order.constructive_days = max(1, min(60, int(db_order.constructive_days or 5)))
@@ -708,8 +406,7 @@ def create_order(order: OrderCreate, session: Session = Depends(get_session), cu
                 db_order.date_manager_handover = date.today()
             
         session.add(db_order)
-        session.commit()
-        session.refresh(db_order)
+        session.flush()  # Assigns db_order.id
         
         # Auto-create folder structure
         try:
@@ -735,8 +432,6 @@ def create_order(order: OrderCreate, session: Session = Depends(get_session), cu
                 db_order.custom_stage2_percent = constructor.payment_stage2_percent
             
             session.add(db_order)
-            session.commit()
-            session.refresh(db_order)
 
         return OrderRead.from_order(db_order, session)
     except Exception as e:
@@ -746,20 +441,138 @@ def create_order(order: OrderCreate, session: Session = Depends(get_session), cu
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Creation Error: {str(e)}")
 
+ORDER_PAGE_MAX_LIMIT = 1000
+
+# Keys accepted by GET /orders/?sort_by=...
+ORDER_SORT_COLUMNS = {
+    "id": Order.id,
+    "name": Order.name,
+    "price": Order.price,
+    "date_received": Order.date_received,
+    "date_to_work": Order.date_to_work,
+    "date_installation": Order.date_installation,
+    # Debt sorting uses the materialized order_financials table
+    "current_debt": func.coalesce(OrderFinancials.current_debt, 0.0),
+    "manager_current_debt": func.coalesce(OrderFinancials.manager_current_debt, 0.0),
+}
+ORDER_DATE_SORT_KEYS = {"date_received", "date_to_work", "date_installation"}
+ORDER_FINANCIALS_SORT_KEYS = {"current_debt", "manager_current_debt"}
+ORDER_PAYMENT_STATUSES = {"unpaid", "advance_paid", "paid"}
+
+
+def encode_order_cursor(sort_by: str, sort_order: str, order: Order, sort_value) -> str:
+    if isinstance(sort_value, date):
+        sort_value = sort_value.isoformat()
+    payload = json.dumps([sort_by, sort_order, sort_value, order.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_order_cursor(cursor: str, sort_by: str, sort_order: str):
+    try:
+        cursor_sort_by, cursor_sort_order, value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if cursor_sort_by != sort_by or cursor_sort_order != sort_order:
+        raise HTTPException(status_code=400, detail="Cursor does not match sort parameters")
+    if value is not None and sort_by in ORDER_DATE_SORT_KEYS:
+        value = date.fromisoformat(value)
+    return value, int(last_id)
+
+
+def order_keyset_condition(sort_col, descending: bool, value, last_id: int):
+    """
+    Rows strictly after (value, last_id) in the page order.
+    Ascending puts NULLs last, descending is the exact reverse (NULLs first).
+    """
+    if sort_col is Order.id:
+        return Order.id < last_id if descending else Order.id > last_id
+    if descending:
+        if value is None:
+            return or_(and_(sort_col.is_(None), Order.id < last_id), sort_col.is_not(None))
+        return or_(sort_col < value, and_(sort_col == value, Order.id < last_id))
+    if value is None:
+        return and_(sort_col.is_(None), Order.id > last_id)
+    return or_(sort_col > value, and_(sort_col == value, Order.id > last_id), sort_col.is_(None))
+
+
 @router.get("/orders/", response_model=List[OrderRead])
-def read_orders(
+async def read_orders(
+    response: Response,
     skip: int = 0, 
     limit: int = 100, 
+    cursor: Optional[str] = None,
     search: Optional[str] = None,
     sort_by: str = "id",
     sort_order: str = "asc",
-    session: Session = Depends(get_session),
+    has_debt: Optional[bool] = None,
+    constructor_id: Optional[int] = None,
+    manager_id: Optional[int] = None,
+    unassigned: Optional[bool] = None,
+    payment_status: Optional[str] = None,
+    archived: Optional[bool] = None,
+    date_received_from: Optional[date] = None,
+    date_received_to: Optional[date] = None,
+    date_installation_from: Optional[date] = None,
+    date_installation_to: Optional[date] = None,
     current_user: User = Depends(get_current_user)
 ):
-    try:
-        ensure_order_planning_schema(session)
+    """
+    Список замовлень з серверними фільтрами і сортуванням.
+
+    Пагінація: передайте значення заголовка X-Next-Cursor у ?cursor= для
+    наступної сторінки (стабільно при нових замовленнях). skip/limit
+    залишені для сумісності.
+    """
+    return await run_read(
+        query_orders_page, response, current_user,
+        skip=skip, limit=limit, cursor=cursor, search=search, sort_by=sort_by, sort_order=sort_order,
+        has_debt=has_debt, constructor_id=constructor_id, manager_id=manager_id, unassigned=unassigned,
+        payment_status=payment_status, archived=archived,
+        date_received_from=date_received_from, date_received_to=date_received_to,
+        date_installation_from=date_installation_from, date_installation_to=date_installation_to,
+    )
+
 
-        query = select(Order)
+def query_orders_page(
+    session: Session,
+    response: Response,
+    current_user: User,
+    skip: int,
+    limit: int,
+    cursor: Optional[str],
+    search: Optional[str],
+    sort_by: str,
+    sort_order: str,
+    has_debt: Optional[bool],
+    constructor_id: Optional[int],
+    manager_id: Optional[int],
+    unassigned: Optional[bool],
+    payment_status: Optional[str],
+    archived: Optional[bool],
+    date_received_from: Optional[date],
+    date_received_to: Optional[date],
+    date_installation_from: Optional[date],
+    date_installation_to: Optional[date],
+):
+    if sort_by not in ORDER_SORT_COLUMNS:
+        sort_by = "id"
+    sort_order = "desc" if sort_order == "desc" else "asc"
+    if payment_status is not None and payment_status not in ORDER_PAYMENT_STATUSES:
+        raise HTTPException(status_code=400, detail=f"payment_status must be one of: {', '.join(sorted(ORDER_PAYMENT_STATUSES))}")
+    limit = max(1, min(limit, ORDER_PAGE_MAX_LIMIT))
+    keyset = decode_order_cursor(cursor, sort_by, sort_order) if cursor else None
+
+    try:
+        sort_col = ORDER_SORT_COLUMNS[sort_by]
+        query = select(Order, sort_col)
+
+        if sort_by in ORDER_FINANCIALS_SORT_KEYS or has_debt is not None or archived is not None:
+            query = query.outerjoin(OrderFinancials, OrderFinancials.order_id == Order.id)
+        current_debt_col = ORDER_SORT_COLUMNS["current_debt"]
+        if has_debt is True:
+            query = query.where(current_debt_col > 0.01)
+        elif has_debt is False:
+            query = query.where(current_debt_col <= 0.01)
         
         # FILTER BY ROLE
         # Admin and Manager see ALL orders
@@ -767,70 +580,110 @@ def read_orders(
             print(f"Filtering orders for CONST ID: {current_user.id}")
             # Constructor sees only their assigned orders
             query = query.where(Order.constructor_id == current_user.id)
+
+        if constructor_id is not None:
+            query = query.where(Order.constructor_id == constructor_id)
+        if manager_id is not None:
+            query = query.where(Order.manager_id == manager_id)
+        if unassigned is True:
+            query = query.where(Order.constructor_id.is_(None))
+        elif unassigned is False:
+            query = query.where(Order.constructor_id.is_not(None))
+
+        if payment_status == "unpaid":
+            query = query.where(Order.date_advance_paid.is_(None), Order.date_final_paid.is_(None))
+        elif payment_status == "advance_paid":
+            query = query.where(Order.date_advance_paid.is_not(None), Order.date_final_paid.is_(None))
+        elif payment_status == "paid":
+            query = query.where(Order.date_final_paid.is_not(None))
+
+        # Archived = same rule as the frontend "Архів" tab
+        is_completed = or_(
+            Order.date_final_paid.is_not(None),
+            and_(
+                Order.date_installation.is_not(None),
+                func.coalesce(OrderFinancials.remainder_amount, 0.0) <= 0.01,
+            ),
+        )
+        if archived is True:
+            query = query.where(is_completed)
+        elif archived is False:
+            query = query.where(not_(is_completed))
+
+        if date_received_from:
+            query = query.where(Order.date_received >= date_received_from)
+        if date_received_to:
+            query = query.where(Order.date_received <= date_received_to)
+        if date_installation_from:
+            query = query.where(Order.date_installation >= date_installation_from)
+        if date_installation_to:
+            query = query.where(Order.date_installation <= date_installation_to)
             
         if search:
             if search.isdigit():
                 query = query.where(Order.id == int(search))
             else:
-                query = query.where(Order.name.contains(search))
-        
-        # Sorting
-        sort_col = Order.id
-        if sort_by == "name":
-            sort_col = Order.name
+                query = query.where(SearchService.order_name_filter(session, search))
         
-        if sort_order == "desc":
-            query = query.order_by(desc(sort_col))
+        # Sorting: (sort column, id) so equal values page deterministically
+        descending = sort_order == "desc"
+        if sort_col is Order.id:
+            order_clauses = [desc(Order.id) if descending else asc(Order.id)]
+        elif descending:
+            order_clauses = [desc(sort_col).nulls_first(), desc(Order.id)]
         else:
-            query = query.order_by(asc(sort_col))
-
-        query = query.offset(skip).limit(limit)
-        
-        orders = session.exec(query).all()
-        # Convert using the logic-heavy from_order method
-        # Return list with constructor-aware bonus calculation
-        result = []
-        for o in orders:
-            constructor = None
-            if o.constructor_id:
-                # FORCE REFRESH: Use populate_existing=True to bypass session cache completely
-                # This ensures we get the latest payment_stage percentages from DB
-                constructor = session.exec(
-                    select(User)
-                    .where(User.id == o.constructor_id)
-                    .execution_options(populate_existing=True)
-                ).first()
-            
-            result.append(OrderRead.from_order(o, session))
-        return result
+            order_clauses = [asc(sort_col).nulls_last(), asc(Order.id)]
+        query = query.order_by(*order_clauses)
+
+        if keyset is not None:
+            query = query.where(order_keyset_condition(sort_col, descending, *keyset))
+        elif skip:
+            query = query.offset(skip)
+
+        rows = session.exec(query.limit(limit + 1)).all()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last_order, last_value = rows[-1]
+            response.headers["X-Next-Cursor"] = encode_order_cursor(sort_by, sort_order, last_order, last_value)
+
+        orders = [order for order, _ in rows]
+        # Batch conversion: users and unpaid deductions for the whole page are
+        # loaded up front instead of per-order lookups.
+        return OrderRead.from_orders(orders, session)
     except Exception as e:
         print(f"ERROR READING ORDERS: {e}")
         return []
 
 @router.patch("/users/{user_id}", response_model=UserRead)
-def update_user(
+async def update_user(
     user_id: int, 
     user_update: UserUpdate, 
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_session, scope="function"),
     current_user: User = Depends(get_admin_user)
 ):
-    db_user = session.get(User, user_id)
-    if not db_user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
     update_data = user_update.dict(exclude_unset=True)
-    
+    # Hash first: no database connection is held while bcrypt runs
+    password_hash = None
     if "password" in update_data:
         password = update_data.pop("password")
         if password: # Only if string is not empty
-            db_user.password_hash = get_password_hash(password)
+            password_hash = await get_password_hash_async(password)
+
+    return await run_in_threadpool(apply_user_update, session, user_id, update_data, password_hash, current_user)
+
+def apply_user_update(session: Session, user_id: int, update_data: dict, password_hash: Optional[str], current_user: User) -> User:
+    db_user = session.get(User, user_id)
+    if not db_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if password_hash:
+        db_user.password_hash = password_hash
     
     for key, value in update_data.items():
         setattr(db_user, key, value)
     
     session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
+    # Salary settings feed every order of this user
+    financials_cache.invalidate_all()
     
     log_activity(session, "UPDATE_USER", f"Оновлено профіль {db_user.username} (Адмін: {current_user.username})")
     return db_user
@@ -839,13 +692,14 @@ def update_user(
 
 
 @router.get("/orders/{order_id}", response_model=OrderRead)
-def read_order(
+async def read_order(
     order_id: int,
-    session: Session = Depends(get_session),
     current_user: User = Depends(get_current_user)
 ):
-    ensure_order_planning_schema(session)
+    return await run_read(query_order, order_id, current_user)
+
 
+def query_order(session: Session, order_id: int, current_user: User) -> OrderRead:
     order = session.get(Order, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
@@ -856,10 +710,9 @@ def read_order(
 @router.get("/orders/{order_id}/calculation-history", response_model=List[OrderCalculationHistoryItemRead])
 def get_order_calculation_history(
     order_id: int,
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_session, scope="function"),
     current_user: User = Depends(get_current_user)
 ):
-    ensure_deduction_schema(session)
     order = session.get(Order, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
@@ -1092,15 +945,14 @@ def get_order_calculation_history(
 def update_order(
     order_id: int, 
     order_update: OrderUpdate, 
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_session, scope="function"),
     current_user: User = Depends(get_current_user)
 ):
-    ensure_order_planning_schema(session)
-
     db_order = session.get(Order, order_id)
     if not db_order:
         raise HTTPException(status_code=404, detail="Order not found")
     ensure_order_access(current_user, db_order)
+    original_order_id = order_id
     
     # Track if dates changed
     old_date_to_work = db_order.date_to_work
@@ -1173,10 +1025,18 @@ def update_order(
         
         # We need to use raw SQL to update PK and cascade to deductions
         from sqlalchemy import text
-        session.execute(text("UPDATE deduction SET order_id = :new_id WHERE order_id = :order_id"), {"new_id": new_id, "order_id": order_id}) # deductions first
-        session.execute(text("UPDATE order_file SET order_id = :new_id WHERE order_id = :order_id"), {"new_id": new_id, "order_id": order_id}) # files too
-        session.execute(text('UPDATE "order" SET id = :new_id WHERE id = :order_id'), {"new_id": new_id, "order_id": order_id}) # Quote table name 'order'
-        session.commit()
+        if session.get_bind().dialect.name == "sqlite":
+            # Children move before the order: with SQLITE_FOREIGN_KEYS=ON check at commit, not per statement
+            session.execute(text("PRAGMA defer_foreign_keys=ON"))
+        params = {"new_id": new_id, "order_id": order_id}
+        session.execute(text("UPDATE deduction SET order_id = :new_id WHERE order_id = :order_id"), params) # deductions first
+        session.execute(text("UPDATE orderfile SET order_id = :new_id WHERE order_id = :order_id"), params) # files too
+        session.execute(text("UPDATE paymentallocation SET order_id = :new_id WHERE order_id = :order_id"), params) # payments
+        session.execute(text("UPDATE payment SET manual_order_id = :new_id WHERE manual_order_id = :order_id"), params)
+        session.execute(text('UPDATE "order" SET id = :new_id WHERE id = :order_id'), params) # Quote table name 'order'
+        OrderFinancialsService.mark_orders(session, [order_id, new_id])
+        # The loaded object still carries the old primary key
+        session.expunge(db_order)
         
         # Re-fetch new order
         db_order = session.get(Order, new_id)
@@ -1207,8 +1067,8 @@ def update_order(
                     db_order.date_manager_handover = date.today()
     
     session.add(db_order)
-    session.commit()
-    session.refresh(db_order)
+    session.flush()
+    financials_cache.invalidate_orders({original_order_id, db_order.id})
     
     # If work dates changed, trigger redistribution
     dates_changed = (
@@ -1217,7 +1077,8 @@ def update_order(
         db_order.date_installation != old_date_installation
     )
     if dates_changed:
-        PaymentDistributionService.distribute_all_unallocated(session)
+        # Only this order could have gained an open stage, so only it is a candidate.
+        PaymentDistributionService.distribute_all_unallocated(session, order_ids=[db_order.id])
     
     log_activity(session, "UPDATE_ORDER", f"Оновлено замовлення #{order_id} (Користувач: {current_user.username})")
     
@@ -1227,7 +1088,7 @@ def update_order(
 @router.delete("/orders/{order_id}")
 def delete_order(
     order_id: int,
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_session, scope="function"),
     current_user: User = Depends(get_admin_user)
 ):
     db_order = session.get(Order, order_id)
@@ -1239,19 +1100,22 @@ def delete_order(
     # Manually delete orphans just in case
     from sqlalchemy import text
     try:
+        affected_payment_ids = session.exec(
+            select(PaymentAllocation.payment_id).where(PaymentAllocation.order_id == order_id).distinct()
+        ).all()
         session.execute(text("DELETE FROM deduction WHERE order_id = :order_id"), {"order_id": order_id}) # Fines
         session.execute(text("DELETE FROM paymentallocation WHERE order_id = :order_id"), {"order_id": order_id}) # Allocations
+        PaymentDistributionService.sync_allocated_totals(session, affected_payment_ids) # Return money to free funds
         session.execute(text("DELETE FROM orderfile WHERE order_id = :order_id"), {"order_id": order_id}) # Files
         
         # Unlink manual payments (don't delete the money, just unlink order)
         session.execute(text("UPDATE payment SET manual_order_id = NULL WHERE manual_order_id = :order_id"), {"order_id": order_id})
-        session.commit()
     except Exception as e:
         print(f"Error cleaning up order dependencies: {e}")
         session.rollback()
 
     session.delete(db_order)
-    session.commit()
+    financials_cache.invalidate_order(order_id)
     log_activity(session, "DELETE_ORDER", f"Видалено замовлення #{order_id} '{order_name}'")
     return {"message": "Order deleted successfully"}
 
@@ -1259,13 +1123,11 @@ def delete_order(
 @router.post("/payments/")
 def create_payment(
     payment_data: PaymentCreate,
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_session, scope="function"),
     current_user: User = Depends(get_admin_user)
 ):
     """Додати платіж і автоматично розподілити його"""
     try:
-        ensure_payment_schema(session)
-
         payment = Payment(
             amount=payment_data.amount,
             date_received=payment_data.date_received,
@@ -1276,30 +1138,30 @@ def create_payment(
             manager_id=payment_data.manager_id
         )
         session.add(payment)
-        session.commit()
-        session.refresh(payment)
+        session.flush()
         
         # Розподілити ВСІ доступні кошти (включаючи старі залишки)
         allocations = PaymentDistributionService.distribute_all_unallocated(session)
+        financials_cache.invalidate_orders({alloc["order_id"] for alloc in allocations})
         
         # Calculate remaining specifically for THIS payment for response (just for UI)
-        existing_allocs = session.exec(
-            select(PaymentAllocation).where(PaymentAllocation.payment_id == payment.id)
-        ).all()
-        used = sum(a.amount for a in existing_allocs)
-        remaining = payment.amount - used
+        remaining = payment.amount - (payment.allocated_total or 0.0)
         
         log_activity(session, "ADD_PAYMENT", f"Додано платіж {payment.amount} грн")
         
         # Notify Constructors regarding allocations
         try:
-            ts = TelegramService()
+            ts = TelegramService(session)  # Queued in the outbox, sent after commit
             for alloc in allocations:
                 order = session.get(Order, alloc.get("order_id")) # Alloc dict from service
-                if order and order.constructor_id:
-                    constructor = session.get(User, order.constructor_id)
-                    if constructor:
-                         ts.notify_payment(payment, alloc.get("amount"), order.name, constructor)
+                if not order:
+                    continue
+                # Manager commission goes to the manager, stage payments to the constructor
+                recipient_id = order.manager_id if alloc.get("stage") == "manager" else order.constructor_id
+                if recipient_id:
+                    recipient = session.get(User, recipient_id)
+                    if recipient:
+                         ts.notify_payment(payment, alloc.get("amount"), order.name, recipient, alloc.get("stage"))
         except Exception as e:
              print(f"Failed to send payment notifications: {e}")
 
@@ -1318,7 +1180,7 @@ def create_payment(
 @router.delete("/payments/{payment_id}")
 def delete_payment(
     payment_id: int,
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_session, scope="function"),
     current_user: User = Depends(get_admin_user)
 ):
     """
@@ -1366,10 +1228,12 @@ def delete_payment(
         session.add(order)
         # Delete this allocation record
         session.delete(alloc)
+    # Allocations reference the payment: delete them first (enforced foreign keys)
+    session.flush()
         
     # 2. Finally delete the payment itself
     session.delete(payment)
-    session.commit()
+    financials_cache.invalidate_orders({alloc.order_id for alloc in allocations})
     
     # 3. NO redistribution. 
     # Whatever happened is done. If holes appeared, they stay as debt.
@@ -1378,11 +1242,14 @@ def delete_payment(
     return {"ok": True}
 
 @router.get("/payments/", response_model=List[PaymentRead])
-def get_payments(
-    session: Session = Depends(get_session),
+async def get_payments(
     current_user: User = Depends(get_current_user)
 ):
     """Отримати історію всіх платежів"""
+    return await run_read(query_payments, current_user)
+
+
+def query_payments(session: Session, current_user: User) -> List[PaymentRead]:
     payments = session.exec(select(Payment).order_by(Payment.date_received.desc())).all()
     
     result = []
@@ -1414,7 +1281,7 @@ def get_payments(
 @router.get("/payments/{payment_id}/allocations")
 def get_payment_allocations(
     payment_id: int,
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_session, scope="function"),
     current_user: User = Depends(get_current_user)
 ):
     """Отримати розподіл конкретного платежу"""
@@ -1448,11 +1315,14 @@ def get_payment_allocations(
 
 @router.post("/payments/redistribute")
 def redistribute_payments(
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_session, scope="function"),
     current_user: User = Depends(get_admin_user)
 ):
     """Примусово перерозподілити всі наявні платежі"""
+    # Re-sync cached payment balances in case allocations were edited by scripts
+    PaymentDistributionService.sync_allocated_totals(session)
     allocations = PaymentDistributionService.distribute_all_unallocated(session)
+    financials_cache.invalidate_all()
     
     # Calculate total unallocated
     payments = session.exec(select(Payment)).all()
@@ -1509,15 +1379,7 @@ def reconcile_order_allocations_after_financial_change(order: Order, session: Se
             if total_to_free <= 0.01:
                 break
 
-            if alloc.amount <= total_to_free:
-                total_to_free -= alloc.amount
-                session.delete(alloc)
-            else:
-                alloc.amount -= total_to_free
-                session.add(alloc)
-                total_to_free = 0
-
-        session.commit()
+            total_to_free -= PaymentDistributionService.release_allocation(session, alloc, total_to_free)
 
     # Manager overpay correction (when manager-target fine reduces available bonus).
     manager_total_bonus = manager_financials.get("total_bonus", 0.0) if manager_financials else 0.0
@@ -1539,25 +1401,16 @@ def reconcile_order_allocations_after_financial_change(order: Order, session: Se
         for alloc in manager_allocations:
             if to_free_manager <= 0.01:
                 break
-            if alloc.amount <= to_free_manager:
-                to_free_manager -= alloc.amount
-                session.delete(alloc)
-            else:
-                alloc.amount -= to_free_manager
-                session.add(alloc)
-                to_free_manager = 0.0
-
-        session.commit()
+            to_free_manager -= PaymentDistributionService.release_allocation(session, alloc, to_free_manager)
 
     PaymentDistributionService.distribute_all_unallocated(session)
-    session.refresh(order)
 
 # File Management
 # File Link Management
 @router.get("/orders/{order_id}/files", response_model=List[OrderFileRead])
 def get_order_files(
     order_id: int,
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_session, scope="function"),
     current_user: User = Depends(get_current_user)
 ):
     order = session.get(Order, order_id)
@@ -1570,7 +1423,7 @@ def get_order_files(
 def add_file_link(
     order_id: int,
     file_data: OrderFileCreate,
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_session, scope="function"),
     current_user: User = Depends(get_current_user)
 ):
     order = session.get(Order, order_id)
@@ -1590,8 +1443,7 @@ def add_file_link(
         folder_name=folder_name
     )
     session.add(new_file)
-    session.commit()
-    session.refresh(new_file)
+    session.flush()
     
     # Log action
     log_activity(session, "ADD_FILE", f"Додано посилання на файл '{new_file.name}' до замовлення '{order.name}'")
@@ -1601,7 +1453,7 @@ def add_file_link(
 @router.delete("/files/{file_id}")
 def delete_file_link(
     file_id: int,
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_session, scope="function"),
     current_user: User = Depends(get_current_user)
 ):
     file_link = session.get(OrderFile, file_id)
@@ -1615,7 +1467,6 @@ def delete_file_link(
     file_name = file_link.name
     
     session.delete(file_link)
-    session.commit()
     
     # Log action
     log_activity(session, "DELETE_FILE", f"Видалено посилання на файл '{file_name}' із замовлення '{order_name}'")
@@ -1629,10 +1480,9 @@ def delete_file_link(
 @router.post("/deductions/")
 def create_deduction(
     deduction_data: DeductionCreate,
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_session, scope="function"),
     current_user: User = Depends(get_manager_user)
 ):
-    ensure_deduction_schema(session)
     # Verify order exists
     order = session.get(Order, deduction_data.order_id)
     if not order:
@@ -1646,13 +1496,15 @@ def create_deduction(
     deduction_payload["target_role"] = target_role
     deduction = Deduction(**deduction_payload)
     session.add(deduction)
-    session.commit()
-    session.refresh(deduction)
+    session.flush()
+    financials_cache.invalidate_order(deduction.order_id)
     
     order = session.get(Order, deduction.order_id)
 
     try:
-        reconcile_order_allocations_after_financial_change(order, session)
+        # Savepoint: a failed recalculation must not undo the fine itself
+        with session.begin_nested():
+            reconcile_order_allocations_after_financial_change(order, session)
     except Exception as e:
         print(f"Warning: recalculation after fine failed: {e}")
     
@@ -1669,7 +1521,7 @@ def create_deduction(
 
     if responsible_user:
         try:
-            TelegramService().notify_deduction(deduction, order.name, responsible_user, role_label)
+            TelegramService(session).notify_deduction(deduction, order.name, responsible_user, role_label)
         except Exception as e:
             print(f"Failed to send deduction notification: {e}")
 
@@ -1683,10 +1535,9 @@ def create_deduction(
 @router.get("/deductions/")
 def get_deductions(
     order_id: int = None,
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_session, scope="function"),
     current_user: User = Depends(get_current_user)
 ):
-    ensure_deduction_schema(session)
     if order_id:
         order = session.get(Order, order_id)
         if not order:
@@ -1725,11 +1576,10 @@ def get_deductions(
 def update_deduction(
     deduction_id: int,
     deduction_update: "DeductionUpdate",
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_session, scope="function"),
     current_user: User = Depends(get_manager_user)
 ):
     from models import DeductionUpdate
-    ensure_deduction_schema(session)
     
     deduction = session.get(Deduction, deduction_id)
     if not deduction:
@@ -1740,13 +1590,14 @@ def update_deduction(
         setattr(deduction, key, value)
     
     session.add(deduction)
-    session.commit()
-    session.refresh(deduction)
+    session.flush()
+    financials_cache.invalidate_order(deduction.order_id)
     
     order = session.get(Order, deduction.order_id)
     if order:
         try:
-            reconcile_order_allocations_after_financial_change(order, session)
+            with session.begin_nested():
+                reconcile_order_allocations_after_financial_change(order, session)
         except Exception as e:
             print(f"Warning: recalculation after deduction update failed: {e}")
     log_activity(session, "UPDATE_DEDUCTION", f"Оновлено штраф #{deduction_id}")
@@ -1755,10 +1606,9 @@ def update_deduction(
 @router.delete("/deductions/{deduction_id}")
 def delete_deduction(
     deduction_id: int,
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_session, scope="function"),
     current_user: User = Depends(get_manager_user)
 ):
-    ensure_deduction_schema(session)
     deduction = session.get(Deduction, deduction_id)
     if not deduction:
         raise HTTPException(status_code=404, detail="Deduction not found")
@@ -1766,11 +1616,13 @@ def delete_deduction(
     order = session.get(Order, deduction.order_id)
     deduction_amount = deduction.amount # Save for log
     session.delete(deduction)
-    session.commit()
+    session.flush()
+    financials_cache.invalidate_order(order.id if order else None)
 
     if order:
         try:
-            reconcile_order_allocations_after_financial_change(order, session)
+            with session.begin_nested():
+                reconcile_order_allocations_after_financial_change(order, session)
         except Exception as e:
             print(f"Warning: recalculation after deduction delete failed: {e}")
     
@@ -1778,176 +1630,15 @@ def delete_deduction(
     return {"message": "Deduction deleted successfully"}
 
 @router.get("/stats/financial")
-def get_financial_stats(session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    from sqlalchemy import func
-    from payments import Payment, PaymentAllocation
-    ensure_deduction_schema(session)
-    
-    try:
-        total_received = session.exec(select(func.sum(Payment.amount))).one()
-        total_allocated = session.exec(select(func.sum(PaymentAllocation.amount))).one()
-        total_deductions = session.exec(select(func.sum(Deduction.amount)).where(Deduction.is_paid == False)).one()
-        
-        if total_received is None: total_received = 0.0
-        if total_allocated is None: total_allocated = 0.0
-        if total_deductions is None: total_deductions = 0.0
-        
-        unallocated = total_received - total_allocated
-
-        if current_user.role == "manager":
-            manager_payments = session.exec(
-                select(Payment).where(Payment.manager_id == current_user.id)
-            ).all()
-            manager_payment_ids = [payment.id for payment in manager_payments]
-            manager_received = sum(payment.amount for payment in manager_payments)
-            if manager_payment_ids:
-                manager_allocated = session.exec(
-                    select(func.sum(PaymentAllocation.amount))
-                    .where(PaymentAllocation.payment_id.in_(manager_payment_ids))
-                ).one() or 0.0
-            else:
-                manager_allocated = 0.0
-
-            manager_orders = session.exec(
-                select(Order).where(Order.manager_id == current_user.id)
-            ).all()
-            manager_bonus_total = 0.0
-            manager_paid_total = 0.0
-            manager_debt = 0.0
-
-            for order in manager_orders:
-                manager_financials = calculate_manager_financials(order, session=session, manager=current_user)
-                manager_bonus_total += manager_financials["active_amount"]
-                manager_paid_total += manager_financials["active_paid_amount"]
-                manager_debt += manager_financials["current_debt"]
-
-            return {
-                "dashboard_scope": "manager",
-                "manager_personal_debt": manager_debt,
-                "manager_personal_unallocated": manager_received - manager_allocated,
-                "manager_personal_bonus": manager_bonus_total,
-                "manager_personal_paid": manager_paid_total,
-                "total_received": total_received,
-                "total_allocated": total_allocated,
-                "unallocated": unallocated,
-                "total_deductions": total_deductions,
-                "total_debt": 0.0,
-                "total_manager_debt": manager_debt,
-                "constructors_stats": [],
-                "manager_stats": []
-            }
-        
-        
-        # Per-User Stats
-        constructors_stats = []
-        manager_stats = []
-        
-        # Pull all users who could be constructors or managers
-        all_users = session.exec(select(User)).all()
-        
-        # Helper to check activity
-        def has_constructor_activity(u_id):
-            return session.exec(select(Order).where(Order.constructor_id == u_id)).first() is not None or \
-                   session.exec(select(Payment).where(Payment.constructor_id == u_id)).first() is not None
-
-        def has_manager_activity(u_id):
-            return session.exec(select(Order).where(Order.manager_id == u_id)).first() is not None or \
-                   session.exec(select(Payment).where(Payment.manager_id == u_id)).first() is not None
+async def get_financial_stats(current_user: User = Depends(get_current_user)):
+    return await run_read(query_financial_stats, current_user)
 
-        constructors = [u for u in all_users if u.role == 'constructor' or has_constructor_activity(u.id)]
-        managers = [u for u in all_users if u.role == 'manager' or has_manager_activity(u.id)]
-        
-        global_total_debt = 0.0
-        
-        for c in constructors:
-            # 1. Undistributed
-            c_payments = session.exec(select(Payment).where(Payment.constructor_id == c.id)).all()
-            c_total_received = sum(p.amount for p in c_payments)
-            
-            # Find allocations for these payments
-            c_payment_ids = [p.id for p in c_payments]
-            if c_payment_ids:
-                c_total_allocated = session.exec(
-                    select(func.sum(PaymentAllocation.amount))
-                    .where(PaymentAllocation.payment_id.in_(c_payment_ids))
-                ).one() or 0.0
-            else:
-                c_total_allocated = 0.0
-                
-            c_unallocated = c_total_received - c_total_allocated
-            
-            # 2. Debt (Unpaid salary for their orders)
-            c_orders = session.exec(select(Order).where(Order.constructor_id == c.id)).all()
-            c_debt = 0.0
-            
-            for o in c_orders:
-                order_view = OrderRead.from_order(o, session)
-                c_debt += order_view.current_debt
-
-            global_total_debt += c_debt
-
-            constructors_stats.append({
-                "id": c.id,
-                "name": c.full_name or c.username,
-                "unallocated": c_unallocated,
-                "debt": c_debt 
-            })
-        
-        # Global Manager Stats
-        total_manager_bonus = 0.0
-        total_manager_paid = 0.0
-        global_total_manager_debt = 0.0
-        
-        for m in managers:
-            m_orders = session.exec(select(Order).where(Order.manager_id == m.id)).all()
-            m_bonus_total = 0.0
-            m_paid_total = 0.0
-            m_debt = 0.0
-            
-            for o in m_orders:
-                manager_financials = calculate_manager_financials(o, session=session, manager=m)
-                m_bonus_total += manager_financials["active_amount"]
-                m_paid_total += manager_financials["active_paid_amount"]
-                m_debt += manager_financials["current_debt"]
-
-            # Calculate manager unallocated (free) funds
-            m_payments = session.exec(select(Payment).where(Payment.manager_id == m.id)).all()
-            m_total_received = sum(p.amount for p in m_payments)
-            
-            m_payment_ids = [p.id for p in m_payments]
-            if m_payment_ids:
-                m_total_allocated = session.exec(
-                    select(func.sum(PaymentAllocation.amount))
-                    .where(PaymentAllocation.payment_id.in_(m_payment_ids))
-                ).one() or 0.0
-            else:
-                m_total_allocated = 0.0
-                
-            m_unallocated = m_total_received - m_total_allocated
-
-            manager_stats.append({
-                "id": m.id,
-                "name": m.full_name or m.username,
-                "bonus": m_bonus_total,
-                "paid": m_paid_total,
-                "debt": m_debt,
-                "unallocated": m_unallocated
-            })
-            total_manager_bonus += m_bonus_total
-            total_manager_paid += m_paid_total
-            global_total_manager_debt += m_debt
-
-        return {
-            "total_received": total_received,
-            "total_allocated": total_allocated,
-            "unallocated": unallocated,
-            "total_deductions": total_deductions,
-            "total_debt": global_total_debt,
-            "total_manager_debt": global_total_manager_debt,
-            "constructors_stats": constructors_stats,
-            "manager_stats": manager_stats
-        }
 
+def query_financial_stats(session: Session, current_user: User) -> dict:
+    try:
+        if current_user.role == "manager":
+            return FinancialStatsService.get_manager_stats(session, current_user)
+        return FinancialStatsService.get_global_stats(session)
     except Exception as e:
         print(f"Error calculating stats: {e}")
         return {
@@ -1960,9 +1651,9 @@ class ResetRequest(BaseModel):
     password: str
 
 @router.delete("/admin/reset")
-def reset_database(
+async def reset_database(
     request: ResetRequest,
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_session, scope="function"),
     current_user: User = Depends(get_super_admin_user)
 ):
     expected_password = os.environ.get("ADMIN_RESET_PASSWORD")
@@ -1972,191 +1663,80 @@ def reset_database(
     else:
         # Fallback for environments where ADMIN_RESET_PASSWORD is not configured:
         # allow reset when super-admin confirms with their account password.
-        if not verify_password(request.password, current_user.password_hash):
+        if not await verify_password_async(request.password, current_user.password_hash):
             raise HTTPException(status_code=403, detail="Incorrect password")
     
+    await run_in_threadpool(wipe_data, session)
+    return {"message": "All data has been reset"}
+
+def wipe_data(session: Session):
     # Delete all data from tables in correct order (child first)
     from sqlmodel import delete
     
     session.exec(delete(PaymentAllocation))
     session.exec(delete(Deduction))
     session.exec(delete(OrderFile))
+    activity_log_writer.flush()  # Queued entries belong to the data being wiped
     session.exec(delete(ActivityLog))
     session.exec(delete(Payment))
+    session.exec(delete(OrderFinancials))
     session.exec(delete(Order))
-    
-    session.commit()
+    financials_cache.invalidate_all()
     
     log_activity(session, "SYSTEM_RESET", "Всі дані було очищено суперадміністратором")
-    return {"message": "All data has been reset"}
 
 
 # --- BACKUP ---
 @router.get("/admin/backup")
-def backup_database(current_user: User = Depends(get_admin_user), session: Session = Depends(get_session)):
-    from datetime import datetime
-    from fastapi.responses import JSONResponse
-    ensure_deduction_schema(session)
-    
-    # 1. Fetch all data
-    users = session.exec(select(User)).all()
-    orders = session.exec(select(Order)).all()
-    payments = session.exec(select(Payment)).all()
-    allocations = session.exec(select(PaymentAllocation)).all()
-    deductions = session.exec(select(Deduction)).all()
-    logs = session.exec(select(ActivityLog)).all()
-    files = session.exec(select(OrderFile)).all()
-    
-    # 2. Serialize (using SQLModel's .dict() or similar)
-    # We use jsonable_encoder to handle datetime serialization automatically
-    from fastapi.encoders import jsonable_encoder
-    
-    backup_data = {
-        "timestamp": datetime.now().isoformat(),
-        "version": "1.0",
-        "data": {
-            "users": jsonable_encoder(users),
-            "orders": jsonable_encoder(orders),
-            "payments": jsonable_encoder(payments),
-            "allocations": jsonable_encoder(allocations),
-            "deductions": jsonable_encoder(deductions),
-            "activity_logs": jsonable_encoder(logs),
-            "order_files": jsonable_encoder(files)
-        }
-    }
-    
-    # 3. Return as downloadable file
-    filename = f"backup_{datetime.now().strftime('%Y-%m-%d_%H-%M')}.json"
-    
-    return JSONResponse(
-        content=backup_data,
+def backup_database(current_user: User = Depends(get_admin_user)):
+    """
+    Gzip-стиснутий JSON усіх таблиць, потоком (див. BackupService).
+    Таблиці не збираються в пам'яті; з'єднання з базою належить
+    генератору і звільняється, щойно відповідь дописана або клієнт відключився.
+    """
+    activity_log_writer.flush()  # Queued entries belong in the backup
+    filename = f"backup_{datetime.now().strftime('%Y-%m-%d_%H-%M')}.json.gz"
+    return StreamingResponse(
+        BackupService.iter_gzip(),
+        media_type="application/gzip",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
 
 @router.post("/admin/restore")
-def restore_database(file: UploadFile = File(...), current_user: User = Depends(get_super_admin_user), session: Session = Depends(get_session)):
-    import json
-    from sqlmodel import delete
-    ensure_deduction_schema(session)
-    
-    # 1. Read and parse JSON
+def restore_database(file: UploadFile = File(...), current_user: User = Depends(get_super_admin_user), session: Session = Depends(get_session, scope="function")):
+    """
+    Відновлення з файлу /admin/backup (JSON або .json.gz), потоком і пачками
+    (див. RestoreService). Усе в одній транзакції: помилка не лишає базу
+    напівзаповненою. Хід виконання видно в /admin/metrics ("restore").
+    """
+    activity_log_writer.flush()  # Queued entries belong to the data being wiped
     try:
-        content = file.file.read()
-        backup = json.loads(content)
-        data = backup.get("data")
-        if not data:
-            raise ValueError("Invalid backup format: missing 'data' field")
-    except Exception as e:
+        result = RestoreService.restore(session, file.file)
+    except BackupFormatError as e:
+        session.rollback()
         raise HTTPException(status_code=400, detail=f"Invalid backup file: {e}")
-        
-    # 2. CLEAR ALL DATA (Order matters for Foreign Keys!)
-    # Child tables first
-    session.exec(delete(PaymentAllocation))
-    session.exec(delete(Deduction))
-    session.exec(delete(OrderFile))
-    session.exec(delete(ActivityLog))
-    session.exec(delete(Payment))
-    session.exec(delete(Order))
-    session.exec(delete(User))
-    
-    try:
-        # 3. RESTORE DATA (Parent tables first)
-        
-        def parse_date(date_str):
-            if not date_str: return None
-            try:
-                # Handle YYYY-MM-DD
-                return datetime.strptime(date_str, "%Y-%m-%d").date()
-            except ValueError:
-                # Fallback for full ISO format if present
-                try:
-                    return datetime.fromisoformat(date_str).date()
-                except:
-                    return None
-
-        def parse_datetime(dt_str):
-            if not dt_str: return None
-            try:
-                # Handle standard ISO format
-                return datetime.fromisoformat(dt_str)
-            except:
-                return None
-
-        # USERS
-        for item in data.get("users", []):
-            session.add(User(**item))
-        session.flush() # Ensure IDs are claimed
-            
-        # ORDERS
-        for item in data.get("orders", []):
-            # Manually parse date fields
-            if "date_received" in item: item["date_received"] = parse_date(item["date_received"])
-            if "date_manager_handover" in item: item["date_manager_handover"] = parse_date(item["date_manager_handover"])
-            if "date_design_deadline" in item: item["date_design_deadline"] = parse_date(item["date_design_deadline"])
-            if "date_to_work" in item: item["date_to_work"] = parse_date(item["date_to_work"])
-            if "date_installation" in item: item["date_installation"] = parse_date(item["date_installation"])
-            if "constructive_start_date" in item: item["constructive_start_date"] = parse_date(item["constructive_start_date"])
-            if "constructive_end_date" in item: item["constructive_end_date"] = parse_date(item["constructive_end_date"])
-            if "complectation_start_date" in item: item["complectation_start_date"] = parse_date(item["complectation_start_date"])
-            if "complectation_end_date" in item: item["complectation_end_date"] = parse_date(item["complectation_end_date"])
-            if "preassembly_start_date" in item: item["preassembly_start_date"] = parse_date(item["preassembly_start_date"])
-            if "preassembly_end_date" in item: item["preassembly_end_date"] = parse_date(item["preassembly_end_date"])
-            if "installation_start_date" in item: item["installation_start_date"] = parse_date(item["installation_start_date"])
-            if "installation_end_date" in item: item["installation_end_date"] = parse_date(item["installation_end_date"])
-            if "date_advance_paid" in item: item["date_advance_paid"] = parse_date(item["date_advance_paid"])
-            if "date_final_paid" in item: item["date_final_paid"] = parse_date(item["date_final_paid"])
-            
-            session.add(Order(**item))
-        session.flush()
-
-        # PAYMENTS
-        for item in data.get("payments", []):
-            if "date_received" in item: item["date_received"] = parse_date(item["date_received"])
-            if "constructive_start_date" in item: item["constructive_start_date"] = parse_date(item["constructive_start_date"])
-            if "constructive_end_date" in item: item["constructive_end_date"] = parse_date(item["constructive_end_date"])
-            if "complectation_start_date" in item: item["complectation_start_date"] = parse_date(item["complectation_start_date"])
-            if "complectation_end_date" in item: item["complectation_end_date"] = parse_date(item["complectation_end_date"])
-            if "preassembly_start_date" in item: item["preassembly_start_date"] = parse_date(item["preassembly_start_date"])
-            if "preassembly_end_date" in item: item["preassembly_end_date"] = parse_date(item["preassembly_end_date"])
-            if "installation_start_date" in item: item["installation_start_date"] = parse_date(item["installation_start_date"])
-            if "installation_end_date" in item: item["installation_end_date"] = parse_date(item["installation_end_date"])
-            if "created_at" in item: item["created_at"] = parse_datetime(item["created_at"])
-            session.add(Payment(**item))
-        session.flush()
-
-        # ALLOCATIONS
-        for item in data.get("allocations", []):
-            if "created_at" in item: item["created_at"] = parse_datetime(item["created_at"])
-            session.add(PaymentAllocation(**item))
-        
-        # DEDUCTIONS
-        for item in data.get("deductions", []):
-            if "date_created" in item: item["date_created"] = parse_date(item["date_created"])
-            if "date_paid" in item: item["date_paid"] = parse_date(item["date_paid"])
-            session.add(Deduction(**item))
-            
-        # ACTIVITY LOGS
-        for item in data.get("activity_logs", []):
-            if "timestamp" in item: item["timestamp"] = parse_date(item["timestamp"])
-            session.add(ActivityLog(**item))
-            
-        # FILES
-        for item in data.get("order_files", []):
-            if "upload_date" in item: item["upload_date"] = parse_date(item["upload_date"])
-            session.add(OrderFile(**item))
-            
-        session.commit()
-        
-        log_activity(session, "SYSTEM_RESTORE", f"Базу даних відновлено з файлу {file.filename}")
-        return {"message": "Database restored successfully", "details": f"Version: {backup.get('version')}, Timestamp: {backup.get('timestamp')}"}
-        
     except Exception as e:
         session.rollback()
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Restore failed: {str(e)}")
 
+    # Old backups have no allocated_total; rebuild it from the restored ledger
+    PaymentDistributionService.sync_allocated_totals(session)
+    # order_financials were wiped; rebuilt for every order before commit
+    OrderFinancialsService.mark_orders(session, session.exec(select(Order.id)).all())
+    financials_cache.invalidate_all()
+    auth_user_cache.invalidate_all()  # Users were replaced with bulk SQL
+
+    log_activity(session, "SYSTEM_RESTORE", f"Базу даних відновлено з файлу {file.filename}")
+    return {
+        "message": "Database restored successfully",
+        "details": f"Version: {result['version']}, Timestamp: {result['timestamp']}",
+        "rows": result["rows"],
+        "seconds": round(result["seconds"], 3),
+    }
+
 
 # --- ADMIN SETTINGS ---
 @router.get("/admin/settings", response_model=Settings)
@@ -2168,20 +1748,187 @@ def update_settings(settings: Settings, current_user: User = Depends(get_super_a
     save_settings(settings)
     return settings
 
-# --- FILE UPLOAD / DOWNLOAD ---
+@router.post("/admin/files/gc")
+def collect_file_store_garbage(
+    dry_run: bool = True,
+    prune_links: bool = False,
+    session: Session = Depends(get_session, scope="function"),
+    current_user: User = Depends(get_super_admin_user)
+):
+    """Видаляє блоби файлового сховища без посилань з OrderFile (dry_run=false — реально видаляє)."""
+    result = file_store.gc(session, load_settings().storage_path, dry_run=dry_run, prune_links=prune_links)
+    if not dry_run:
+        log_activity(session, "FILE_STORE_GC", f"Очищено сховище файлів: {result['deleted']} блобів, {result['bytes_freed']} байт")
+    return result
 
-@router.post("/orders/{order_id}/upload")
-async def upload_file(
-    order_id: int, 
-    folder_category: str,
-    file: UploadFile = File(...), 
-    session: Session = Depends(get_session),
+@router.get("/admin/financials/check")
+def check_order_financials(
+    fix: bool = False,
+    session: Session = Depends(get_session, scope="function"),
+    current_user: User = Depends(get_admin_user)
+):
+    """Порівнює збережені order_financials з перерахунком; fix=true виправляє розбіжності."""
+    report = OrderFinancialsService.check_consistency(session, fix=fix)
+    if fix:
+        session.flush()
+        financials_cache.invalidate_all()
+        log_activity(
+            session,
+            "FIX_FINANCIALS",
+            f"Виправлено фінанси замовлень: {len(report['mismatches'])} розбіжностей, {len(report['missing'])} відсутніх",
+        )
+    return report
+
+# --- SEARCH ---
+SEARCH_MAX_LIMIT = 100
+
+
+@router.get("/search", response_model=List[SearchResultRead])
+def search_records(
+    q: str,
+    limit: int = 20,
+    types: Optional[str] = None,
+    session: Session = Depends(get_session, scope="function"),
     current_user: User = Depends(get_current_user)
 ):
+    """
+    Пошук по назвах замовлень, нотатках платежів і описах відрахувань.
+    types - через кому: order,payment,deduction (за замовчуванням усі).
+    """
+    q = q.strip()
+    if not q:
+        return []
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    doc_types = [t.strip() for t in types.split(",") if t.strip()] if types else list(SEARCH_DOC_TYPES)
+    unknown = set(doc_types) - set(SEARCH_DOC_TYPES)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown search types: {', '.join(sorted(unknown))}")
+
+    # Access is checked per hit, so restricted roles fetch extra candidates
+    fetch_limit = limit if is_admin(current_user) else limit * 5
+    hits = SearchService.search(session, q, limit=fetch_limit, doc_types=doc_types)
+
+    def load_by_id(model, ids):
+        ids = {i for i in ids if i is not None}
+        if not ids:
+            return {}
+        return {obj.id: obj for obj in session.exec(select(model).where(model.id.in_(ids))).all()}
+
+    payments_by_id = load_by_id(Payment, [h["id"] for h in hits if h["type"] == "payment"])
+    deductions_by_id = load_by_id(Deduction, [h["id"] for h in hits if h["type"] == "deduction"])
+    orders_by_id = load_by_id(Order, [h["order_id"] for h in hits])
+
+    results = []
+    for hit in hits:
+        order = orders_by_id.get(hit["order_id"])
+        if hit["type"] == "order":
+            if order is None or not can_access_order(current_user, order):
+                continue
+        elif hit["type"] == "deduction":
+            deduction = deductions_by_id.get(hit["id"])
+            if deduction is None or order is None or not can_access_order(current_user, order):
+                continue
+            if current_user.role == "constructor" and deduction.target_role not in (None, "constructor"):
+                continue
+        elif hit["type"] == "payment":
+            payment = payments_by_id.get(hit["id"])
+            if payment is None:
+                continue
+            if current_user.role == "constructor" and not is_payment_visible_to_constructor(session, payment, current_user.id):
+                continue
+            if current_user.role == "manager" and not is_payment_visible_to_manager(session, payment, current_user.id):
+                continue
+
+        results.append(SearchResultRead(order_name=order.name if order else None, **hit))
+        if len(results) >= limit:
+            break
+    return results
+
+# --- METRICS ---
+@router.get("/admin/metrics")
+def get_metrics(current_user: User = Depends(get_admin_user)):
+    return {
+        "financials_cache": financials_cache.stats(),
+        "activity_log": activity_log_writer.stats(),
+        "auth_cache": auth_user_cache.stats(),
+        "password_pool": password_pool_stats(),
+        "sqlite": sqlite_tuning.stats(SQLITE_PATH) if SQLITE_PATH else None,
+        "restore": restore_progress.stats(),
+        "telegram_outbox": telegram_dispatcher.stats(),
+        "uploads": upload_stats.stats(),
+        "file_store": file_store.stats(),
+        "db_pool": {
+            "pgbouncer": DB_PGBOUNCER and SQLITE_PATH is None,
+            "pre_ping": DB_POOL_PRE_PING and SQLITE_PATH is None and not DB_PGBOUNCER,
+            "sync": sync_pool_metrics.stats(engine),
+            "async": async_pool_metrics.stats(async_engine.sync_engine) if async_engine is not None else None,
+        },
+    }
+
+# --- FILE UPLOAD / DOWNLOAD ---
+
+# The body is parsed by upload_service, not by FastAPI: declare it for /docs
+UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {"file": {"type": "string", "format": "binary"}},
+            "required": ["file"],
+        }}},
+    }
+}
+
+def record_upload(session: Session, order_id: int, folder_category: str, filename: str, size: int, content_hash: str) -> OrderFile:
+    safe_filename = sanitize_filename(filename)
+    # Create DB Link
+    # We store a special URL that points to our download endpoint
+    # Format: /api/download/{order_id}/{category}/{filename}
+    download_url = f"/api/download/{order_id}/{folder_category}/{safe_filename}"
+
+    # Same name in the same folder replaced the file on disk, so it replaces
+    # the link too (a stale content_hash would keep its blob alive forever)
+    new_file = session.exec(select(OrderFile).where(
+        OrderFile.order_id == order_id, OrderFile.url == download_url
+    )).first()
+    if new_file is None:
+        new_file = OrderFile(
+            order_id=order_id,
+            name=safe_filename,
+            url=download_url,
+            folder_name=folder_category,
+        )
+    new_file.size = size
+    new_file.content_hash = content_hash
+    new_file.upload_date = date.today()
+    session.add(new_file)
+    session.flush()
+
+    log_activity(session, "UPLOAD_FILE", f"Завантажено файл '{safe_filename}' у '{folder_category}'")
+    return new_file
+
+def load_upload_order(session: Session, order_id: int, current_user: User) -> Order:
     order = session.get(Order, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     ensure_order_access(current_user, order)
+    # End the read transaction before the body is streamed: a slow upload must
+    # not keep a pooled connection idle in transaction. record_upload runs in
+    # a new, short one.
+    session.commit()
+    return order
+
+@router.post("/orders/{order_id}/upload", openapi_extra=UPLOAD_OPENAPI)
+async def upload_file(
+    order_id: int, 
+    folder_category: str,
+    request: Request,
+    session: Session = Depends(get_session, scope="function"),
+    current_user: User = Depends(get_current_user)
+):
+    # Nothing blocking runs on the event loop: database and disk work go to
+    # the threadpool, the body is streamed (see upload_service.py)
+    order = await run_in_threadpool(load_upload_order, session, order_id, current_user)
 
     try:
         folder_category = normalize_folder_category(folder_category)
@@ -2191,42 +1938,81 @@ async def upload_file(
     settings = load_settings()
     
     # Ensure structure exists (just in case)
-    ensure_project_structure(order.name, settings.storage_path)
-    
+    await run_in_threadpool(ensure_project_structure, order.name, settings.storage_path)
+    folder_path = os.path.join(settings.storage_path, sanitize_filename(order.name), folder_category)
+
+    started = time.perf_counter()
+    upload = StreamingUpload(folder_path, upload_limit(folder_category))
+    try:
+        await upload.receive(request)
+        if not sanitize_filename(upload.filename):
+            raise UploadError("Invalid file name")
+    except UploadError as e:
+        await upload.discard()
+        upload_stats.record_rejected()
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
     # Save file
-    safe_filename = sanitize_filename(file.filename)
-    file_path = get_file_path(order.name, folder_category, safe_filename, settings.storage_path)
-    
+    file_path = get_file_path(order.name, folder_category, upload.filename, settings.storage_path)
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        if file_store.enabled:
+            await upload.commit_to_store(file_store, settings.storage_path, file_path)
+        else:
+            await upload.commit(file_path)
     except Exception as e:
+        await upload.discard()
         raise HTTPException(status_code=500, detail=f"Failed to save file: {e}")
-        
-    # Create DB Link
-    # We store a special URL that points to our download endpoint
-    # Format: /api/download/{order_id}/{category}/{filename}
-    download_url = f"/api/download/{order_id}/{folder_category}/{safe_filename}"
-    
-    new_file = OrderFile(
-        order_id=order_id,
-        name=safe_filename,
-        url=download_url,
-        folder_name=folder_category
-    )
-    session.add(new_file)
-    session.commit()
-    session.refresh(new_file)
-    
-    log_activity(session, "UPLOAD_FILE", f"Завантажено файл '{safe_filename}' у '{folder_category}'")
-    return new_file
+    upload_stats.record(upload.size, time.perf_counter() - started)
+
+    return await run_in_threadpool(record_upload, session, order_id, folder_category, upload.filename, upload.size, upload.sha256)
+
+class UploadByHash(BaseModel):
+    filename: str
+    content_hash: str
+
+@router.post("/orders/{order_id}/upload/by-hash")
+def upload_file_by_hash(
+    order_id: int,
+    folder_category: str,
+    data: UploadByHash,
+    session: Session = Depends(get_session, scope="function"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Hash-first upload: when the file store already has this content it is
+    linked into the order folder without sending the file. 404 means the
+    client has to upload it.
+    """
+    order = session.get(Order, order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    ensure_order_access(current_user, order)
+
+    try:
+        folder_category = normalize_folder_category(folder_category)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid folder category")
+    content_hash = data.content_hash.lower()
+    if not is_sha256(content_hash) or not sanitize_filename(data.filename):
+        raise HTTPException(status_code=400, detail="Invalid file name or hash")
+
+    settings = load_settings()
+    if not file_store.has_blob(settings.storage_path, content_hash):
+        raise HTTPException(status_code=404, detail="Content not stored, upload the file")
+    ensure_project_structure(order.name, settings.storage_path)
+    file_path = get_file_path(order.name, folder_category, data.filename, settings.storage_path)
+    size = file_store.link_existing(settings.storage_path, content_hash, file_path)
+    if size is None:
+        raise HTTPException(status_code=404, detail="Content not stored, upload the file")
+
+    return record_upload(session, order_id, folder_category, data.filename, size, content_hash)
 
 @router.get("/download/{order_id}/{folder_category}/{filename}")
 def download_file(
     order_id: int,
     folder_category: str,
     filename: str,
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_session, scope="function"),
     current_user: User = Depends(get_current_user)
 ):
     order = session.get(Order, order_id)
@@ -2244,13 +2030,16 @@ def download_file(
     file_path = get_file_path(order.name, folder_category, safe_filename, settings.storage_path)
     
     if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found on server")
+        # Virtual file store mode: the folder has no copy, the blob has
+        file_path = stored_file_path(session, order_id, folder_category, safe_filename, settings.storage_path)
+        if file_path is None:
+            raise HTTPException(status_code=404, detail="File not found on server")
         
     return FileResponse(path=file_path, filename=safe_filename)
 
 @router.get("/debug/force_fix")
 def debug_force_fix(
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_session, scope="function"),
     current_user: User = Depends(get_admin_user)
 ):
     report = []
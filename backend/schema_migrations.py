@@ -0,0 +1,286 @@
+import hashlib
+import json
+import logging
+import os
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+
+from sqlalchemy import inspect, text
+from sqlmodel import Session, SQLModel, select
+from database import engine, SQLITE_PATH
+from models import Order, OrderFinancials, SchemaMigration, SchemaState
+from payment_service import SYNC_ALLOCATED_TOTAL_SQL
+from financials_service import OrderFinancialsService
+from search_service import SearchService
+
+logger = logging.getLogger(__name__)
+
+# A step is raw SQL or a callable(session). Every step must be idempotent:
+# on a fresh database create_all() already built the current schema and the
+# whole registry still runs once to record the versions. Steps work on the
+# schema as of their version, so they use raw SQL and the inspector only;
+# anything that needs the current models runs in POST_MIGRATION_STEPS.
+MigrationStep = Union[str, Callable[[Session], None]]
+
+
+def add_columns(table: str, columns: Sequence[Tuple[str, str]]) -> Callable[[Session], None]:
+    """Step that adds the missing columns: [(name, "TYPE [DEFAULT ...]"), ...]."""
+    def step(session: Session):
+        connection = session.connection()
+        existing = {column["name"] for column in inspect(connection).get_columns(table)}
+        quoted_table = connection.dialect.identifier_preparer.quote(table)
+        for name, ddl in columns:
+            if name not in existing:
+                logger.info(f"Adding column '{table}.{name}'...")
+                connection.execute(text(f"ALTER TABLE {quoted_table} ADD COLUMN {name} {ddl}"))
+    return step
+
+
+def create_model_indexes(session: Session):
+    """Indexes declared on models (create_all only adds them together with new tables)."""
+    connection = session.connection()
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def reset_order_financials_if_stale(session: Session):
+    # Rows written before remainder_amount existed are rebuilt by the backfill below
+    columns = {column["name"] for column in inspect(session.connection()).get_columns("order_financials")}
+    if "remainder_amount" not in columns:
+        add_columns("order_financials", [("remainder_amount", "FLOAT DEFAULT 0.0")])(session)
+        session.connection().execute(text("DELETE FROM order_financials"))
+
+
+def backfill_order_financials(session: Session):
+    # ORM over Order/User: needs every column of the models, see POST_MIGRATION_STEPS
+    has_orders = session.exec(select(Order.id).limit(1)).first() is not None
+    has_financials = session.exec(select(OrderFinancials.order_id).limit(1)).first() is not None
+    if has_orders and not has_financials:
+        logger.info("Backfilling order_financials...")
+        OrderFinancialsService.refresh_all(session)
+
+
+def ensure_search_index(session: Session):
+    SearchService.ensure_search_index(session)
+
+
+# Ordered registry: (version, name, steps). Append new migrations at the end,
+# never renumber or edit applied ones. No ORM entities (select(Order), ...)
+# or model metadata in these steps: an older database reaches them before
+# the columns of later versions exist. Data backfills go to
+# POST_MIGRATION_STEPS.
+MIGRATIONS: List[Tuple[int, str, List[MigrationStep]]] = [
+    (1, "order columns", [
+        add_columns("order", [
+            ("constructor_id", "INTEGER"),
+            ("date_design_deadline", "DATE"),
+            ("material_cost", "FLOAT DEFAULT 0.0"),
+            ("fixed_bonus", "FLOAT"),
+            ("custom_stage1_percent", "FLOAT"),
+            ("custom_stage2_percent", "FLOAT"),
+            ("date_manager_handover", "DATE"),
+            ("date_installation_plan", "DATE"),
+            ("constructive_days", "INTEGER DEFAULT 5"),
+            ("complectation_days", "INTEGER DEFAULT 2"),
+            ("preassembly_days", "INTEGER DEFAULT 1"),
+            ("installation_days", "INTEGER DEFAULT 3"),
+            ("constructive_start_date", "DATE"),
+            ("constructive_end_date", "DATE"),
+            ("complectation_start_date", "DATE"),
+            ("complectation_end_date", "DATE"),
+            ("preassembly_start_date", "DATE"),
+            ("preassembly_end_date", "DATE"),
+            ("installation_start_date", "DATE"),
+            ("installation_end_date", "DATE"),
+            ("manager_id", "INTEGER"),
+            ("manager_paid_amount", "FLOAT DEFAULT 0.0"),
+            ("date_manager_paid", "DATE"),
+        ]),
+    ]),
+    (2, "user columns", [
+        add_columns("user", [
+            ("card_number", "VARCHAR"),
+            ("email", "VARCHAR"),
+            ("phone_number", "VARCHAR"),
+            ("telegram_id", "VARCHAR"),
+            ("salary_mode", "VARCHAR DEFAULT 'sales_percent'"),
+            ("salary_percent", "FLOAT DEFAULT 5.0"),
+            ("payment_stage1_percent", "FLOAT DEFAULT 50.0"),
+            ("payment_stage2_percent", "FLOAT DEFAULT 50.0"),
+            ("can_see_constructor_pay", "BOOLEAN DEFAULT TRUE"),
+            ("can_see_stage1", "BOOLEAN DEFAULT TRUE"),
+            ("can_see_stage2", "BOOLEAN DEFAULT TRUE"),
+            ("can_see_debt", "BOOLEAN DEFAULT TRUE"),
+            ("can_see_dashboard", "BOOLEAN DEFAULT TRUE"),
+        ]),
+    ]),
+    (3, "payment columns", [
+        add_columns("payment", [
+            ("allocated_automatically", "BOOLEAN DEFAULT TRUE"),
+            ("notes", "TEXT"),
+            ("manual_order_id", "INTEGER"),
+            ("constructor_id", "INTEGER"),
+            ("manager_id", "INTEGER"),
+        ]),
+    ]),
+    (4, "payment allocated_total", [
+        add_columns("payment", [("allocated_total", "FLOAT DEFAULT 0.0")]),
+        SYNC_ALLOCATED_TOTAL_SQL,
+    ]),
+    (5, "deduction target_role", [
+        add_columns("deduction", [("target_role", "VARCHAR DEFAULT 'constructor'")]),
+        "UPDATE deduction SET target_role = 'constructor' WHERE target_role IS NULL OR target_role = ''",
+    ]),
+    (6, "order_financials backfill", [
+        reset_order_financials_if_stale,  # The backfill itself is a post-migration step
+    ]),
+    (7, "model indexes", []),  # Post-migration step: built from the current models
+    (8, "search index", [ensure_search_index]),
+    (9, "notification coalescing", [
+        add_columns("notification_outbox", [
+            ("kind", "VARCHAR DEFAULT 'message'"),
+            ("payload", "TEXT"),
+        ]),
+        add_columns("user", [("telegram_digest", "BOOLEAN DEFAULT FALSE")]),
+    ]),
+    (10, "order file size and hash", [
+        add_columns("orderfile", [
+            ("size", "INTEGER"),
+            ("content_hash", "VARCHAR"),
+        ]),
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Run after the registry on every migration run, once all columns exist.
+# Idempotent and cheap when there is nothing to do.
+POST_MIGRATION_STEPS: List[Tuple[str, MigrationStep]] = [
+    ("model indexes", create_model_indexes),
+    ("order_financials backfill", backfill_order_financials),
+]
+
+
+def applied_versions(session: Session) -> set:
+    return set(session.exec(select(SchemaMigration.version)).all())
+
+
+def run_migrations(session: Session, reapply: bool = False) -> List[str]:
+    """
+    Applies pending migrations in order, each in its own transaction, and
+    records them in schema_migrations, then runs POST_MIGRATION_STEPS.
+    Stops at the first failure so later migrations never run on top of a
+    missing one. reapply=True runs every migration again (manual repair via
+    /fix-db).
+
+    Returns log lines; failures start with "FAILED".
+    """
+    logs = []
+    done = set() if reapply else applied_versions(session)
+    for version, name, steps in MIGRATIONS:
+        if version in done:
+            continue
+        try:
+            for step in steps:
+                _run_step(session, step)
+            if session.get(SchemaMigration, version) is None:
+                session.add(SchemaMigration(version=version, name=name))
+            session.commit()
+            logs.append(f"APPLIED {version}: {name}")
+            logger.info(f"Applied schema migration {version}: {name}")
+        except Exception as e:
+            session.rollback()
+            logs.append(f"FAILED {version}: {name} | Error: {e}")
+            logger.error(f"Schema migration {version} ({name}) failed: {e}")
+            return logs
+
+    for name, step in POST_MIGRATION_STEPS:
+        try:
+            _run_step(session, step)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logs.append(f"FAILED post-migration: {name} | Error: {e}")
+            logger.error(f"Post-migration step '{name}' failed: {e}")
+            break
+    return logs
+
+
+def _run_step(session: Session, step: MigrationStep):
+    if isinstance(step, str):
+        session.connection().execute(text(step))
+    else:
+        step(session)
+
+
+def pending_versions(session: Session) -> List[int]:
+    done = applied_versions(session)
+    return [version for version, _, _ in MIGRATIONS if version not in done]
+
+
+def schema_fingerprint() -> str:
+    """Hash of the model metadata (tables, columns, indexes) and the migration registry."""
+    tables = [
+        [
+            table.name,
+            sorted(f"{column.name}:{column.type}" for column in table.columns),
+            sorted(index.name for index in table.indexes),
+        ]
+        for table in SQLModel.metadata.sorted_tables
+    ]
+    migrations = [[version, name] for version, name, _ in MIGRATIONS]
+    payload = json.dumps([tables, migrations], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def stored_fingerprint() -> Optional[str]:
+    """One query; None when the table does not exist yet."""
+    try:
+        with engine.connect() as connection:
+            return connection.execute(text("SELECT fingerprint FROM schema_state WHERE id = 1")).scalar()
+    except Exception:
+        return None
+
+
+def store_fingerprint(session: Session, fingerprint: str):
+    state = session.get(SchemaState, 1) or SchemaState(id=1, fingerprint=fingerprint)
+    state.fingerprint = fingerprint
+    state.updated_at = datetime.utcnow()
+    session.add(state)
+    session.commit()
+
+
+# Arbitrary application-wide key for pg_advisory_lock
+MIGRATION_LOCK_KEY = 73102024
+
+
+@contextmanager
+def migration_lock():
+    """
+    Serialises migrations between workers: pg_advisory_lock on Postgres,
+    an exclusive file lock next to the database file on SQLite.
+    """
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as connection:
+            connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            try:
+                yield
+            finally:
+                connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+                connection.commit()
+        return
+
+    try:
+        import fcntl
+    except ImportError:  # Windows dev setup: single process, no lock needed
+        yield
+        return
+    lock_path = f"{SQLITE_PATH}.migrate.lock" if SQLITE_PATH else os.path.join(os.getcwd(), ".migrate.lock")
+    with open(lock_path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,241 @@
+import html
+import re
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import Integer, bindparam, column, text
+from sqlmodel import Session
+from database import SEARCH_BACKEND
+from models import Order
+
+SEARCH_DOC_TYPES = ("order", "payment", "deduction")
+
+# Trigram tokenizer cannot match terms shorter than 3 characters,
+# such queries fall back to LIKE.
+FTS_MIN_TERM_LENGTH = 3
+
+# Match markers used inside highlights before HTML escaping
+_MARK_START = "\x02"
+_MARK_END = "\x03"
+
+# doc_type -> (rowid code, table, text column, order id column)
+# FTS rowid = source id * 4 + code, so triggers can update rows by rowid.
+SEARCH_SOURCES = {
+    "order": (1, '"order"', "name", "id"),
+    "payment": (2, "payment", "notes", "manual_order_id"),
+    "deduction": (3, "deduction", "description", "order_id"),
+}
+
+_active_backend: Optional[str] = None
+
+
+def _fts5_trigger_sql() -> List[str]:
+    statements = []
+    for doc_type, (code, table, body_col, order_col) in SEARCH_SOURCES.items():
+        name = table.strip('"')
+        insert_new = (
+            "INSERT INTO search_index(rowid, body, doc_type, doc_id, order_id) "
+            f"VALUES (new.id * 4 + {code}, COALESCE(new.{body_col}, ''), '{doc_type}', new.id, new.{order_col});"
+        )
+        delete_old = f"DELETE FROM search_index WHERE rowid = old.id * 4 + {code};"
+        statements.append(
+            f"CREATE TRIGGER IF NOT EXISTS search_{name}_ai AFTER INSERT ON {table} BEGIN {insert_new} END"
+        )
+        statements.append(
+            f"CREATE TRIGGER IF NOT EXISTS search_{name}_au AFTER UPDATE OF id, {body_col}, {order_col} ON {table} "
+            f"BEGIN {delete_old} {insert_new} END"
+        )
+        statements.append(
+            f"CREATE TRIGGER IF NOT EXISTS search_{name}_ad AFTER DELETE ON {table} BEGIN {delete_old} END"
+        )
+    return statements
+
+
+def _escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _fts5_phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _mark_terms(body: str, terms: Sequence[str]) -> str:
+    pattern = "|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+    return re.sub(f"({pattern})", f"{_MARK_START}\\1{_MARK_END}", body, flags=re.IGNORECASE)
+
+
+def render_highlight(marked: str) -> str:
+    """HTML-escaped text with <mark>...</mark> around the matches."""
+    return html.escape(marked).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+
+
+class SearchService:
+    """
+    Повнотекстовий пошук по назвах замовлень, нотатках платежів і описах
+    відрахувань.
+
+    Backend обирається в database.py (SEARCH_BACKEND):
+    - fts5: shadow-таблиця search_index (FTS5, trigram), синхронізується тригерами;
+    - pg_trgm: GIN-індекси gin_trgm_ops, ранжування similarity();
+    - like: без індексу (fallback, якщо попередні недоступні).
+    """
+
+    @staticmethod
+    def tokenize(query: str) -> List[str]:
+        return [term for term in query.split() if term]
+
+    @staticmethod
+    def ensure_search_index(session: Session):
+        """Створює індекси пошуку (викликається з міграцій, без commit)."""
+        global _active_backend
+        _active_backend = None
+        if SEARCH_BACKEND == "fts5":
+            exists = session.exec(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'")
+            ).first() is not None
+            session.connection().execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+                "body, doc_type UNINDEXED, doc_id UNINDEXED, order_id UNINDEXED, tokenize = 'trigram')"
+            ))
+            for sql in _fts5_trigger_sql():
+                session.connection().execute(text(sql))
+            if not exists:
+                SearchService.rebuild(session)
+        elif SEARCH_BACKEND == "pg_trgm":
+            session.connection().execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            for doc_type, (_, table, body_col, _) in SEARCH_SOURCES.items():
+                name = table.strip('"')
+                session.connection().execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_{name}_{body_col}_trgm ON {table} USING gin ({body_col} gin_trgm_ops)"
+                ))
+
+    @staticmethod
+    def rebuild(session: Session):
+        """Перезаповнює search_index з основних таблиць (лише fts5, без commit)."""
+        session.connection().execute(text("DELETE FROM search_index"))
+        for doc_type, (code, table, body_col, order_col) in SEARCH_SOURCES.items():
+            session.connection().execute(text(
+                "INSERT INTO search_index(rowid, body, doc_type, doc_id, order_id) "
+                f"SELECT id * 4 + {code}, COALESCE({body_col}, ''), '{doc_type}', id, {order_col} FROM {table}"
+            ))
+
+    @staticmethod
+    def active_backend(session: Session) -> str:
+        """SEARCH_BACKEND, якщо його індекс реально створений, інакше 'like'."""
+        global _active_backend
+        if _active_backend is None:
+            backend = "like"
+            try:
+                if SEARCH_BACKEND == "fts5":
+                    if session.exec(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'")).first():
+                        backend = "fts5"
+                elif SEARCH_BACKEND == "pg_trgm":
+                    if session.exec(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first():
+                        backend = "pg_trgm"
+            except Exception as e:
+                print(f"Search backend check failed: {e}")
+                session.rollback()
+            _active_backend = backend
+        return _active_backend
+
+    @staticmethod
+    def order_name_filter(session: Session, search: str):
+        """Умова WHERE для пошуку замовлень за назвою (підрядок) у GET /orders/."""
+        backend = SearchService.active_backend(session)
+        if backend == "fts5" and len(search) >= FTS_MIN_TERM_LENGTH:
+            matching_ids = (
+                text("SELECT doc_id FROM search_index WHERE search_index MATCH :order_match AND doc_type = 'order'")
+                .bindparams(order_match=_fts5_phrase(search))
+                .columns(column("doc_id", Integer))
+            )
+            return Order.id.in_(matching_ids)
+        if backend == "pg_trgm":
+            return Order.name.ilike(f"%{_escape_like(search)}%", escape="\\")
+        return Order.name.contains(search)
+
+    @staticmethod
+    def search(
+        session: Session,
+        query: str,
+        limit: int = 20,
+        doc_types: Optional[Sequence[str]] = None,
+    ) -> List[Dict]:
+        """
+        Ранжовані збіги: [{type, id, order_id, text, highlight, score}].
+        Кожне слово запиту має зустрічатися в тексті (як підрядок).
+        """
+        terms = SearchService.tokenize(query)
+        if not terms:
+            return []
+        doc_types = list(doc_types or SEARCH_DOC_TYPES)
+
+        backend = SearchService.active_backend(session)
+        if backend == "fts5" and all(len(term) >= FTS_MIN_TERM_LENGTH for term in terms):
+            rows = SearchService._search_fts5(session, terms, limit, doc_types)
+        else:
+            rows = SearchService._search_like(session, query, terms, limit, doc_types, trigram=backend == "pg_trgm")
+
+        return [
+            {
+                "type": doc_type,
+                "id": doc_id,
+                "order_id": order_id,
+                "text": (marked or "").replace(_MARK_START, "").replace(_MARK_END, ""),
+                "highlight": render_highlight(marked or ""),
+                "score": float(score or 0.0),
+            }
+            for doc_type, doc_id, order_id, marked, score in rows
+        ]
+
+    @staticmethod
+    def _search_fts5(session: Session, terms: List[str], limit: int, doc_types: List[str]):
+        rows = session.execute(
+            text(
+                "SELECT doc_type, doc_id, order_id, "
+                "highlight(search_index, 0, :mark_start, :mark_end), -bm25(search_index) AS score "
+                "FROM search_index WHERE search_index MATCH :match AND doc_type IN :doc_types "
+                "ORDER BY bm25(search_index), doc_id DESC LIMIT :limit"
+            ).bindparams(bindparam("doc_types", expanding=True)),
+            {
+                "match": " ".join(_fts5_phrase(term) for term in terms),
+                "mark_start": _MARK_START,
+                "mark_end": _MARK_END,
+                "doc_types": doc_types,
+                "limit": limit,
+            },
+        ).all()
+        return [(doc_type, int(doc_id), order_id, marked, score) for doc_type, doc_id, order_id, marked, score in rows]
+
+    @staticmethod
+    def _search_like(
+        session: Session,
+        query: str,
+        terms: List[str],
+        limit: int,
+        doc_types: List[str],
+        trigram: bool = False,
+    ):
+        params = {"query": query, "limit": limit}
+        for i, term in enumerate(terms):
+            params[f"term_{i}"] = f"%{_escape_like(term)}%"
+        like_op = "ILIKE" if trigram else "LIKE"
+
+        selects = []
+        for doc_type in doc_types:
+            _, table, body_col, order_col = SEARCH_SOURCES[doc_type]
+            condition = " AND ".join(
+                f"{body_col} {like_op} :term_{i} ESCAPE '\\'" for i in range(len(terms))
+            )
+            if trigram:
+                # Typo-tolerant match for whole-query similarity (served by the same GIN index)
+                condition = f"(({condition}) OR {body_col} % :query)"
+            score = f"similarity({body_col}, :query)" if trigram else "0.0"
+            selects.append(
+                f"SELECT '{doc_type}' AS doc_type, id AS doc_id, {order_col} AS order_id, "
+                f"{body_col} AS body, {score} AS score FROM {table} WHERE {condition}"
+            )
+        sql = " UNION ALL ".join(selects) + " ORDER BY score DESC, doc_id DESC LIMIT :limit"
+        rows = session.execute(text(sql), params).all()
+        return [
+            (doc_type, doc_id, order_id, _mark_terms(body or "", terms), score)
+            for doc_type, doc_id, order_id, body, score in rows
+        ]
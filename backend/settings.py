@@ -1,8 +1,19 @@
 import json
+import logging
 import os
+import tempfile
+import threading
+from typing import Dict, Optional, Tuple
 from pydantic import BaseModel
 
-SETTINGS_FILE = "settings.json"
+logger = logging.getLogger(__name__)
+
+# settings.json next to this module, like the SQLite file in database.py, so
+# the working directory of the server does not matter. SETTINGS_FILE
+# overrides it (e.g. a mounted volume in a container); a relative value is
+# resolved against the same directory.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SETTINGS_FILE = os.path.abspath(os.path.join(BASE_DIR, os.environ.get("SETTINGS_FILE", "settings.json")))
 DEFAULT_SETTINGS = {
     "storage_path": "C:\\TechPay_Projects" if os.name == 'nt' else "uploads",
     "telegram_bot_token": ""
@@ -12,30 +23,97 @@ class Settings(BaseModel):
     storage_path: str
     telegram_bot_token: str = ""
 
+# Environment variables that take precedence over settings.json. When every
+# field is set this way (containers), load_settings never touches the file.
+ENV_OVERRIDES = {
+    "storage_path": "STORAGE_PATH",
+    "telegram_bot_token": "TELEGRAM_BOT_TOKEN",
+}
+
+
+class SettingsCache:
+    """
+    Parsed settings.json, reloaded only when the file changes. The file is
+    identified by (mtime, size, inode): save_settings replaces it with a new
+    file, so every gunicorn worker sees the change on its next call.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._key: Optional[Tuple[int, int, int]] = None
+        self._settings: Optional[Settings] = None
+        self.reloads = 0
+
+    @staticmethod
+    def env_overrides() -> Dict[str, str]:
+        # Empty values count as unset (docker-compose passes ${VAR:-} through)
+        return {field: os.environ[name] for field, name in ENV_OVERRIDES.items() if os.environ.get(name)}
+
+    def _read(self) -> Settings:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            save_settings(Settings(**DEFAULT_SETTINGS))
+            return Settings(**DEFAULT_SETTINGS)
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self._lock:
+            if key == self._key and self._settings is not None:
+                return self._settings
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                settings = Settings(**json.load(f))
+        except Exception as e:
+            logger.error(f"Error loading settings: {e}")
+            return Settings(**DEFAULT_SETTINGS)
+        with self._lock:
+            self._key, self._settings = key, settings
+            self.reloads += 1
+        return settings
+
+    def get(self) -> Settings:
+        overrides = self.env_overrides()
+        if len(overrides) == len(ENV_OVERRIDES):
+            return Settings(**overrides)
+        settings = self._read()
+        # A copy: callers may modify it before save_settings
+        return settings.model_copy(update=overrides)
+
+    def invalidate(self):
+        with self._lock:
+            self._key, self._settings = None, None
+
+
+settings_cache = SettingsCache(SETTINGS_FILE)
+
+
 def load_settings() -> Settings:
-    if not os.path.exists(SETTINGS_FILE):
-        save_settings(Settings(**DEFAULT_SETTINGS))
-        return Settings(**DEFAULT_SETTINGS)
-    
-    try:
-        with open(SETTINGS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            return Settings(**data)
-    except Exception as e:
-        print(f"Error loading settings: {e}")
-        return Settings(**DEFAULT_SETTINGS)
+    return settings_cache.get()
 
 def save_settings(settings: Settings):
     try:
-        with open(SETTINGS_FILE, "w", encoding="utf-8") as f:
-            json.dump(settings.dict(), f, indent=4, ensure_ascii=False)
-            
+        # Temp file + rename: other workers never read a half-written file
+        directory = os.path.dirname(SETTINGS_FILE)
+        fd, tmp_path = tempfile.mkstemp(prefix=".settings-", suffix=".json", dir=directory)
+        try:
+            # mkstemp creates the file as 0600; keep the usual permissions
+            os.chmod(tmp_path, os.stat(SETTINGS_FILE).st_mode & 0o777 if os.path.exists(SETTINGS_FILE) else 0o644)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(settings.dict(), f, indent=4, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, SETTINGS_FILE)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        settings_cache.invalidate()
+
         # Ensure directory exists
         if not os.path.exists(settings.storage_path):
             try:
                 os.makedirs(settings.storage_path)
             except Exception as e:
-                print(f"Error creating storage directory: {e}")
-                
+                logger.error(f"Error creating storage directory: {e}")
+
     except Exception as e:
-        print(f"Error saving settings: {e}")
+        logger.error(f"Error saving settings: {e}")
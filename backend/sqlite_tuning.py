@@ -0,0 +1,107 @@
+import os
+import re
+import threading
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event
+
+# Connection tuning for the SQLite backend, applied on every new connection
+# of both engines (sync and async).
+#
+# WAL lets readers work while one writer commits, so concurrent gunicorn
+# workers wait on busy_timeout instead of failing with "database is locked".
+# synchronous=NORMAL in WAL mode fsyncs at checkpoints instead of on every
+# commit: a power loss can drop the last commits but never corrupts the file.
+#
+# Checkpoint policy: connections fold the WAL back into the database after
+# SQLITE_WAL_AUTOCHECKPOINT pages, journal_size_limit truncates the WAL file
+# after a checkpoint, and shutdown runs a TRUNCATE checkpoint so a stopped
+# site leaves a single database file behind.
+#
+# SQLITE_TUNING=false keeps SQLite defaults (rollback journal, full fsync).
+SQLITE_TUNING_ENABLED = os.environ.get("SQLITE_TUNING", "true").lower() in {"1", "true", "yes"}
+
+# Applied in this order: busy_timeout first, so switching to WAL waits for
+# other workers instead of failing.
+SQLITE_PRAGMAS: Dict[str, Any] = {
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+    # Negative cache_size is in KiB
+    "cache_size": -int(os.environ.get("SQLITE_CACHE_SIZE_KB", "20000")),
+    "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": os.environ.get("SQLITE_TEMP_STORE", "MEMORY"),
+    # Off by default: databases created before it may hold orphan rows, and
+    # the tables have no ON DELETE/UPDATE rules. Run PRAGMA foreign_key_check
+    # (empty result) before setting SQLITE_FOREIGN_KEYS=ON.
+    "foreign_keys": os.environ.get("SQLITE_FOREIGN_KEYS", "OFF"),
+    "wal_autocheckpoint": int(os.environ.get("SQLITE_WAL_AUTOCHECKPOINT", "1000")),
+    "journal_size_limit": int(os.environ.get("SQLITE_JOURNAL_SIZE_LIMIT", str(64 * 1024 * 1024))),
+}
+
+_PRAGMA_VALUE = re.compile(r"^-?[A-Za-z0-9_]+$")
+CHECKPOINT_MODES = {"PASSIVE", "FULL", "RESTART", "TRUNCATE"}
+
+
+class SQLiteTuning:
+    def __init__(self, enabled: bool = True, pragmas: Optional[Dict[str, Any]] = None):
+        self.enabled = enabled
+        self.pragmas = dict(SQLITE_PRAGMAS if pragmas is None else pragmas)
+        for name, value in self.pragmas.items():
+            # Pragma values cannot be bound as parameters
+            if not _PRAGMA_VALUE.match(str(value)):
+                raise ValueError(f"Invalid value for SQLite pragma {name}: {value!r}")
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.checkpoints = 0
+        self.last_checkpoint: Optional[Dict[str, Any]] = None
+
+    def apply(self, dbapi_connection):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in self.pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+        with self._lock:
+            self.connections += 1
+
+    def install(self, engine):
+        """Registers the pragmas on engine's connect event (pass async_engine.sync_engine for async)."""
+        if not self.enabled or engine.dialect.name != "sqlite":
+            return
+
+        @event.listens_for(engine, "connect")
+        def _on_connect(dbapi_connection, connection_record):
+            self.apply(dbapi_connection)
+
+    def checkpoint(self, engine, mode: str = "PASSIVE") -> Optional[Dict[str, Any]]:
+        """Runs PRAGMA wal_checkpoint(mode); None when the database is not in WAL mode."""
+        mode = mode.upper()
+        if mode not in CHECKPOINT_MODES:
+            raise ValueError(f"Unknown checkpoint mode: {mode}")
+        if engine.dialect.name != "sqlite":
+            return None
+        with engine.connect() as connection:
+            if connection.exec_driver_sql("PRAGMA journal_mode").scalar().lower() != "wal":
+                return None
+            busy, wal_pages, checkpointed = connection.exec_driver_sql(f"PRAGMA wal_checkpoint({mode})").one()
+        result = {"mode": mode, "busy": bool(busy), "wal_pages": wal_pages, "checkpointed_pages": checkpointed}
+        with self._lock:
+            self.checkpoints += 1
+            self.last_checkpoint = result
+        return result
+
+    def stats(self, sqlite_path: Optional[str] = None) -> Dict[str, Any]:
+        wal_path = f"{sqlite_path}-wal" if sqlite_path else None
+        return {
+            "enabled": self.enabled,
+            "pragmas": self.pragmas,
+            "connections": self.connections,
+            "wal_bytes": os.path.getsize(wal_path) if wal_path and os.path.exists(wal_path) else 0,
+            "checkpoints": self.checkpoints,
+            "last_checkpoint": self.last_checkpoint,
+        }
+
+
+sqlite_tuning = SQLiteTuning(enabled=SQLITE_TUNING_ENABLED, pragmas=SQLITE_PRAGMAS)
@@ -0,0 +1,256 @@
+from typing import Dict, List, Optional, Tuple
+
+from sqlmodel import Session, select, func
+from models import Order, User, Deduction
+from payments import Payment, PaymentAllocation
+from financial_logic import (
+    DEDUCTION_BATCH_SIZE,
+    calculate_constructor_financials,
+    calculate_manager_financials,
+    calculate_order_current_debt,
+    sum_unpaid_deductions_by_order,
+)
+from financial_cache import financials_cache
+
+
+class FinancialStatsService:
+    """Агрегати для дашборду /stats/financial за фіксовану кількість запитів"""
+
+    @staticmethod
+    def _sum_payments_by(session: Session, column) -> Dict[int, float]:
+        rows = session.exec(
+            select(column, func.sum(Payment.amount))
+            .where(column.is_not(None))
+            .group_by(column)
+        ).all()
+        return {user_id: total or 0.0 for user_id, total in rows}
+
+    @staticmethod
+    def _sum_allocations_by(session: Session, column) -> Dict[int, float]:
+        rows = session.exec(
+            select(column, func.sum(PaymentAllocation.amount))
+            .join(Payment, Payment.id == PaymentAllocation.payment_id)
+            .where(column.is_not(None))
+            .group_by(column)
+        ).all()
+        return {user_id: total or 0.0 for user_id, total in rows}
+
+    @staticmethod
+    def _active_user_ids(session: Session, order_column, payment_column) -> set:
+        order_user_ids = session.exec(select(order_column).where(order_column.is_not(None)).distinct()).all()
+        payment_user_ids = session.exec(select(payment_column).where(payment_column.is_not(None)).distinct()).all()
+        return set(order_user_ids) | set(payment_user_ids)
+
+    @staticmethod
+    def get_totals(session: Session) -> Dict[str, float]:
+        total_received = session.exec(select(func.sum(Payment.amount))).one()
+        total_allocated = session.exec(select(func.sum(PaymentAllocation.amount))).one()
+        total_deductions = session.exec(select(func.sum(Deduction.amount)).where(Deduction.is_paid == False)).one()
+
+        if total_received is None: total_received = 0.0
+        if total_allocated is None: total_allocated = 0.0
+        if total_deductions is None: total_deductions = 0.0
+
+        return {
+            "total_received": total_received,
+            "total_allocated": total_allocated,
+            "unallocated": total_received - total_allocated,
+            "total_deductions": total_deductions,
+        }
+
+    @staticmethod
+    def _load_financials(
+        session: Session,
+        orders: List[Order],
+        users_by_id: Dict[int, User],
+    ) -> Dict[int, Tuple[dict, dict]]:
+        """
+        (constructor_financials, manager_financials) for every order: served
+        from the financials cache where possible, otherwise computed in memory
+        from one grouped deduction query.
+        """
+        financials_by_order = {}
+        misses = []
+        for order in orders:
+            cached = financials_cache.get(order)
+            if cached is not None:
+                financials_by_order[order.id] = cached
+            else:
+                misses.append(order)
+
+        if not misses:
+            return financials_by_order
+
+        generation = financials_cache.begin()
+        # A full-table GROUP BY is cheaper than many batched IN (...) lists.
+        miss_ids = None if len(misses) > DEDUCTION_BATCH_SIZE else [order.id for order in misses]
+        unpaid_by_order = sum_unpaid_deductions_by_order(session, miss_ids)
+
+        for order in misses:
+            unpaid = unpaid_by_order.get(order.id) or {}
+            constructor_financials = calculate_constructor_financials(
+                order,
+                constructor=users_by_id.get(order.constructor_id),
+                unpaid_deductions=unpaid.get("constructor", 0.0),
+            )
+            manager_financials = calculate_manager_financials(
+                order,
+                manager=users_by_id.get(order.manager_id),
+                unpaid_deductions=unpaid.get("manager", 0.0),
+            )
+            financials_cache.put(order, constructor_financials, manager_financials, generation=generation)
+            financials_by_order[order.id] = (constructor_financials, manager_financials)
+
+        return financials_by_order
+
+    @staticmethod
+    def _manager_totals(
+        orders: List[Order],
+        financials_by_order: Dict[int, Tuple[dict, dict]],
+    ) -> Dict[str, float]:
+        bonus_total = 0.0
+        paid_total = 0.0
+        debt = 0.0
+        for order in orders:
+            _, manager_financials = financials_by_order[order.id]
+            bonus_total += manager_financials["active_amount"]
+            paid_total += manager_financials["active_paid_amount"]
+            debt += manager_financials["current_debt"]
+        return {"bonus": bonus_total, "paid": paid_total, "debt": debt}
+
+    @staticmethod
+    def _constructor_debt(
+        orders: List[Order],
+        financials_by_order: Dict[int, Tuple[dict, dict]],
+    ) -> float:
+        debt = 0.0
+        for order in orders:
+            constructor_financials, _ = financials_by_order[order.id]
+            debt += calculate_order_current_debt(
+                advance_remaining=constructor_financials["advance_remaining"],
+                final_remaining=constructor_financials["final_remaining"],
+                unabsorbed_deductions=constructor_financials.get("unabsorbed_deductions", 0.0),
+                stage1_active=bool(order.date_to_work),
+                stage2_active=bool(order.date_installation),
+            )
+        return debt
+
+    @staticmethod
+    def get_manager_stats(session: Session, manager: User) -> dict:
+        """Особиста статистика менеджера (dashboard_scope = manager)"""
+        totals = FinancialStatsService.get_totals(session)
+
+        manager_received = session.exec(
+            select(func.sum(Payment.amount)).where(Payment.manager_id == manager.id)
+        ).one() or 0.0
+        manager_allocated = session.exec(
+            select(func.sum(PaymentAllocation.amount))
+            .join(Payment, Payment.id == PaymentAllocation.payment_id)
+            .where(Payment.manager_id == manager.id)
+        ).one() or 0.0
+
+        manager_orders = session.exec(
+            select(Order).where(Order.manager_id == manager.id)
+        ).all()
+        constructor_ids = {order.constructor_id for order in manager_orders if order.constructor_id}
+        users_by_id = {manager.id: manager}
+        if constructor_ids:
+            users_by_id.update({
+                user.id: user for user in session.exec(select(User).where(User.id.in_(constructor_ids))).all()
+            })
+        financials_by_order = FinancialStatsService._load_financials(session, manager_orders, users_by_id)
+        manager_totals = FinancialStatsService._manager_totals(manager_orders, financials_by_order)
+
+        return {
+            "dashboard_scope": "manager",
+            "manager_personal_debt": manager_totals["debt"],
+            "manager_personal_unallocated": manager_received - manager_allocated,
+            "manager_personal_bonus": manager_totals["bonus"],
+            "manager_personal_paid": manager_totals["paid"],
+            "total_received": totals["total_received"],
+            "total_allocated": totals["total_allocated"],
+            "unallocated": totals["unallocated"],
+            "total_deductions": totals["total_deductions"],
+            "total_debt": 0.0,
+            "total_manager_debt": manager_totals["debt"],
+            "constructors_stats": [],
+            "manager_stats": []
+        }
+
+    @staticmethod
+    def get_global_stats(session: Session) -> dict:
+        """
+        Глобальна статистика по всіх конструкторах і менеджерах.
+
+        Надходження/розподіл рахуються згрупованими SUM-запитами, борг -
+        одним проходом по всіх замовленнях у пам'яті (з кешу, де можливо).
+        """
+        totals = FinancialStatsService.get_totals(session)
+
+        all_users = session.exec(select(User)).all()
+        all_orders = session.exec(select(Order)).all()
+        financials_by_order = FinancialStatsService._load_financials(
+            session, all_orders, {user.id: user for user in all_users}
+        )
+
+        constructor_activity = FinancialStatsService._active_user_ids(session, Order.constructor_id, Payment.constructor_id)
+        manager_activity = FinancialStatsService._active_user_ids(session, Order.manager_id, Payment.manager_id)
+
+        constructors = [u for u in all_users if u.role == 'constructor' or u.id in constructor_activity]
+        managers = [u for u in all_users if u.role == 'manager' or u.id in manager_activity]
+
+        orders_by_constructor: Dict[Optional[int], List[Order]] = {}
+        orders_by_manager: Dict[Optional[int], List[Order]] = {}
+        for order in all_orders:
+            orders_by_constructor.setdefault(order.constructor_id, []).append(order)
+            orders_by_manager.setdefault(order.manager_id, []).append(order)
+
+        received_by_constructor = FinancialStatsService._sum_payments_by(session, Payment.constructor_id)
+        allocated_by_constructor = FinancialStatsService._sum_allocations_by(session, Payment.constructor_id)
+        received_by_manager = FinancialStatsService._sum_payments_by(session, Payment.manager_id)
+        allocated_by_manager = FinancialStatsService._sum_allocations_by(session, Payment.manager_id)
+
+        constructors_stats = []
+        global_total_debt = 0.0
+        for c in constructors:
+            c_unallocated = received_by_constructor.get(c.id, 0.0) - allocated_by_constructor.get(c.id, 0.0)
+            c_debt = FinancialStatsService._constructor_debt(
+                orders_by_constructor.get(c.id, []), financials_by_order
+            )
+            global_total_debt += c_debt
+
+            constructors_stats.append({
+                "id": c.id,
+                "name": c.full_name or c.username,
+                "unallocated": c_unallocated,
+                "debt": c_debt
+            })
+
+        manager_stats = []
+        global_total_manager_debt = 0.0
+        for m in managers:
+            m_totals = FinancialStatsService._manager_totals(
+                orders_by_manager.get(m.id, []), financials_by_order
+            )
+            m_unallocated = received_by_manager.get(m.id, 0.0) - allocated_by_manager.get(m.id, 0.0)
+
+            manager_stats.append({
+                "id": m.id,
+                "name": m.full_name or m.username,
+                "bonus": m_totals["bonus"],
+                "paid": m_totals["paid"],
+                "debt": m_totals["debt"],
+                "unallocated": m_unallocated
+            })
+            global_total_manager_debt += m_totals["debt"]
+
+        return {
+            "total_received": totals["total_received"],
+            "total_allocated": totals["total_allocated"],
+            "unallocated": totals["unallocated"],
+            "total_deductions": totals["total_deductions"],
+            "total_debt": global_total_debt,
+            "total_manager_debt": global_total_manager_debt,
+            "constructors_stats": constructors_stats,
+            "manager_stats": manager_stats
+        }
@@ -0,0 +1,331 @@
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import event, func, update
+from sqlalchemy.orm import Session as SASession
+from sqlmodel import Session, select
+from database import engine
+from models import NotificationOutbox
+from notification_digest import COALESCIBLE_KINDS, notification_digest, render_summary
+from settings import load_settings
+
+# Background delivery of the notification_outbox table.
+#
+# Request handlers only insert outbox rows (TelegramService with a session),
+# so a slow or unreachable Telegram API never delays a request. The
+# dispatcher thread claims due rows, sends them over one pooled HTTP session
+# and records the outcome. Failures are retried with exponential backoff and
+# jitter; a 429 waits for Telegram's retry_after. Token buckets keep us under
+# Telegram's limits (about 30 messages/s per bot, 1 message/s per chat).
+#
+# Rows are claimed by moving next_attempt_at forward by the lease, guarded by
+# its old value, so several gunicorn workers can run dispatchers against the
+# same table without sending a message twice. A worker that dies mid-send
+# leaves the row to be retried after the lease.
+#
+# Payment/deduction rows of one chat are merged into a single summary and
+# held rows become daily digests, see notification_digest.py.
+#
+# TELEGRAM_API_URL points the dispatcher at another server, e.g. the local
+# stub in telegram_stub.py. TELEGRAM_DISPATCHER=off disables the thread
+# (rows stay pending until a dispatcher runs).
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+TELEGRAM_DISPATCHER_ENABLED = os.environ.get("TELEGRAM_DISPATCHER", "on").lower() not in {"0", "false", "off", "no"}
+TELEGRAM_POLL_INTERVAL = float(os.environ.get("TELEGRAM_POLL_INTERVAL", "5"))
+TELEGRAM_BATCH_SIZE = int(os.environ.get("TELEGRAM_BATCH_SIZE", "50"))
+TELEGRAM_MAX_ATTEMPTS = int(os.environ.get("TELEGRAM_MAX_ATTEMPTS", "8"))
+TELEGRAM_BACKOFF_BASE = float(os.environ.get("TELEGRAM_BACKOFF_BASE", "2"))
+TELEGRAM_BACKOFF_MAX = float(os.environ.get("TELEGRAM_BACKOFF_MAX", "600"))
+TELEGRAM_GLOBAL_RATE = float(os.environ.get("TELEGRAM_GLOBAL_RATE", "25"))
+TELEGRAM_CHAT_RATE = float(os.environ.get("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_LEASE_SECONDS = 60
+TELEGRAM_HTTP_TIMEOUT = (3.05, 10)
+
+# session.info key: the transaction added outbox rows
+_OUTBOX_WRITTEN = "telegram_outbox_written"
+
+
+class TokenBucket:
+    """rate tokens per second, bursts up to capacity."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self) -> float:
+        """Takes a token; returns how long to wait before using it (0 if available now)."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class TelegramDispatcher:
+    def __init__(
+        self,
+        api_url: str = "https://api.telegram.org",
+        poll_interval: float = 5.0,
+        batch_size: int = 50,
+        max_attempts: int = 8,
+        backoff_base: float = 2.0,
+        backoff_max: float = 600.0,
+        global_rate: float = 25.0,
+        chat_rate: float = 1.0,
+    ):
+        self.api_url = api_url
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self._chat_buckets: Dict[str, TokenBucket] = {}
+        self._http: Optional[requests.Session] = None
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.coalesced = 0  # rows delivered inside another row's summary
+
+    # --- HTTP ---
+
+    def _session(self) -> requests.Session:
+        if self._http is None:
+            http = requests.Session()
+            http.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+            http.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+            self._http = http
+        return self._http
+
+    def _throttle(self, chat_id: str):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                self._chat_buckets.clear()
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, 1)
+        wait = max(self.global_bucket.delay(), bucket.delay())
+        if wait > 0:
+            time.sleep(wait)
+
+    def send(self, token: str, chat_id: str, text: str):
+        """
+        One sendMessage call. Returns (ok, retry_after, error): retry_after is
+        None for permanent failures (bad chat id, bot blocked).
+        """
+        self._throttle(chat_id)
+        try:
+            response = self._session().post(
+                f"{self.api_url}/bot{token}/sendMessage",
+                json={"chat_id": chat_id, "text": text, "parse_mode": "HTML"},
+                timeout=TELEGRAM_HTTP_TIMEOUT,
+            )
+        except requests.RequestException as e:
+            return False, 0.0, f"{type(e).__name__}: {e}"
+        if response.status_code == 200:
+            return True, None, None
+        error = f"HTTP {response.status_code}: {response.text[:200]}"
+        if response.status_code == 429:
+            self.rate_limited += 1
+            try:
+                retry_after = float(response.json().get("parameters", {}).get("retry_after", 1))
+            except ValueError:
+                retry_after = 1.0
+            return False, retry_after, error
+        if response.status_code >= 500:
+            return False, 0.0, error
+        return False, None, error
+
+    # --- Outbox ---
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _claim(self, session: Session, row: NotificationOutbox, now: datetime) -> bool:
+        result = session.execute(
+            update(NotificationOutbox)
+            .where(NotificationOutbox.id == row.id, NotificationOutbox.next_attempt_at == row.next_attempt_at)
+            .values(next_attempt_at=now + timedelta(seconds=TELEGRAM_LEASE_SECONDS), attempts=NotificationOutbox.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+
+    def _finish(self, row_ids: List[int], values: Dict[str, Any]):
+        with Session(engine) as session:
+            session.execute(update(NotificationOutbox).where(NotificationOutbox.id.in_(row_ids)).values(**values))
+            session.commit()
+
+    def _claim_batch(self, now: datetime) -> List[List[NotificationOutbox]]:
+        """Claims the due rows; returns them grouped into messages (one group per send)."""
+        with Session(engine, expire_on_commit=False) as session:
+            rows = session.exec(
+                select(NotificationOutbox)
+                .where(NotificationOutbox.status == "pending", NotificationOutbox.next_attempt_at <= now)
+                .order_by(NotificationOutbox.id)
+                .limit(self.batch_size)
+            ).all()
+            claimed = [row for row in rows if self._claim(session, row, now)]
+
+            # The rest of the pending payment/deduction rows of the same chats
+            # (still inside their coalescing window) go into the same summary
+            chats = {row.chat_id for row in claimed if row.kind in COALESCIBLE_KINDS}
+            if chats:
+                claimed_ids = {row.id for row in claimed}
+                siblings = session.exec(
+                    select(NotificationOutbox)
+                    .where(
+                        NotificationOutbox.status == "pending",
+                        NotificationOutbox.chat_id.in_(chats),
+                        NotificationOutbox.kind.in_(COALESCIBLE_KINDS),
+                    )
+                    .order_by(NotificationOutbox.id)
+                ).all()
+                claimed += [row for row in siblings if row.id not in claimed_ids and self._claim(session, row, now)]
+            session.commit()
+
+        groups: List[List[NotificationOutbox]] = []
+        by_chat: Dict[str, List[NotificationOutbox]] = {}
+        for row in sorted(claimed, key=lambda r: r.id):
+            if row.kind not in COALESCIBLE_KINDS:
+                groups.append([row])
+            elif row.chat_id in by_chat:
+                by_chat[row.chat_id].append(row)
+            else:
+                by_chat[row.chat_id] = [row]
+                groups.append(by_chat[row.chat_id])
+        return groups
+
+    def dispatch_once(self) -> int:
+        """Sends the due rows (one batch); returns how many rows were attempted."""
+        token = load_settings().telegram_bot_token
+        if not token:
+            return 0
+        groups = self._claim_batch(datetime.utcnow())
+
+        for rows in groups:
+            row_ids = [row.id for row in rows]
+            text = rows[0].text if len(rows) == 1 else render_summary(rows)
+            ok, retry_after, error = self.send(token, rows[0].chat_id, text)
+            attempts = max(row.attempts for row in rows) + 1
+            if ok:
+                self.sent += 1
+                self.coalesced += len(rows) - 1
+                self._finish(row_ids, {"status": "sent", "sent_at": datetime.utcnow(), "last_error": None})
+            elif retry_after is None or attempts >= self.max_attempts:
+                self.failed += 1
+                print(f"Telegram message {row_ids} to {rows[0].chat_id} failed after {attempts} attempts: {error}")
+                self._finish(row_ids, {"status": "failed", "last_error": error})
+            else:
+                self.retried += 1
+                delay = max(retry_after, self._backoff(attempts))
+                self._finish(row_ids, {
+                    "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay),
+                    "last_error": error,
+                })
+        return sum(len(rows) for rows in groups)
+
+    # --- Thread ---
+
+    def wake(self):
+        self._wakeup.set()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="telegram-dispatcher", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                notification_digest.run_if_due()
+            except Exception as e:
+                print(f"Telegram digest error: {e}")
+            try:
+                attempted = self.dispatch_once()
+            except Exception as e:
+                print(f"Telegram dispatcher error: {e}")
+                attempted = 0
+            if attempted >= self.batch_size:
+                continue  # More rows are due
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def stop(self, timeout: float = 10.0):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        thread.join(timeout)
+        self._thread = None
+        if self._http is not None:
+            self._http.close()
+            self._http = None
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            with Session(engine) as session:
+                counts = dict(session.exec(
+                    select(NotificationOutbox.status, func.count()).group_by(NotificationOutbox.status)
+                ).all())
+        except Exception:
+            counts = {}
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "pending": counts.get("pending", 0),
+            "failed_total": counts.get("failed", 0),
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "rate_limited": self.rate_limited,
+            "coalesced": self.coalesced,
+            "held": counts.get("held", 0),
+            "digest": notification_digest.stats(),
+        }
+
+
+telegram_dispatcher = TelegramDispatcher(
+    api_url=TELEGRAM_API_URL,
+    poll_interval=TELEGRAM_POLL_INTERVAL,
+    batch_size=TELEGRAM_BATCH_SIZE,
+    max_attempts=TELEGRAM_MAX_ATTEMPTS,
+    backoff_base=TELEGRAM_BACKOFF_BASE,
+    backoff_max=TELEGRAM_BACKOFF_MAX,
+    global_rate=TELEGRAM_GLOBAL_RATE,
+    chat_rate=TELEGRAM_CHAT_RATE,
+)
+
+
+def mark_outbox_written(session):
+    session.info[_OUTBOX_WRITTEN] = True
+
+
+def _wake_after_commit(session):
+    if session.in_nested_transaction():
+        return
+    if session.info.pop(_OUTBOX_WRITTEN, None):
+        telegram_dispatcher.wake()
+
+
+def _reset_after_rollback(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop(_OUTBOX_WRITTEN, None)
+
+
+event.listen(SASession, "after_commit", _wake_after_commit)
+event.listen(SASession, "after_soft_rollback", _reset_after_rollback)
@@ -1,5 +1,9 @@
-import requests
+import json
+from datetime import datetime, timedelta
 from settings import load_settings
+from models import NotificationOutbox
+from notification_digest import TELEGRAM_COALESCE_SECONDS
+from telegram_dispatcher import telegram_dispatcher, mark_outbox_written
 import logging
 
 # Configure logging
@@ -7,13 +11,24 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class TelegramService:
-    def __init__(self):
+    def __init__(self, session=None):
+        """
+        With a session, messages go to the notification outbox and are sent
+        by the background dispatcher after that session commits. Without one
+        they are sent immediately (scripts).
+        """
         self.settings = load_settings()
         self.token = self.settings.telegram_bot_token
-        self.base_url = f"https://api.telegram.org/bot{self.token}"
+        self.session = session
 
-    def send_message(self, chat_id: str, text: str):
-        """Sends a message to a specific Telegram chat ID."""
+    def send_message(self, chat_id: str, text: str, kind: str = "message", payload=None, digest: bool = False):
+        """
+        Sends (or queues) a message to a specific Telegram chat ID.
+
+        Queued rows with a payload (kind "payment"/"deduction") wait for the
+        coalescing window and may go out as one summary; digest=True holds
+        them for the recipient's daily digest.
+        """
         if not self.token:
             logger.warning("Telegram Bot Token is not set. Skipping notification.")
             return False
@@ -22,24 +37,26 @@ class TelegramService:
             logger.warning("Telegram Chat ID is missing. Skipping notification.")
             return False
 
-        try:
-            url = f"{self.base_url}/sendMessage"
-            payload = {
-                "chat_id": chat_id,
-                "text": text,
-                "parse_mode": "HTML"
-            }
-            response = requests.post(url, json=payload, timeout=5)
-            
-            if response.status_code == 200:
-                logger.info(f"Telegram notification sent to {chat_id}")
-                return True
-            else:
-                logger.error(f"Failed to send Telegram message: {response.text}")
-                return False
-        except Exception as e:
-            logger.error(f"Error sending Telegram message: {e}")
-            return False
+        if self.session is not None:
+            row = NotificationOutbox(chat_id=str(chat_id), text=text)
+            if payload is not None:
+                row.kind = kind
+                row.payload = json.dumps(payload, ensure_ascii=False, default=str)
+                if digest:
+                    row.status = "held"
+                else:
+                    row.next_attempt_at = datetime.utcnow() + timedelta(seconds=TELEGRAM_COALESCE_SECONDS)
+            self.session.add(row)
+            if row.status == "pending":
+                mark_outbox_written(self.session)
+            return True
+
+        ok, _, error = telegram_dispatcher.send(self.token, str(chat_id), text)
+        if ok:
+            logger.info(f"Telegram notification sent to {chat_id}")
+        else:
+            logger.error(f"Failed to send Telegram message: {error}")
+        return ok
 
     def notify_order_assigned(self, order, constructor):
         """Notifier for when an order is assigned to a constructor."""
@@ -56,7 +73,7 @@ class TelegramService:
         )
         self.send_message(constructor.telegram_id, message)
 
-    def notify_payment(self, payment, allocated_amount, order_name, constructor):
+    def notify_payment(self, payment, allocated_amount, order_name, constructor, stage=None):
         """Notifier for when a payment is received."""
         if not constructor.telegram_id:
             return
@@ -68,7 +85,8 @@ class TelegramService:
             f"📅 <b>Дата:</b> {payment.date_received}\n\n"
             f"<i>Баланс оновлено.</i>"
         )
-        self.send_message(constructor.telegram_id, message)
+        payload = {"order": order_name, "stage": stage, "amount": allocated_amount, "date": payment.date_received}
+        self.send_message(constructor.telegram_id, message, "payment", payload, constructor.telegram_digest)
 
     def notify_deduction(self, deduction, order_name, recipient_user, role_label="конструктор"):
         """Notifier for when a deduction (fine) is created."""
@@ -83,4 +101,5 @@ class TelegramService:
             f"📝 <b>Причина:</b> {deduction.description}\n\n"
             f"<i>Будь ласка, будьте уважніші.</i>"
         )
-        self.send_message(recipient_user.telegram_id, message)
+        payload = {"order": order_name, "amount": deduction.amount, "description": deduction.description, "role": role_label}
+        self.send_message(recipient_user.telegram_id, message, "deduction", payload, recipient_user.telegram_digest)
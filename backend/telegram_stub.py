@@ -0,0 +1,84 @@
+"""
+Local stand-in for the Telegram Bot API, for tests and demos.
+
+Usage:
+    python telegram_stub.py --port 8081
+    TELEGRAM_API_URL=http://127.0.0.1:8081 uvicorn main:app
+
+Accepts POST /bot<token>/sendMessage and prints each message. GET /messages
+returns everything received so far as JSON; DELETE /messages clears it.
+--fail-rate, --rate-limit-every and --delay simulate an unreliable API.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(options):
+    messages = []
+    lock = threading.Lock()
+    counter = {"requests": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path != "/messages":
+                return self._reply(404, {"ok": False, "description": "Not Found"})
+            with lock:
+                return self._reply(200, list(messages))
+
+        def do_DELETE(self):
+            with lock:
+                messages.clear()
+            self._reply(200, {"ok": True})
+
+        def do_POST(self):
+            if not self.path.endswith("/sendMessage"):
+                return self._reply(404, {"ok": False, "description": "Not Found"})
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            with lock:
+                counter["requests"] += 1
+                number = counter["requests"]
+            if options.delay:
+                time.sleep(options.delay)
+            if options.rate_limit_every and number % options.rate_limit_every == 0:
+                return self._reply(429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1", "parameters": {"retry_after": 1}})
+            if random.random() < options.fail_rate:
+                return self._reply(502, {"ok": False, "error_code": 502, "description": "Bad Gateway"})
+            if not payload.get("chat_id"):
+                return self._reply(400, {"ok": False, "error_code": 400, "description": "Bad Request: chat not found"})
+            with lock:
+                messages.append({"chat_id": payload["chat_id"], "text": payload.get("text"), "received_at": time.time()})
+            if not options.quiet:
+                print(f"[{payload['chat_id']}] {payload.get('text')}\n")
+            self._reply(200, {"ok": True, "result": {"message_id": number, "chat": {"id": payload["chat_id"]}}})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with 502")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="answer every Nth request with 429")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds before each answer")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args))
+    print(f"Telegram stub listening on http://{args.host}:{args.port}")
+    server.serve_forever()
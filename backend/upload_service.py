@@ -0,0 +1,218 @@
+import hashlib
+import os
+import tempfile
+import threading
+from typing import Any, Dict, Optional
+
+from fastapi.concurrency import run_in_threadpool
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# Streaming upload for /orders/{id}/upload.
+#
+# The multipart body is parsed chunk by chunk straight from the request
+# stream (no SpooledTemporaryFile copy), the file part goes into a temp file
+# in the destination folder and is hashed on the way. Disk writes and
+# hashing run in the threadpool, so a large drawing never blocks the event
+# loop. The size limit is checked while streaming (and against
+# Content-Length before reading anything). The finished temp file is
+# renamed over the destination, so readers never see a partial file.
+#
+# UPLOAD_MAX_MB: default limit; UPLOAD_LIMITS_MB: per category overrides,
+# e.g. "Проджекти=500,Креслення=300".
+UPLOAD_FIELD = "file"
+UPLOAD_WRITE_CHUNK = int(os.environ.get("UPLOAD_WRITE_CHUNK_KB", "1024")) * 1024
+UPLOAD_MAX_MB = float(os.environ.get("UPLOAD_MAX_MB", "100"))
+DEFAULT_CATEGORY_LIMITS_MB = {"Проджекти": 500.0, "Креслення": 300.0}
+# Multipart framing around the file part (boundaries, part headers)
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+def _parse_limits(spec: str) -> Dict[str, float]:
+    limits = dict(DEFAULT_CATEGORY_LIMITS_MB)
+    for item in spec.split(","):
+        if "=" in item:
+            category, megabytes = item.split("=", 1)
+            limits[category.strip()] = float(megabytes)
+    return limits
+
+
+UPLOAD_CATEGORY_LIMITS_MB = _parse_limits(os.environ.get("UPLOAD_LIMITS_MB", ""))
+
+
+class UploadError(ValueError):
+    """Rejected upload; status_code is the HTTP status for the response."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def upload_limit(folder_category: str) -> int:
+    """Maximum file size in bytes for a project subfolder."""
+    return int(UPLOAD_CATEGORY_LIMITS_MB.get(folder_category, UPLOAD_MAX_MB) * 1024 * 1024)
+
+
+class StreamingUpload:
+    """One upload: multipart parser callbacks feeding a temp file."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.filename: Optional[str] = None
+        self.size = 0
+        self.sha256 = ""
+        self.tmp_path: Optional[str] = None
+        self._hasher = hashlib.sha256()
+        self._file = None
+        self._pending = bytearray()
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._in_file = False
+        self._done = False
+
+    # --- Parser callbacks (run on the event loop, no I/O) ---
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._in_file = False
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        if name == UPLOAD_FIELD and b"filename" in options and not self._done:
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+            self._in_file = True
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_file:
+            self._pending += data[start:end]
+            self.size += end - start
+            if self.size > self.max_bytes:
+                raise UploadError(f"File is larger than {self.max_bytes // (1024 * 1024)} MB", 413)
+
+    def _on_part_end(self):
+        if self._in_file:
+            self._in_file = False
+            self._done = True
+
+    # --- Disk (threadpool) ---
+
+    def _open(self):
+        fd, self.tmp_path = tempfile.mkstemp(prefix=".upload-", suffix=".part", dir=self.directory)
+        self._file = os.fdopen(fd, "wb")
+
+    def _write(self, data: bytes):
+        self._hasher.update(data)  # Releases the GIL for large buffers
+        self._file.write(data)
+
+    async def _flush_pending(self):
+        if self._pending:
+            data = bytes(self._pending)
+            self._pending.clear()
+            await run_in_threadpool(self._write, data)
+
+    def _cleanup(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.tmp_path is not None and os.path.exists(self.tmp_path):
+            os.unlink(self.tmp_path)
+        self.tmp_path = None
+
+    async def receive(self, request):
+        """Streams the request body into the temp file."""
+        content_type, options = parse_options_header(request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or b"boundary" not in options:
+            raise UploadError("Expected multipart/form-data")
+        length = request.headers.get("content-length")
+        if length and length.isdigit() and int(length) > self.max_bytes + MULTIPART_OVERHEAD:
+            raise UploadError(f"File is larger than {self.max_bytes // (1024 * 1024)} MB", 413)
+
+        parser = MultipartParser(options[b"boundary"], {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+        await run_in_threadpool(self._open)
+        try:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                if len(self._pending) >= UPLOAD_WRITE_CHUNK:
+                    await self._flush_pending()
+            parser.finalize()
+            await self._flush_pending()
+            if not self._done or not self.filename:
+                raise UploadError(f"Missing '{UPLOAD_FIELD}' file part")
+            await run_in_threadpool(self._file.close)
+            self._file = None
+        except Exception as e:
+            await run_in_threadpool(self._cleanup)
+            if isinstance(e, UploadError):
+                raise
+            raise UploadError(f"Malformed upload: {e}") from e
+        self.sha256 = self._hasher.hexdigest()
+
+    async def commit(self, path: str):
+        """Atomically moves the received file to path (replacing an existing one)."""
+        await run_in_threadpool(os.replace, self.tmp_path, path)
+        self.tmp_path = None
+
+    async def commit_to_store(self, store, base_path: str, path: str) -> bool:
+        """Moves the received file into the content-addressed store (see file_store.py) and links it to path."""
+        deduplicated = await run_in_threadpool(store.store, base_path, self.tmp_path, self.sha256, path)
+        self.tmp_path = None
+        return deduplicated
+
+    async def discard(self):
+        await run_in_threadpool(self._cleanup)
+
+
+class UploadStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.rejected = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def record(self, size: int, seconds: float):
+        with self._lock:
+            self.uploads += 1
+            self.bytes += size
+            self.seconds += seconds
+
+    def record_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "uploads": self.uploads,
+                "rejected": self.rejected,
+                "bytes": self.bytes,
+                "avg_mb_per_s": (self.bytes / self.seconds / (1024 * 1024)) if self.seconds else 0.0,
+                "default_limit_mb": UPLOAD_MAX_MB,
+                "category_limits_mb": UPLOAD_CATEGORY_LIMITS_MB,
+            }
+
+
+upload_stats = UploadStats()
@@ -25,6 +25,12 @@ export const getOrders = async (params = {}) => {
     return response.data;
 };
 
+// One page of orders; pass nextCursor back as params.cursor for the next page
+export const getOrdersPage = async (params = {}) => {
+    const response = await api.get('/orders/', { params });
+    return { items: response.data, nextCursor: response.headers['x-next-cursor'] || null };
+};
+
 export const getUsers = async () => {
     const response = await api.get('/users');
     return response.data;
@@ -113,8 +119,9 @@ export const getFinancialStats = async () => {
     return response.data;
 };
 
-export const getLogs = async () => {
-    const response = await api.get('/logs');
+// params: limit, before_id (older page), after_id (only newer rows), action_type, date_from, date_to
+export const getLogs = async (params = {}) => {
+    const response = await api.get('/logs', { params });
     return response.data;
 };
 
@@ -128,7 +135,30 @@ export const updateSettings = async (settings) => {
     return response.data;
 };
 
+// Hash-first upload: browsers hash files up to this size before sending them
+const HASH_FIRST_MAX_BYTES = 200 * 1024 * 1024;
+
+const sha256Hex = async (file) => {
+    // crypto.subtle exists only on https / localhost
+    if (!window.crypto?.subtle || file.size > HASH_FIRST_MAX_BYTES) return null;
+    const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+};
+
 export const uploadFile = async (orderId, folderCategory, file) => {
+    // The server links content it already stores instead of receiving it again
+    const contentHash = await sha256Hex(file).catch(() => null);
+    if (contentHash) {
+        try {
+            const response = await api.post(`/orders/${orderId}/upload/by-hash`,
+                { filename: file.name, content_hash: contentHash },
+                { params: { folder_category: folderCategory } });
+            return response.data;
+        } catch (err) {
+            if (err.response?.status !== 404) throw err;
+        }
+    }
+
     const formData = new FormData();
     formData.append('file', file);
     const response = await api.post(`/orders/${orderId}/upload`, formData, {
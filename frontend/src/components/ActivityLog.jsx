@@ -1,24 +1,80 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import { getLogs } from '../api';
 
+const LOGS_PAGE_SIZE = 100;
+
+const ACTION_FILTERS = [
+    { value: '', label: 'Усі події' },
+    { value: 'CREATE_ORDER', label: 'Нові замовлення' },
+    { value: 'ADD_PAYMENT', label: 'Надходження коштів' },
+    { value: 'ADD_DEDUCTION', label: 'Штрафи' },
+    { value: 'DELETE_ORDER', label: 'Видалення замовлень' },
+    { value: 'DELETE_DEDUCTION', label: 'Видалення штрафів' },
+];
+
 const ActivityLog = () => {
     const [logs, setLogs] = useState([]);
+    const [actionFilter, setActionFilter] = useState('');
+    const [hasMore, setHasMore] = useState(false);
+    const logsRef = useRef([]);
+
+    const filterParams = () => (actionFilter ? { action_type: actionFilter } : {});
+
+    const applyLogs = (nextLogs) => {
+        logsRef.current = nextLogs;
+        setLogs(nextLogs);
+    };
 
+    // Full first page (initial load, filter change, manual refresh)
     const fetchLogs = async () => {
         try {
-            const data = await getLogs();
-            setLogs(data);
+            const data = await getLogs({ ...filterParams(), limit: LOGS_PAGE_SIZE });
+            applyLogs(data);
+            setHasMore(data.length === LOGS_PAGE_SIZE);
         } catch (error) {
             console.error("Failed to fetch logs:", error);
         }
     };
 
+    // Poll: only rows newer than the newest one we already have
+    const fetchNewLogs = async () => {
+        const current = logsRef.current;
+        if (current.length === 0) {
+            return fetchLogs();
+        }
+        try {
+            const lastId = Math.max(...current.map(log => log.id));
+            const data = await getLogs({ ...filterParams(), after_id: lastId, limit: LOGS_PAGE_SIZE });
+            if (data.length === LOGS_PAGE_SIZE) {
+                // Too many new rows to merge, reload the first page
+                return fetchLogs();
+            }
+            if (data.length > 0) {
+                applyLogs([...data, ...current]);
+            }
+        } catch (error) {
+            console.error("Failed to fetch new logs:", error);
+        }
+    };
+
+    const loadMoreLogs = async () => {
+        const current = logsRef.current;
+        if (current.length === 0) return;
+        try {
+            const data = await getLogs({ ...filterParams(), before_id: current[current.length - 1].id, limit: LOGS_PAGE_SIZE });
+            applyLogs([...current, ...data]);
+            setHasMore(data.length === LOGS_PAGE_SIZE);
+        } catch (error) {
+            console.error("Failed to load more logs:", error);
+        }
+    };
+
     useEffect(() => {
         fetchLogs();
-        // Auto-refresh every 30 seconds
-        const interval = setInterval(fetchLogs, 30000);
+        // Auto-refresh every 30 seconds (incremental)
+        const interval = setInterval(fetchNewLogs, 30000);
         return () => clearInterval(interval);
-    }, []);
+    }, [actionFilter]);
 
     const getActionConfig = (action) => {
         switch (action) {
@@ -70,13 +126,24 @@ const ActivityLog = () => {
                     </span>
                     Історія дій
                 </h2>
-                <button
-                    onClick={fetchLogs}
-                    className="p-2 bg-slate-100 rounded-full hover:bg-slate-200 transition text-slate-500"
-                    title="Оновити"
-                >
-                    <i className="fas fa-sync-alt"></i>
-                </button>
+                <div className="flex items-center gap-3">
+                    <select
+                        value={actionFilter}
+                        onChange={(e) => setActionFilter(e.target.value)}
+                        className="px-3 py-2 bg-slate-100 rounded-xl text-sm font-bold text-slate-600 outline-none"
+                    >
+                        {ACTION_FILTERS.map(option => (
+                            <option key={option.value} value={option.value}>{option.label}</option>
+                        ))}
+                    </select>
+                    <button
+                        onClick={fetchLogs}
+                        className="p-2 bg-slate-100 rounded-full hover:bg-slate-200 transition text-slate-500"
+                        title="Оновити"
+                    >
+                        <i className="fas fa-sync-alt"></i>
+                    </button>
+                </div>
             </div>
 
             <div className="overflow-x-auto">
@@ -125,6 +192,17 @@ const ActivityLog = () => {
                     </tbody>
                 </table>
             </div>
+
+            {hasMore && (
+                <div className="text-center mt-6">
+                    <button
+                        onClick={loadMoreLogs}
+                        className="px-6 py-2 rounded-xl font-bold text-sm bg-slate-100 text-slate-600 hover:bg-slate-200 transition"
+                    >
+                        Показати ще
+                    </button>
+                </div>
+            )}
         </div>
     );
 };
@@ -1,5 +1,5 @@
 import React, { useEffect, useState } from 'react';
-import { getOrders, createOrder, getDeductions, updateOrder, getUsers, api } from '../api';
+import { getOrdersPage, createOrder, getDeductions, updateOrder, getUsers, api } from '../api';
 import PaymentModal from './PaymentModal';
 import SettingsModal from './SettingsModal';
 import CalendarView from './CalendarView';
@@ -8,6 +8,8 @@ import { useAuth } from '../context/AuthContext';
 import UKDatePicker from './UKDatePicker';
 
 
+const ORDERS_PAGE_SIZE = 200;
+
 const CreateOrderModal = ({ isOpen, onClose, onSave }) => {
     const { user } = useAuth();
     const isAdmin = user?.role === 'admin' || user?.role === 'super_admin';
@@ -341,6 +343,8 @@ const CreateOrderModal = ({ isOpen, onClose, onSave }) => {
 
 const OrderList = ({ onSelectOrder, onPaymentAdded, refreshTrigger }) => {
     const [orders, setOrders] = useState([]);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [isLoadingMore, setIsLoadingMore] = useState(false);
     const [deductions, setDeductions] = useState([]);
     const [isModalOpen, setIsModalOpen] = useState(false);
     const [isPaymentModalOpen, setIsPaymentModalOpen] = useState(false);
@@ -408,24 +412,55 @@ const OrderList = ({ onSelectOrder, onPaymentAdded, refreshTrigger }) => {
         }
     }, [canManage]);
 
+    // Archive tab and constructor filter are applied on the server
+    const buildOrderParams = () => {
+        const params = {
+            sort_by: sortBy,
+            sort_order: sortOrder,
+            limit: ORDERS_PAGE_SIZE,
+            archived: viewMode === 'archived',
+        };
+        if (filterConstructorId === 'unassigned') {
+            params.unassigned = true;
+        } else if (filterConstructorId) {
+            params.constructor_id = parseInt(filterConstructorId);
+        }
+        return params;
+    };
+
     const fetchOrders = async () => {
         try {
-            const [ordersData, deductionsData] = await Promise.all([
-                getOrders({ sort_by: sortBy, sort_order: sortOrder, limit: 1000 }), // Increase limit to avoid missing data
+            const [ordersPage, deductionsData] = await Promise.all([
+                getOrdersPage(buildOrderParams()),
                 getDeductions()
             ]);
-            setOrders(ordersData);
+            setOrders(ordersPage.items);
+            setNextCursor(ordersPage.nextCursor);
             setDeductions(deductionsData);
         } catch (error) {
             console.error("Failed to fetch data:", error);
         }
     };
 
+    const loadMoreOrders = async () => {
+        if (!nextCursor || isLoadingMore) return;
+        setIsLoadingMore(true);
+        try {
+            const ordersPage = await getOrdersPage({ ...buildOrderParams(), cursor: nextCursor });
+            setOrders(prev => [...prev, ...ordersPage.items]);
+            setNextCursor(ordersPage.nextCursor);
+        } catch (error) {
+            console.error("Failed to load more orders:", error);
+        } finally {
+            setIsLoadingMore(false);
+        }
+    };
+
     useEffect(() => {
         if (user) {
             fetchOrders();
         }
-    }, [refreshTrigger, user, sortBy, sortOrder]); // Re-fetch when sort changes
+    }, [refreshTrigger, user, sortBy, sortOrder, viewMode, filterConstructorId]); // Re-fetch when sort/filters change
 
     const handleCreate = async (newOrder) => {
         try {
@@ -503,24 +538,12 @@ const OrderList = ({ onSelectOrder, onPaymentAdded, refreshTrigger }) => {
         }
     };
 
-    // Filter orders by completion status and search query
+    // Search over the loaded orders (archive/constructor filters come from the server)
     const filteredOrders = orders.filter(order => {
-        const isCompleted = !!order.date_final_paid || (!!order.date_installation && order.remainder_amount <= 0.01);
-
-
-        // Filter by view mode
-        const matchesViewMode = viewMode === 'active' ? !isCompleted : isCompleted;
-
-        // Filter by search query
-        const matchesSearch = searchQuery === '' ||
+        return searchQuery === '' ||
             order.id.toString().includes(searchQuery) ||
             order.name.toLowerCase().includes(searchQuery.toLowerCase()) ||
             (order.product_types && order.product_types.toLowerCase().includes(searchQuery.toLowerCase()));
-
-        const matchesConstructor = !filterConstructorId ||
-            (filterConstructorId === 'unassigned' ? !order.constructor_id : order.constructor_id === parseInt(filterConstructorId));
-
-        return matchesViewMode && matchesSearch && matchesConstructor;
     }); // Server-side sorting is used now
 
     return (
@@ -1195,6 +1218,18 @@ const OrderList = ({ onSelectOrder, onPaymentAdded, refreshTrigger }) => {
                 </div>
             )}
 
+            {nextCursor && (
+                <div className="text-center mt-6">
+                    <button
+                        onClick={loadMoreOrders}
+                        disabled={isLoadingMore}
+                        className="px-6 py-2 rounded-xl font-bold text-sm bg-white/60 text-slate-600 hover:bg-white transition disabled:opacity-50"
+                    >
+                        {isLoadingMore ? 'Завантаження...' : 'Показати ще'}
+                    </button>
+                </div>
+            )}
+
             {viewLayout !== 'calendar' && viewLayout !== 'gantt' && filteredOrders.length === 0 && (
                 <div className="text-center py-20">
                     <div className="inline-block p-6 rounded-full bg-slate-50 mb-4">
@@ -127,7 +127,7 @@ const SettingsModal = ({ onClose }) => {
                                                     const url = window.URL.createObjectURL(blob);
                                                     const a = document.createElement('a');
                                                     a.href = url;
-                                                    a.download = `backup_${new Date().toISOString().slice(0, 10)}.json`;
+                                                    a.download = `backup_${new Date().toISOString().slice(0, 10)}.json.gz`;
                                                     document.body.appendChild(a);
                                                     a.click();
                                                     window.URL.revokeObjectURL(url);
@@ -136,7 +136,7 @@ const SettingsModal = ({ onClose }) => {
                                         }}
                                         className="w-full py-2 bg-white border border-amber-300 text-amber-700 font-bold rounded-lg hover:bg-amber-100 transition flex items-center justify-center gap-2 text-xs uppercase"
                                     >
-                                        <span className="text-lg">📥</span> Скачати базу даних (JSON)
+                                        <span className="text-lg">📥</span> Скачати базу даних (JSON.GZ)
                                     </button>
 
                                     <div className="mt-4 pt-4 border-t border-amber-200">
@@ -149,7 +149,7 @@ const SettingsModal = ({ onClose }) => {
                                                 <span className="text-lg">♻️</span> Завантажити Backup файл
                                                 <input
                                                     type="file"
-                                                    accept=".json"
+                                                    accept=".json,.gz"
                                                     className="hidden"
                                                     onChange={async (e) => {
                                                         const file = e.target.files[0];
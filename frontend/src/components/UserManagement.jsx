@@ -18,6 +18,7 @@ const UserManagement = ({ onBack }) => {
         email: '',
         phone_number: '',
         telegram_id: '',
+        telegram_digest: false,
         salary_mode: 'sales_percent',
         salary_percent: 5.0,
         payment_stage1_percent: 50.0,
@@ -58,6 +59,7 @@ const UserManagement = ({ onBack }) => {
             email: '',
             phone_number: '',
             telegram_id: '',
+            telegram_digest: false,
             salary_mode: 'sales_percent',
             salary_percent: 5.0,
             payment_stage1_percent: 50.0,
@@ -84,6 +86,7 @@ const UserManagement = ({ onBack }) => {
             email: u.email || '',
             phone_number: u.phone_number || '',
             telegram_id: u.telegram_id || '',
+            telegram_digest: !!u.telegram_digest,
             salary_mode: u.salary_mode || 'sales_percent',
             salary_percent: u.salary_percent !== undefined ? u.salary_percent : 5.0,
             payment_stage1_percent: u.payment_stage1_percent !== undefined ? u.payment_stage1_percent : 50.0,
@@ -272,6 +275,15 @@ const UserManagement = ({ onBack }) => {
                                     placeholder="123456789"
                                 />
                                 <p className="text-[10px] text-slate-400 mt-1">* Можна дізнатися у бота @userinfobot</p>
+                                <label className="flex items-center gap-2 mt-2 cursor-pointer">
+                                    <input
+                                        type="checkbox"
+                                        checked={formData.telegram_digest}
+                                        onChange={(e) => setFormData({ ...formData, telegram_digest: e.target.checked })}
+                                        className="w-4 h-4 text-blue-600 rounded focus:ring-2 focus:ring-blue-500"
+                                    />
+                                    <span className="text-xs font-bold text-slate-600">Оплати та штрафи — одним підсумком раз на день</span>
+                                </label>
                             </div>
 
                             {/* Salary Configuration */}
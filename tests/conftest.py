@@ -0,0 +1,48 @@
+"""
+Shared setup of the backend pytest suite: the backend reads its
+configuration at import time, so the temp database, settings file and
+storage folder are set here, before any test module imports it.
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+
+WORK_DIR = tempfile.mkdtemp(prefix="backend-tests-")
+atexit.register(shutil.rmtree, WORK_DIR, ignore_errors=True)
+os.environ.pop("DATABASE_URL", None)
+os.environ["SQLITE_FILE_NAME"] = os.path.join(WORK_DIR, "tests.db")
+os.environ["SETTINGS_FILE"] = os.path.join(WORK_DIR, "settings.json")
+os.environ["STORAGE_PATH"] = os.path.join(WORK_DIR, "storage")
+os.environ["TELEGRAM_DISPATCHER"] = "off"
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture(scope="session")
+def api():
+    """Admin TestClient (startup runs the migrations) and the ids of a few orders."""
+    from fastapi.testclient import TestClient
+    import main
+
+    with TestClient(main.app) as client:
+        token = client.post("/token", data={"username": "admin", "password": "admin"}).json()["access_token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+        user = client.post("/users", json={"username": "smoke_c1", "password": "p", "full_name": "Smoke Constructor", "role": "constructor"})
+        assert user.status_code == 200, user.text
+        order_ids = []
+        for i in range(7):
+            response = client.post("/orders/", json={
+                "name": f"Smoke {i}",
+                "price": 10000 + (i % 3) * 1000,  # Repeated prices: paging must break ties by id
+                "constructor_id": user.json()["id"],
+                "date_received": "2026-01-0%d" % (1 + i),
+            })
+            assert response.status_code == 200, response.text
+            order_ids.append(response.json()["id"])
+        yield client, order_ids
@@ -0,0 +1,37 @@
+"""
+The hot queries of check_indexes.HOT_QUERIES use their indexes on a freshly
+migrated database (EXPLAIN QUERY PLAN on SQLite, EXPLAIN on Postgres).
+"""
+import pytest
+
+
+@pytest.fixture(scope="module")
+def session():
+    from sqlmodel import Session
+    from database import engine
+    from migrate_auth import migrate
+
+    migrate()
+    with Session(engine) as session:
+        yield session
+        session.rollback()
+
+
+def _hot_queries():
+    from check_indexes import HOT_QUERIES
+    return HOT_QUERIES
+
+
+@pytest.mark.parametrize("description, sql, index_name", _hot_queries(), ids=[query[0] for query in _hot_queries()])
+def test_hot_query_uses_index(session, description, sql, index_name):
+    from check_indexes import explain
+
+    plan = explain(session, sql)
+    assert index_name in plan, f"{description}: expected {index_name}\n{plan}"
+
+
+def test_check_indexes_reports_ok(session, capsys):
+    from check_indexes import check_indexes
+
+    assert check_indexes()
+    assert "FAIL" not in capsys.readouterr().out
@@ -0,0 +1,102 @@
+"""
+Content-addressed upload store (file_store.py): identical uploads share one
+read-only blob, changed files get their own, GC deletes unreferenced blobs.
+"""
+import hashlib
+import os
+import stat
+
+import pytest
+
+
+@pytest.fixture
+def store(api):
+    from file_store import file_store
+    from settings import load_settings
+
+    link_mode, grace_seconds = file_store.link_mode, file_store.grace_seconds
+    yield file_store, load_settings().storage_path
+    file_store.link_mode, file_store.grace_seconds = link_mode, grace_seconds
+
+
+def _upload(client, order_id, name, body, category="Фурнітура"):
+    response = client.post(f"/orders/{order_id}/upload", params={"folder_category": category}, files={"file": (name, body)})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _folder_file(client, storage, order_id, category, name):
+    from file_utils import get_file_path
+
+    return get_file_path(client.get(f"/orders/{order_id}").json()["name"], category, name, storage)
+
+
+def _writable(path):
+    return bool(stat.S_IMODE(os.stat(path).st_mode) & 0o222)
+
+
+def test_upload_dedup_and_gc(api, store):
+    client, order_ids = api
+    file_store, storage = store
+    data = os.urandom(256 * 1024)
+    content_hash = hashlib.sha256(data).hexdigest()
+
+    first = _upload(client, order_ids[0], "catalog.pdf", data)
+    second = _upload(client, order_ids[1], "catalog.pdf", data)
+    assert first["content_hash"] == content_hash
+    blob = file_store.blob_path(storage, content_hash)
+    assert os.stat(blob).st_nlink == 3  # The blob and two folder links
+    assert not _writable(blob)  # Shared by both orders: no in-place edits
+    assert client.get(second["url"].replace("/api", "")).content == data
+
+    # Hash-first upload links the stored content without a body
+    response = client.post(f"/orders/{order_ids[2]}/upload/by-hash", params={"folder_category": "Метал"},
+                           json={"filename": "copy.pdf", "content_hash": content_hash})
+    assert response.status_code == 200, response.text
+
+    # Referenced blobs survive GC
+    file_store.grace_seconds = 0
+    assert client.post("/admin/files/gc", params={"dry_run": False}).json()["deleted"] == 0
+    for order_id in order_ids[:3]:
+        for row in client.get(f"/orders/{order_id}/files").json():
+            assert client.delete(f"/files/{row['id']}").status_code == 200
+    result = client.post("/admin/files/gc", params={"dry_run": False, "prune_links": True}).json()
+    assert result["deleted"] == 1
+    assert not os.path.exists(blob)
+
+
+def test_changed_upload_breaks_only_its_own_link(api, store):
+    client, order_ids = api
+    file_store, storage = store
+    old, new = b"fittings v1" * 1000, b"fittings v2" * 1000
+
+    _upload(client, order_ids[3], "fittings.pdf", old)
+    _upload(client, order_ids[4], "fittings.pdf", old)
+    path3 = _folder_file(client, storage, order_ids[3], "Фурнітура", "fittings.pdf")
+    path4 = _folder_file(client, storage, order_ids[4], "Фурнітура", "fittings.pdf")
+    assert os.path.samefile(path3, path4)
+
+    # New version uploaded to one order: the other keeps the old content
+    _upload(client, order_ids[3], "fittings.pdf", new)
+    assert not os.path.samefile(path3, path4)
+    assert open(path3, "rb").read() == new
+    assert open(path4, "rb").read() == old
+    assert open(file_store.blob_path(storage, hashlib.sha256(old).hexdigest()), "rb").read() == old
+
+
+def test_copy_mode_gives_private_writable_files(api, store):
+    client, order_ids = api
+    file_store, storage = store
+    file_store.link_mode = "copy"
+    data = b"price list" * 1000
+    blob = file_store.blob_path(storage, hashlib.sha256(data).hexdigest())
+
+    _upload(client, order_ids[5], "prices.pdf", data)
+    _upload(client, order_ids[6], "prices.pdf", data)
+    path = _folder_file(client, storage, order_ids[5], "Фурнітура", "prices.pdf")
+    assert _writable(path) and not _writable(blob)
+    assert os.stat(blob).st_nlink == 1
+    with open(path, "r+b") as f:
+        f.write(b"EDITED")
+    assert open(blob, "rb").read() == data
+    assert open(_folder_file(client, storage, order_ids[6], "Фурнітура", "prices.pdf"), "rb").read() == data
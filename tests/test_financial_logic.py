@@ -0,0 +1,35 @@
+"""
+Unpaid-deduction sums on a database without deduction.target_role: the
+legacy fallback runs inside the caller's transaction without losing it.
+"""
+from sqlalchemy import create_engine, event, text
+from sqlmodel import Session
+
+
+def test_legacy_fallback_keeps_the_transaction(tmp_path):
+    from financial_logic import _sum_unpaid_deductions_for_target, sum_unpaid_deductions_by_order
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE deduction (id INTEGER PRIMARY KEY, order_id INTEGER, amount FLOAT, is_paid BOOLEAN)"))
+        connection.execute(text("CREATE TABLE note (id INTEGER PRIMARY KEY, body TEXT)"))
+        connection.execute(text("INSERT INTO deduction (order_id, amount, is_paid) VALUES (1, 100, 0), (1, 50, 1), (2, 30, 0)"))
+    savepoint_rollbacks = []
+    event.listen(engine, "rollback_savepoint", lambda *args: savepoint_rollbacks.append(args[1]))
+
+    with Session(engine) as session:
+        # A write of the same unit of work, made before the sums are read
+        session.execute(text("INSERT INTO note (body) VALUES ('pending')"))
+        totals = sum_unpaid_deductions_by_order(session, [1, 2, 3])
+        assert totals == {
+            1: {"constructor": 100.0, "manager": 0.0},
+            2: {"constructor": 30.0, "manager": 0.0},
+            3: {"constructor": 0.0, "manager": 0.0},
+        }
+        assert _sum_unpaid_deductions_for_target(session, 2, "constructor") == 30.0
+        # Only the failed statements were undone (Postgres would abort the whole transaction)
+        assert len(savepoint_rollbacks) == 2
+        session.commit()
+
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT body FROM note")).scalars().all() == ["pending"]
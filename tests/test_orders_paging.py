@@ -0,0 +1,34 @@
+"""
+Keyset pagination of GET /orders/: following X-Next-Cursor gives the same
+orders as one unpaged request, for every sort.
+"""
+import pytest
+
+
+def _pages(client, params, limit):
+    ids, cursor = [], None
+    while True:
+        response = client.get("/orders/", params=dict(params, limit=limit, **({"cursor": cursor} if cursor else {})))
+        assert response.status_code == 200, response.text
+        assert len(response.json()) <= limit
+        ids += [order["id"] for order in response.json()]
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            return ids
+
+
+@pytest.mark.parametrize("sort_by", ["id", "name", "price", "date_received"])
+@pytest.mark.parametrize("sort_order", ["asc", "desc"])
+def test_keyset_paging_matches_full_list(api, sort_by, sort_order):
+    client, _ = api
+    params = {"sort_by": sort_by, "sort_order": sort_order}
+    full = [order["id"] for order in client.get("/orders/", params=dict(params, limit=1000)).json()]
+    assert _pages(client, params, limit=3) == full
+
+
+def test_keyset_paging_rejects_bad_cursor(api):
+    client, _ = api
+    assert client.get("/orders/", params={"cursor": "zzz"}).status_code == 400
+    first = client.get("/orders/", params={"limit": 2, "sort_by": "price"})
+    # A cursor is only valid for the sort it was issued for
+    assert client.get("/orders/", params={"cursor": first.headers["x-next-cursor"], "sort_by": "name"}).status_code == 400
@@ -0,0 +1,25 @@
+"""
+/admin/restore rejects truncated or corrupt backups with 400 and leaves the
+data untouched.
+"""
+import gzip
+
+
+def test_restore_rejects_damaged_archives(api):
+    client, order_ids = api
+    backup = client.get("/admin/backup").content
+    assert backup[:2] == b"\x1f\x8b"
+    damaged = {
+        "truncated gz": backup[: len(backup) // 2],
+        "corrupt gz": backup[:10] + b"\x00" * 40 + backup[50:],
+        "not utf-8": gzip.compress(b'{"version": "\xff\xfe"}'),
+        "truncated json": b'{"data": {"users": [',
+        "invalid json": b'{"data": {"users": [{"id": 1,,}]}}',
+    }
+    for name, body in damaged.items():
+        response = client.post("/admin/restore", files={"file": ("backup.json.gz", body)})
+        assert response.status_code == 400, (name, response.text)
+    # Nothing was wiped, and the intact backup still restores
+    assert len(client.get("/orders/", params={"limit": 1000}).json()) == len(order_ids)
+    response = client.post("/admin/restore", files={"file": ("backup.json.gz", backup)})
+    assert response.status_code == 200, response.text
@@ -0,0 +1,135 @@
+"""
+Upgrade of a database created by the pre-registry code (no schema_migrations,
+no order_financials, no later columns) to the latest schema version.
+
+Runs migrate_auth.migrate() in a subprocess: the backend binds its engine to
+SQLITE_FILE_NAME at import time.
+"""
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+
+# Tables as create_all() of the baseline models built them
+BASELINE_DDL = """
+CREATE TABLE user (
+    id INTEGER NOT NULL, username VARCHAR NOT NULL, password_hash VARCHAR NOT NULL,
+    full_name VARCHAR NOT NULL, role VARCHAR NOT NULL, is_active BOOLEAN NOT NULL,
+    card_number VARCHAR, email VARCHAR, phone_number VARCHAR, telegram_id VARCHAR,
+    salary_mode VARCHAR NOT NULL, salary_percent FLOAT NOT NULL,
+    payment_stage1_percent FLOAT NOT NULL, payment_stage2_percent FLOAT NOT NULL,
+    can_see_constructor_pay BOOLEAN NOT NULL, can_see_stage1 BOOLEAN NOT NULL,
+    can_see_stage2 BOOLEAN NOT NULL, can_see_debt BOOLEAN NOT NULL, can_see_dashboard BOOLEAN NOT NULL,
+    PRIMARY KEY (id)
+);
+CREATE UNIQUE INDEX ix_user_username ON user (username);
+CREATE TABLE activitylog (
+    id INTEGER NOT NULL, timestamp DATE NOT NULL, action_type VARCHAR NOT NULL,
+    description VARCHAR NOT NULL, details VARCHAR, PRIMARY KEY (id)
+);
+CREATE TABLE "order" (
+    name VARCHAR NOT NULL, price FLOAT NOT NULL, material_cost FLOAT NOT NULL, product_types VARCHAR,
+    date_received DATE, date_manager_handover DATE, date_design_deadline DATE, date_to_work DATE,
+    date_advance_paid DATE, date_installation DATE, date_final_paid DATE,
+    advance_paid_amount FLOAT NOT NULL, final_paid_amount FLOAT NOT NULL,
+    constructor_id INTEGER, manager_id INTEGER, fixed_bonus FLOAT,
+    custom_stage1_percent FLOAT, custom_stage2_percent FLOAT, date_installation_plan DATE,
+    constructive_days INTEGER NOT NULL, complectation_days INTEGER NOT NULL,
+    preassembly_days INTEGER NOT NULL, installation_days INTEGER NOT NULL,
+    constructive_start_date DATE, constructive_end_date DATE, complectation_start_date DATE,
+    complectation_end_date DATE, preassembly_start_date DATE, preassembly_end_date DATE,
+    installation_start_date DATE, installation_end_date DATE,
+    manager_paid_amount FLOAT NOT NULL, date_manager_paid DATE, id INTEGER NOT NULL,
+    PRIMARY KEY (id),
+    FOREIGN KEY(constructor_id) REFERENCES user (id), FOREIGN KEY(manager_id) REFERENCES user (id)
+);
+CREATE INDEX ix_order_name ON "order" (name);
+CREATE TABLE deduction (
+    id INTEGER NOT NULL, order_id INTEGER NOT NULL, amount FLOAT NOT NULL, description VARCHAR NOT NULL,
+    target_role VARCHAR NOT NULL, date_created DATE NOT NULL, is_paid BOOLEAN NOT NULL, date_paid DATE,
+    PRIMARY KEY (id), FOREIGN KEY(order_id) REFERENCES "order" (id)
+);
+CREATE TABLE orderfile (
+    id INTEGER NOT NULL, order_id INTEGER NOT NULL, name VARCHAR NOT NULL, url VARCHAR NOT NULL,
+    folder_name VARCHAR NOT NULL, upload_date DATE NOT NULL,
+    PRIMARY KEY (id), FOREIGN KEY(order_id) REFERENCES "order" (id)
+);
+CREATE TABLE payment (
+    id INTEGER NOT NULL, amount FLOAT NOT NULL, date_received DATE NOT NULL, created_at DATETIME NOT NULL,
+    allocated_automatically BOOLEAN NOT NULL, manual_order_id INTEGER, constructor_id INTEGER,
+    manager_id INTEGER, notes VARCHAR,
+    PRIMARY KEY (id), FOREIGN KEY(manual_order_id) REFERENCES "order" (id),
+    FOREIGN KEY(constructor_id) REFERENCES user (id), FOREIGN KEY(manager_id) REFERENCES user (id)
+);
+CREATE TABLE paymentallocation (
+    id INTEGER NOT NULL, payment_id INTEGER NOT NULL, order_id INTEGER NOT NULL, stage VARCHAR NOT NULL,
+    amount FLOAT NOT NULL, created_at DATETIME NOT NULL,
+    PRIMARY KEY (id), FOREIGN KEY(payment_id) REFERENCES payment (id), FOREIGN KEY(order_id) REFERENCES "order" (id)
+);
+"""
+
+BASELINE_ROWS = """
+INSERT INTO user VALUES (1, 'admin', 'x', 'Administrator', 'admin', 1, NULL, NULL, NULL, NULL,
+    'sales_percent', 5.0, 50.0, 50.0, 1, 1, 1, 1, 1);
+INSERT INTO user VALUES (2, 'c1', 'x', 'Constructor One', 'constructor', 1, NULL, NULL, NULL, NULL,
+    'sales_percent', 5.0, 50.0, 50.0, 1, 1, 1, 1, 1);
+INSERT INTO "order" (id, name, price, material_cost, advance_paid_amount, final_paid_amount, constructor_id,
+    constructive_days, complectation_days, preassembly_days, installation_days, manager_paid_amount, date_to_work)
+VALUES (1, 'Kitchen 1', 10000, 3000, 0, 0, 2, 5, 2, 1, 3, 0, '2026-01-10'),
+       (2, 'Kitchen 2', 20000, 5000, 0, 0, 2, 5, 2, 1, 3, 0, NULL);
+INSERT INTO deduction VALUES (1, 1, 100, 'late', 'constructor', '2026-01-15', 0, NULL);
+INSERT INTO payment VALUES (1, 200, '2026-01-20', '2026-01-20 10:00:00', 1, NULL, 2, NULL, NULL);
+INSERT INTO paymentallocation VALUES (1, 1, 1, 'advance', 200, '2026-01-20 10:00:00');
+INSERT INTO orderfile VALUES (1, 1, 'plan.pdf', '/api/download/1/x/plan.pdf', 'x', '2026-01-11');
+"""
+
+MIGRATE = """
+import json, sqlite3, sys
+from migrate_auth import migrate
+from schema_migrations import LATEST_VERSION
+migrate()
+db = sqlite3.connect(sys.argv[1])
+columns = lambda table: [row[1] for row in db.execute(f'PRAGMA table_info("{table}")')]
+print(json.dumps({
+    "latest": LATEST_VERSION,
+    "versions": [row[0] for row in db.execute("SELECT version FROM schema_migrations ORDER BY version")],
+    "fingerprint": db.execute("SELECT COUNT(*) FROM schema_state").fetchone()[0],
+    "financials": [row[0] for row in db.execute("SELECT order_id FROM order_financials ORDER BY order_id")],
+    "user_columns": columns("user"),
+    "orderfile_columns": columns("orderfile"),
+    "admin_role": db.execute("SELECT role FROM user WHERE username = 'admin'").fetchone()[0],
+    "allocated_total": db.execute("SELECT allocated_total FROM payment WHERE id = 1").fetchone()[0],
+}))
+"""
+
+
+def _migrate(db_path, tmp_path):
+    env = dict(os.environ, SQLITE_FILE_NAME=str(db_path), SETTINGS_FILE=str(tmp_path / "settings.json"))
+    env.pop("DATABASE_URL", None)
+    result = subprocess.run([sys.executable, "-c", MIGRATE, str(db_path)], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+    assert "failed" not in result.stderr.lower(), result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_baseline_database_upgrades_to_latest(tmp_path):
+    db_path = tmp_path / "baseline.db"
+    db = sqlite3.connect(db_path)
+    db.executescript(BASELINE_DDL + BASELINE_ROWS)
+    db.close()
+
+    state = _migrate(db_path, tmp_path)
+    assert state["versions"] == list(range(1, state["latest"] + 1))
+    assert state["fingerprint"] == 1
+    assert state["financials"] == [1, 2]  # Backfilled after the user/order columns were added
+    assert "telegram_digest" in state["user_columns"]
+    assert {"size", "content_hash"} <= set(state["orderfile_columns"])
+    assert state["admin_role"] == "super_admin"
+    assert state["allocated_total"] == 200
+
+    # Second start takes the fast path and changes nothing
+    assert _migrate(db_path, tmp_path) == state
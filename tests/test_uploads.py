@@ -0,0 +1,27 @@
+"""
+Streaming upload (/orders/{id}/upload): no database connection is held
+while the body is received.
+"""
+
+
+def test_upload_holds_no_connection_while_streaming(api, monkeypatch):
+    import upload_service
+    from database import engine
+
+    client, order_ids = api
+    checked_out = []
+    receive = upload_service.StreamingUpload.receive
+
+    async def counting_receive(self, request):
+        checked_out.append(engine.pool.checkedout())
+        return await receive(self, request)
+
+    monkeypatch.setattr(upload_service.StreamingUpload, "receive", counting_receive)
+    response = client.post(f"/orders/{order_ids[0]}/upload", params={"folder_category": "Метал"},
+                           files={"file": ("drawing.bin", b"x" * 4096)})
+    assert response.status_code == 200, response.text
+    assert checked_out == [0]
+    assert response.json()["size"] == 4096
+
+    missing = client.post("/orders/999999/upload", params={"folder_category": "Метал"}, files={"file": ("a.bin", b"x")})
+    assert missing.status_code == 404